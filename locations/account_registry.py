@@ -0,0 +1,357 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+# One local record per Instagram account (keyed by pk id) shared by every pipeline and table:
+# identity, the latest profile info with when it was fetched, the gender result,
+# and which Airtable tables / sources reference the account
+# Pipelines check it before paying for a profile or gender lookup, so each account is looked up once
+REGISTRY_FILE = os.getenv('ACCOUNT_REGISTRY_FILE') or os.path.join(os.path.dirname(__file__), "..", "data", "accounts.sqlite3")
+PROFILE_MAX_AGE_DAYS = float(os.getenv('PROFILE_MAX_AGE_DAYS', 30))
+
+# Table names used for references
+LOCATION_POSTS = 'Location Posts'
+BUSINESS_NETWORK = 'Business Network'
+NETWORK = 'Network'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    pk_id TEXT PRIMARY KEY,
+    username TEXT,
+    full_name TEXT,
+    pfp_url TEXT,
+    is_private INTEGER,
+    is_verified INTEGER,
+    profile TEXT,
+    profile_fetched_at TEXT,
+    gender TEXT,
+    gender_confidence REAL,
+    gender_source TEXT,
+    gender_checked_at TEXT,
+    first_seen_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS accounts_username ON accounts (username);
+CREATE TABLE IF NOT EXISTS refs (
+    pk_id TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT '',
+    record_id TEXT,
+    added_at TEXT NOT NULL,
+    PRIMARY KEY (pk_id, table_name, source)
+);
+"""
+
+IDENTITY_FIELDS = ('username', 'full_name', 'pfp_url', 'is_private', 'is_verified')
+
+# Columns added after the first release, created on open if an older registry file lacks them
+MIGRATIONS = {
+    'accounts': {'lead_score': 'REAL', 'lead_qualified': 'INTEGER', 'lead_scored_at': 'TEXT'},
+    # the score last written to each table's row, and the latest time the account was recorded in the table
+    'refs': {'lead_synced_score': 'REAL', 'lead_synced_qualified': 'INTEGER', 'last_seen_at': 'TEXT'}
+}
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+def _is_fresh(timestamp, max_age_days):
+    if not timestamp:
+        return False
+    if max_age_days is None:
+        return True
+    return datetime.fromisoformat(timestamp) >= datetime.now(timezone.utc) - timedelta(days=max_age_days)
+
+def identity_from_fields(fields):
+    """
+    Function to read the identity columns from an Airtable record's fields
+    Handles both the locations tables (Title Case) and the suggested accounts Network table (snake_case)
+    """
+    return {
+        'pk_id': fields.get('Pk Id') or fields.get('pk_id'),
+        'username': fields.get('Username') or fields.get('username'),
+        'full_name': fields.get('Full Name') or fields.get('full_name'),
+        'pfp_url': fields.get('Pfp Url') or fields.get('pfp_url'),
+        'is_private': fields.get('Is Private', fields.get('private')),
+        'is_verified': fields.get('Is Verified', fields.get('verified'))
+    }
+
+class AccountRegistry:
+    """
+    sqlite backed account registry, safe to share between threads
+    """
+
+    def __init__(self, path=REGISTRY_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # WAL lets several pipeline processes read while one writes
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.executescript(SCHEMA)
+        for table, migrations in MIGRATIONS.items():
+            columns = {row['name'] for row in self.conn.execute(f'PRAGMA table_info({table})')}
+            for column, column_type in migrations.items():
+                if column not in columns:
+                    self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+    def record_accounts(self, accounts, table=None, source=None):
+        """
+        Function to add or refresh the identity of several accounts, optionally recording that table references them
+        accounts are dicts with pk_id and any of username, full_name, pfp_url, is_private, is_verified
+        (identity_from_fields builds them from Airtable records), plus an optional per-account source and record_id
+        Returns how many accounts were new to the registry
+        """
+        now = _now()
+        new_accounts = 0
+        with self.lock, self.conn:
+            for account in accounts:
+                pk_id = account.get('pk_id')
+                if pk_id is None:
+                    continue
+                pk_id = str(pk_id)
+                cursor = self.conn.execute(
+                    'INSERT OR IGNORE INTO accounts (pk_id, first_seen_at, updated_at) VALUES (?, ?, ?)', (pk_id, now, now))
+                new_accounts += cursor.rowcount
+                # Keep what we already know when a source doesn't have a field
+                self.conn.execute(
+                    'UPDATE accounts SET ' + ', '.join(f'{field} = COALESCE(?, {field})' for field in IDENTITY_FIELDS) +
+                    ', updated_at = ? WHERE pk_id = ?',
+                    [account.get(field) for field in IDENTITY_FIELDS] + [now, pk_id])
+                if table:
+                    # added_at stays the first sighting, last_seen_at moves with every one
+                    self.conn.execute(
+                        'INSERT INTO refs (pk_id, table_name, source, record_id, added_at, last_seen_at) VALUES (?, ?, ?, ?, ?, ?) '
+                        'ON CONFLICT (pk_id, table_name, source) DO UPDATE SET last_seen_at = excluded.last_seen_at',
+                        (pk_id, table, account.get('source') or source or '', account.get('record_id'), now, now))
+        return new_accounts
+
+    def record_records(self, records, table, source=None):
+        """
+        Function to register the accounts in a list of Airtable records written to table
+        """
+        accounts = []
+        for record in records:
+            account = identity_from_fields(record.get('fields', {}))
+            account['record_id'] = record.get('id')
+            accounts.append(account)
+        return self.record_accounts(accounts, table, source)
+
+    def _find(self, pk_id=None, username=None):
+        if pk_id is not None:
+            row = self.conn.execute('SELECT * FROM accounts WHERE pk_id = ?', (str(pk_id),)).fetchone()
+            if row:
+                return row
+        if username:
+            return self.conn.execute(
+                'SELECT * FROM accounts WHERE username = ? ORDER BY updated_at DESC LIMIT 1', (username,)).fetchone()
+        return None
+
+    def lookup(self, pk_id=None, username=None):
+        """
+        Function to get everything known about an account as a dict, None if it isn't registered
+        """
+        with self.lock:
+            row = self._find(pk_id, username)
+            if not row:
+                return None
+            account = dict(row)
+            account['profile'] = json.loads(row['profile']) if row['profile'] else None
+            account['refs'] = [dict(ref) for ref in self.conn.execute(
+                'SELECT table_name, source, record_id, added_at, last_seen_at FROM refs WHERE pk_id = ?', (row['pk_id'],))]
+            return account
+
+    def record_profile(self, profile):
+        """
+        Function to save the latest profile info (the data of an Instagram /v1/info response) for an account
+        """
+        pk_id = profile.get('id') or profile.get('pk')
+        if pk_id is None:
+            return
+        self.record_accounts([{
+            'pk_id': pk_id,
+            'username': profile.get('username'),
+            'full_name': profile.get('full_name'),
+            'pfp_url': profile.get('profile_pic_url'),
+            'is_private': profile.get('is_private'),
+            'is_verified': profile.get('is_verified')
+        }])
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE accounts SET profile = ?, profile_fetched_at = ? WHERE pk_id = ?',
+                              (json.dumps(profile), _now(), str(pk_id)))
+
+    def get_profile(self, pk_id=None, username=None, max_age_days=PROFILE_MAX_AGE_DAYS):
+        """
+        Function to get the stored profile info if it was fetched within max_age_days, otherwise None
+        """
+        return self.get_profile_fetched(pk_id, username, max_age_days)[0]
+
+    def get_profile_fetched(self, pk_id=None, username=None, max_age_days=PROFILE_MAX_AGE_DAYS):
+        """
+        Function to get (profile info, when it was fetched) if it was fetched within max_age_days, otherwise (None, None)
+        """
+        with self.lock:
+            row = self._find(pk_id, username)
+        if not row or not row['profile'] or not _is_fresh(row['profile_fetched_at'], max_age_days):
+            return None, None
+        return json.loads(row['profile']), row['profile_fetched_at']
+
+    def record_gender(self, pk_id, gender, confidence=None, source=None):
+        """
+        Function to save a gender result, gender None means the account was checked without a result (e.g. no face)
+        """
+        if pk_id is None:
+            return
+        self.record_accounts([{'pk_id': pk_id}])
+        with self.lock, self.conn:
+            self.conn.execute(
+                'UPDATE accounts SET gender = ?, gender_confidence = ?, gender_source = ?, gender_checked_at = ? WHERE pk_id = ?',
+                (gender, confidence, source, _now(), str(pk_id)))
+
+    def get_gender(self, pk_id=None, username=None):
+        """
+        Function to get a stored gender result as {'gender', 'confidence', 'source'}, None if never checked
+        """
+        with self.lock:
+            row = self._find(pk_id, username)
+        if not row or not row['gender_checked_at']:
+            return None
+        return {'gender': row['gender'], 'confidence': row['gender_confidence'], 'source': row['gender_source']}
+
+    def is_referenced(self, table, pk_id=None, username=None):
+        """
+        Function to check whether an account is already known to be in table
+        """
+        with self.lock:
+            row = self._find(pk_id, username)
+            if not row:
+                return False
+            return self.conn.execute('SELECT 1 FROM refs WHERE pk_id = ? AND table_name = ? LIMIT 1',
+                                     (row['pk_id'], table)).fetchone() is not None
+
+    def scoring_rows(self, table=None, recency_table=LOCATION_POSTS):
+        """
+        Function to get the lead scoring inputs of every account (or every account referenced by table) in one query
+        Rows are (pk_id, follower_count, following_count, media_count, is_private, is_verified,
+        gender, gender_confidence, last seen in recency_table as unix time)
+        """
+        query = """
+            SELECT a.pk_id,
+                   json_extract(a.profile, '$.follower_count'),
+                   json_extract(a.profile, '$.following_count'),
+                   json_extract(a.profile, '$.media_count'),
+                   a.is_private, a.is_verified, a.gender, a.gender_confidence,
+                   (SELECT CAST(strftime('%s', MAX(COALESCE(r.last_seen_at, r.added_at))) AS INTEGER) FROM refs r
+                    WHERE r.pk_id = a.pk_id AND r.table_name = ?)
+            FROM accounts a"""
+        params = [recency_table]
+        if table:
+            query += " WHERE EXISTS (SELECT 1 FROM refs t WHERE t.pk_id = a.pk_id AND t.table_name = ?)"
+            params.append(table)
+        with self.lock:
+            return self.conn.execute(query, params).fetchall()
+
+    def record_lead_scores(self, pk_ids, scores, qualified):
+        """
+        Function to save freshly computed lead scores (parallel sequences)
+        """
+        now = _now()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'UPDATE accounts SET lead_score = ?, lead_qualified = ?, lead_scored_at = ? WHERE pk_id = ?',
+                ((float(score), int(ok), now, pk_id) for pk_id, score, ok in zip(pk_ids, scores, qualified)))
+
+    def lead_scores(self, pk_ids):
+        """
+        Function to get the saved lead scores of several accounts as {pk_id: score}, unscored accounts are left out
+        """
+        pk_ids = [str(pk_id) for pk_id in pk_ids if pk_id is not None]
+        scores = {}
+        with self.lock:
+            for i in range(0, len(pk_ids), 500):
+                chunk = pk_ids[i:i + 500]
+                rows = self.conn.execute(
+                    f'SELECT pk_id, lead_score FROM accounts WHERE lead_score IS NOT NULL AND pk_id IN ({",".join("?" * len(chunk))})',
+                    chunk)
+                scores.update({row['pk_id']: row['lead_score'] for row in rows})
+        return scores
+
+    def unsynced_lead_scores(self, table, min_change):
+        """
+        Function to get (pk_id, score, qualified) for accounts in table whose score moved by min_change or more,
+        or whose qualification changed, since it was last written to that table
+        """
+        with self.lock:
+            return self.conn.execute(
+                """SELECT a.pk_id, a.lead_score, a.lead_qualified FROM accounts a
+                   JOIN (SELECT pk_id, MIN(lead_synced_score) AS synced_score, MIN(lead_synced_qualified) AS synced_qualified
+                         FROM refs WHERE table_name = ? GROUP BY pk_id) t ON t.pk_id = a.pk_id
+                   WHERE a.lead_score IS NOT NULL
+                   AND (t.synced_score IS NULL OR ABS(a.lead_score - t.synced_score) >= ?
+                        OR a.lead_qualified != t.synced_qualified)""",
+                (table, min_change)).fetchall()
+
+    def mark_lead_scores_synced(self, table, rows):
+        """
+        Function to record that (pk_id, score, qualified) rows were written to table
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'UPDATE refs SET lead_synced_score = ?, lead_synced_qualified = ? WHERE pk_id = ? AND table_name = ?',
+                ((score, qualified, pk_id, table) for pk_id, score, qualified in rows))
+
+    def stats(self):
+        with self.lock:
+            counts = {
+                'accounts': self.conn.execute('SELECT COUNT(*) FROM accounts').fetchone()[0],
+                'with_profile': self.conn.execute('SELECT COUNT(*) FROM accounts WHERE profile IS NOT NULL').fetchone()[0],
+                'gender_checked': self.conn.execute('SELECT COUNT(*) FROM accounts WHERE gender_checked_at IS NOT NULL').fetchone()[0]
+            }
+            counts['by_table'] = {row[0]: row[1] for row in self.conn.execute(
+                'SELECT table_name, COUNT(DISTINCT pk_id) FROM refs GROUP BY table_name')}
+            counts['in_several_tables'] = self.conn.execute(
+                'SELECT COUNT(*) FROM (SELECT pk_id FROM refs GROUP BY pk_id HAVING COUNT(DISTINCT table_name) > 1)').fetchone()[0]
+        return counts
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """
+    Function to get the shared registry, opened on first use
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = AccountRegistry()
+        return _registry
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the local account registry")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    subparsers.add_parser('stats', help="count registered accounts")
+    show_parser = subparsers.add_parser('show', help="show everything known about one account")
+    show_parser.add_argument('account', help="pk id or username")
+    args = parser.parse_args()
+
+    registry = get_registry()
+    if args.action == 'stats':
+        stats = registry.stats()
+        print(f"{stats['accounts']} accounts, {stats['with_profile']} with profile info, {stats['gender_checked']} gender checked")
+        for table, count in sorted(stats['by_table'].items()):
+            print(f"  {table}: {count}")
+        print(f"  in more than one table: {stats['in_several_tables']}")
+    else:
+        account = registry.lookup(pk_id=args.account, username=args.account)
+        if account:
+            print(json.dumps(account, indent=2, default=str))
+        else:
+            print(f"{args.account} is not in the registry")
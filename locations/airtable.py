@@ -1,7 +1,10 @@
 import requests
+import http_client
 from dotenv import load_dotenv
 import os
-import time  # Add this import at the top
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
@@ -15,12 +18,161 @@ AIRTABLE_FIRE_LOCATIONS_VIEW = os.getenv('AIRTABLE_FIRE_LOCATIONS_VIEW')
 AIRTABLE_BUSINESS_TARGETS_TABLE = os.getenv('AIRTABLE_BUSINESS_TARGETS_TABLE')
 AIRTABLE_BUSINESS_NETWORK_TABLE = os.getenv('AIRTABLE_BUSINESS_NETWORK_TABLE')
 
-def fetch_existing_locations(offset=None, all_records=None):
+# Sharding: a table that outgrows one base can be spread over several bases (or tables)
+# Records are routed by a hash of their Pk Id and reads fan out to every shard and merge the results
+# Each base has its own rate limit in http_client, so throughput grows with the number of shards
+# e.g. AIRTABLE_SHARDS="Business Network=appAAA,appBBB;Location Posts=appAAA/Location Posts,appCCC/Posts 2"
+# A shard is base[/table], the table defaulting to the logical table name; unlisted tables live in AIRTABLE_BASE_ID
+# Routing depends on the shard order, so only ever append shards to a table that already has records
+AIRTABLE_SHARDS = os.getenv('AIRTABLE_SHARDS', '')
+SHARD_KEY_FIELDS = ('Pk Id', 'pk_id')
+
+def parse_shards(raw=AIRTABLE_SHARDS):
+    """
+    Function to parse AIRTABLE_SHARDS into {logical table: [(base id, table), ...]}
+    """
+    shards = {}
+    for entry in raw.split(';'):
+        if '=' not in entry:
+            continue
+        table, targets = entry.split('=', 1)
+        table = table.strip()
+        for target in targets.split(','):
+            base_id, _, shard_table = target.strip().partition('/')
+            if base_id:
+                shards.setdefault(table, []).append((base_id, shard_table.strip() or table))
+    return shards
+
+class WriteResult(dict):
+    """
+    Outcome of a write that may be spread over several shards and batches, counts (e.g. created / updated) as items
+    It is falsy if any record failed; written lists the records that were stored, so callers can still record
+    those when another shard or a later batch failed
+    """
+
+    def __init__(self, written, complete, **counts):
+        super().__init__(counts)
+        self.written = written
+        self.complete = complete
+
+    def __bool__(self):
+        return self.complete
+
+_shards = parse_shards()
+_record_shards = {}  # record id -> shard, learnt from reads and creates so updates go to the right base
+_record_shards_lock = threading.Lock()
+
+def table_shards(table):
+    """
+    Function to get the (base id, table) shards of a logical table
+    """
+    return _shards.get(table) or [(AIRTABLE_BASE_ID, table)]
+
+def shard_for_key(table, key):
+    """
+    Function to get the shard a shard key (Pk Id) is routed to
+    """
+    shards = table_shards(table)
+    if len(shards) == 1 or key is None:
+        return shards[0]
+    return shards[zlib.crc32(str(key).encode('utf-8')) % len(shards)]
+
+def shard_for_record(table, record):
+    """
+    Function to get the shard holding a record, by its record id if we've seen it, else by its Pk Id
+    A record id we haven't seen and can't route by Pk Id is looked up in each shard
+    """
+    shards = table_shards(table)
+    if len(shards) == 1:
+        return shards[0]
+    with _record_shards_lock:
+        known = _record_shards.get(record.get('id'))
+    if known:
+        return known
+    fields = record.get('fields', {})
+    key = next((fields[f] for f in SHARD_KEY_FIELDS if fields.get(f) is not None), None)
+    if key is None and record.get('id'):
+        return _locate_record(table, record['id'])
+    return shard_for_key(table, key)
+
+def _locate_record(table, record_id):
+    """
+    Function to find which shard holds a record id, raising LookupError if none does
+    """
+    headers = {
+        'Authorization': f'Bearer {AIRTABLE_API_KEY}',
+    }
+    for shard in table_shards(table):
+        response = http_client.get(_shard_url(shard, record_id), headers=headers)
+        if response.status_code == 404:
+            continue
+        response.raise_for_status()
+        _remember_shard(shard, [{'id': record_id}])
+        return shard
+    raise LookupError(f"Record {record_id} isn't in any shard of {table}")
+
+def _remember_shard(shard, records):
+    with _record_shards_lock:
+        for record in records:
+            if record.get('id'):
+                _record_shards[record['id']] = shard
+
+def _shard_url(shard, record_id=None):
+    base_id, table = shard
+    url = f'https://api.airtable.com/v0/{base_id}/{table}'
+    return f'{url}/{record_id}' if record_id else url
+
+def _per_shard(table, records, write):
+    """
+    Function to split records by shard and run write(shard, shard_records) for each, shards in parallel
+    Returns the list of per-shard results, one shard failing doesn't stop the others
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(shard_for_record(table, record), []).append(record)
+    if len(groups) <= 1:
+        return [write(shard, shard_records) for shard, shard_records in groups.items()]
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        return list(executor.map(lambda item: write(*item), groups.items()))
+
+def _fetch_shard(shard, params):
+    headers = {
+        'Authorization': f'Bearer {AIRTABLE_API_KEY}',
+    }
+    records = []
+    query_params = dict(params or {})
+    while True:
+        response = http_client.get(_shard_url(shard), headers=headers, params=query_params)
+        response.raise_for_status()
+        data = response.json()
+        records.extend(data.get('records', []))
+        if 'offset' not in data:
+            break
+        query_params['offset'] = data['offset']
+    _remember_shard(shard, records)
+    return records
+
+def fetch_all(table, params=None):
+    """
+    Function to fetch every record of a (possibly sharded) table matching the query params
+    Shards are read in parallel and merged in shard order; views named in params must exist in every shard
+    """
+    shards = table_shards(table)
+    if len(shards) == 1:
+        return _fetch_shard(shards[0], params)
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        results = list(executor.map(lambda shard: _fetch_shard(shard, params), shards))
+    return [record for records in results for record in records]
+
+def fetch_existing_locations(offset=None, all_records=None, view=AIRTABLE_FIRE_LOCATIONS_VIEW):
     """
     Function to fetch all records from locations table
+    Defaults to the 🔥 location view, pass view=None for the whole table
     """
     
-    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_LOCATIONS_TABLE}?view={AIRTABLE_FIRE_LOCATIONS_VIEW}' #NOTE: using 🔥 location view
+    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_LOCATIONS_TABLE}'
+    if view:
+        url += f'?view={view}' #NOTE: using 🔥 location view by default
     headers = {
         'Authorization': f'Bearer {AIRTABLE_API_KEY}',
     }
@@ -32,14 +184,14 @@ def fetch_existing_locations(offset=None, all_records=None):
     if offset:
         query_params['offset'] = offset
 
-    response = requests.get(url, headers=headers, params=query_params)
+    response = http_client.get(url, headers=headers, params=query_params)
     response.raise_for_status()
     data = response.json()
     
     all_records.extend(data.get('records', []))
     
     if 'offset' in data:
-        return fetch_existing_locations(data['offset'], all_records)
+        return fetch_existing_locations(data['offset'], all_records, view)
     else:
         return all_records
 
@@ -66,7 +218,7 @@ def create_location_records(records):
         }
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = http_client.post(url, headers=headers, json=payload)
             response.raise_for_status()
             total_created += len(batch)
             print(f"Successfully created batch of {len(batch)} records")
@@ -79,41 +231,188 @@ def create_location_records(records):
     print(f"Total records created: {total_created}")
     return True
 
-def fetch_existing_location_posts(offset=None, all_records=None):
+def upsert_records(table, records, fields_to_merge_on, label='records'):
     """
-    Function to fetch all records from location posts table
+    Function to upsert records into an Airtable table using performUpsert
+    Records whose fields_to_merge_on values match an existing row update it, the rest are created
+    Handles batches of 10 records at a time (Airtable limit)
+    Returns a WriteResult with created/updated counts, falsy if a batch failed
     """
+    results = _per_shard(table, records, lambda shard, shard_records: _upsert_shard(shard, shard_records, fields_to_merge_on, label))
+    written = [record for shard_written, _ in results for record in shard_written]
+    counts = {'created': sum(r['created'] for _, r in results), 'updated': sum(r['updated'] for _, r in results)}
+    print(f"Total {label} created: {counts['created']}, updated: {counts['updated']}")
+    return WriteResult(written, len(written) == len(records), **counts)
+
+def _upsert_shard(shard, records, fields_to_merge_on, label):
+    url = _shard_url(shard)
+    headers = {
+        'Authorization': f'Bearer {AIRTABLE_API_KEY}',
+        'Content-Type': 'application/json'
+    }
     
-    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_LOCATION_POSTS_TABLE}'
+    batch_size = 10
+    written = []
+    counts = {'created': 0, 'updated': 0}
+    
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i + batch_size]
+        payload = {
+            "performUpsert": {
+                "fieldsToMergeOn": fields_to_merge_on
+            },
+            "records": batch
+        }
+        
+        try:
+            response = http_client.patch(url, idempotent=True, headers=headers, json=payload)
+            response.raise_for_status()
+            data = response.json()
+            _remember_shard(shard, data.get('records', []))
+            created = len(data.get('createdRecords', []))
+            updated = len(data.get('updatedRecords', []))
+            counts['created'] += created
+            counts['updated'] += updated
+            written.extend(batch)
+            print(f"Successfully upserted batch of {len(batch)} {label} ({created} created, {updated} updated)")
+        except requests.exceptions.RequestException as e:
+            print(f"Error upserting {label} batch: {e}")
+            if hasattr(e.response, 'text'):
+                print(f"Response text: {e.response.text}")
+            break
+    
+    return written, counts
+
+def _formula_string(value):
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+def fetch_matching_records(table, records, fields_to_merge_on, fields=()):
+    """
+    Function to find the existing rows matching records on fields_to_merge_on
+    Returns {merge key: existing record} with only the merge fields and fields requested
+    """
+    keys = {}
+    for record in records:
+        values = tuple(record.get('fields', {}).get(field) for field in fields_to_merge_on)
+        if all(value is not None for value in values):
+            keys[tuple(str(value) for value in values)] = values
+    existing = {}
+    key_list = list(keys.values())
+    # Several keys per lookup, kept short enough for Airtable's URL length limit
+    for i in range(0, len(key_list), 50):
+        conditions = [
+            "AND(" + ", ".join(f"{{{field}}}&'' = {_formula_string(value)}" for field, value in zip(fields_to_merge_on, values)) + ")"
+            for values in key_list[i:i + 50]
+        ]
+        for record in fetch_all(table, {
+            'filterByFormula': f"OR({', '.join(conditions)})",
+            'fields[]': list(fields_to_merge_on) + list(fields)
+        }):
+            key = tuple(str(record.get('fields', {}).get(field)) for field in fields_to_merge_on)
+            existing.setdefault(key, record)
+    return existing
+
+def merge_records(table, records, fields_to_merge_on, link_fields=(), keep_fields=(), label='records'):
+    """
+    Function to upsert records without losing what existing rows already hold
+    Rows matching on fields_to_merge_on only get the fields that may change: keep_fields (first-seen values such as
+    the post id) are left out and link_fields are sent as the existing links plus the new ones
+    Records with no matching row are created whole through performUpsert
+    Returns a WriteResult with created/updated counts, falsy if the lookup or a batch failed
+    """
+    try:
+        existing = fetch_matching_records(table, records, fields_to_merge_on, link_fields)
+    except requests.exceptions.RequestException as e:
+        print(f"Error looking up existing {label}: {e}")
+        return WriteResult([], False, created=0, updated=0)
+
+    new_records = []
+    updates = []
+    originals = {}  # id() of each update sent -> the record it came from
+    for record in records:
+        fields = record.get('fields', {})
+        match = existing.get(tuple(str(fields.get(field)) for field in fields_to_merge_on))
+        if not match:
+            new_records.append(record)
+            continue
+        update = {field: value for field, value in fields.items() if field not in keep_fields}
+        for field in link_fields:
+            if field in update:
+                links = match.get('fields', {}).get(field) or []
+                update[field] = links + [link for link in update[field] or [] if link not in links]
+        updates.append({"id": match['id'], "fields": update})
+        originals[id(updates[-1])] = record
+
+    written = [originals[id(update)] for update in _update_written(table, updates, label)] if updates else []
+    counts = {'created': 0, 'updated': len(written)}
+    complete = len(written) == len(updates)
+    if new_records:
+        result = upsert_records(table, new_records, fields_to_merge_on, label)
+        written.extend(result.written)
+        counts['created'] += result['created']
+        counts['updated'] += result['updated']
+        complete = complete and bool(result)
+    return WriteResult(written, complete, **counts)
+
+def update_records(table, records, label='records'):
+    """
+    Function to update existing records in an Airtable table
+    records are {"id": record_id, "fields": {...}} dicts
+    Handles batches of 10 records at a time (Airtable limit)
+    Returns the number of records updated, each shard stopping at its first failed batch
+    """
+    return len(_update_written(table, records, label))
+
+def _update_written(table, records, label):
+    """
+    Function to update records and get back the ones that were updated
+    """
+    results = _per_shard(table, records, lambda shard, shard_records: _update_shard(shard, shard_records, label))
+    written = [record for shard_written in results for record in shard_written]
+    print(f"Total {label} updated: {len(written)}")
+    return written
+
+def _update_shard(shard, records, label):
+    url = _shard_url(shard)
     headers = {
         'Authorization': f'Bearer {AIRTABLE_API_KEY}',
+        'Content-Type': 'application/json'
     }
 
-    if all_records is None:
-        all_records = []
-        
-    query_params = {}
-    if offset:
-        query_params['offset'] = offset
+    batch_size = 10
+    written = []
 
-    response = requests.get(url, headers=headers, params=query_params)
-    response.raise_for_status()
-    data = response.json()
-    
-    all_records.extend(data.get('records', []))
-    
-    if 'offset' in data:
-        return fetch_existing_location_posts(data['offset'], all_records)
-    else:
-        return all_records
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i + batch_size]
+        payload = {
+            "records": batch
+        }
 
-def create_location_post_records(records):
+        try:
+            response = http_client.patch(url, idempotent=True, headers=headers, json=payload)
+            response.raise_for_status()
+            written.extend(batch)
+        except requests.exceptions.RequestException as e:
+            print(f"Error updating {label} batch: {e}")
+            if hasattr(e.response, 'text'):
+                print(f"Response text: {e.response.text}")
+            break
+
+    return written
+
+def create_records(table, records, label='records'):
     """
-    Function to create new location post records in Airtable
+    Function to create records in a (possibly sharded) table, each routed to its shard by Pk Id
     Handles batches of 10 records at a time (Airtable limit)
+    Returns a WriteResult with the created count, falsy unless every batch was created
     """
-    
-    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_LOCATION_POSTS_TABLE}'
+    results = _per_shard(table, records, lambda shard, shard_records: _create_shard(shard, shard_records, label))
+    written = [record for shard_written in results for record in shard_written]
+    print(f"Total {label} created: {len(written)}")
+    return WriteResult(written, len(written) == len(records), created=len(written), updated=0)
+
+def _create_shard(shard, records, label):
+    url = _shard_url(shard)
     headers = {
         'Authorization': f'Bearer {AIRTABLE_API_KEY}',
         'Content-Type': 'application/json'
@@ -121,7 +420,7 @@ def create_location_post_records(records):
     
     # Split records into batches of 10
     batch_size = 10
-    total_created = 0
+    written = []
     
     for i in range(0, len(records), batch_size):
         batch = records[i:i + batch_size]
@@ -130,55 +429,61 @@ def create_location_post_records(records):
         }
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = http_client.post(url, headers=headers, json=payload)
             response.raise_for_status()
-            total_created += len(batch)
-            print(f"Successfully created batch of {len(batch)} post records")
+            _remember_shard(shard, response.json().get('records', []))
+            written.extend(batch)
+            print(f"Successfully created batch of {len(batch)} {label}")
         except requests.exceptions.RequestException as e:
-            print(f"Error creating location post records batch: {e}")
+            print(f"Error creating {label} batch: {e}")
             if hasattr(e.response, 'text'):
                 print(f"Response text: {e.response.text}")
-            return False
+            break
     
-    print(f"Total post records created: {total_created}")
-    return True
+    return written
 
-def fetch_location_posts_without_gender(offset=None, all_records=None):
+def fetch_existing_location_posts():
     """
-    Function to fetch posts that haven't been gender checked
+    Function to fetch all records from location posts table
+    """
+    return fetch_all(AIRTABLE_LOCATION_POSTS_TABLE)
+
+def create_location_post_records(records, upsert_on=None):
+    """
+    Function to create new location post records in Airtable
+    Handles batches of 10 records at a time (Airtable limit)
+    upsert_on (e.g. ['Pk Id']) merges into existing rows instead of creating duplicates
+    Returns a WriteResult (created/updated counts, written records), falsy if any record wasn't saved
+    An existing row keeps its first post (Post Id, Posted Date, Post Caption) and gains the new Locations link
     """
     
-    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_LOCATION_POSTS_TABLE}'
-    headers = {
-        'Authorization': f'Bearer {AIRTABLE_API_KEY}',
-    }
+    if upsert_on:
+        return merge_records(AIRTABLE_LOCATION_POSTS_TABLE, records, upsert_on, link_fields=('Locations',),
+                             keep_fields=('Post Id', 'Posted Date', 'Post Caption'), label='post records')
+    return create_records(AIRTABLE_LOCATION_POSTS_TABLE, records, 'post records')
 
-    if all_records is None:
-        all_records = []
-        
-    query_params = {
-        'filterByFormula': '{Gender Checked} != TRUE()'
-    }
-    if offset:
-        query_params['offset'] = offset
+def fetch_location_posts_without_gender():
+    """
+    Function to fetch posts that haven't been gender checked
+    """
+    return fetch_all(AIRTABLE_LOCATION_POSTS_TABLE, {'filterByFormula': '{Gender Checked} != TRUE()'})
 
-    response = requests.get(url, headers=headers, params=query_params)
-    response.raise_for_status()
-    data = response.json()
-    
-    all_records.extend(data.get('records', []))
-    
-    if 'offset' in data:
-        return fetch_location_posts_without_gender(data['offset'], all_records)
-    else:
-        return all_records
+def fetch_location_post_genders():
+    """
+    Function to fetch the Locations and Gender fields of every gender checked location post
+    Only those two fields are requested so the scan stays small
+    """
+    return fetch_all(AIRTABLE_LOCATION_POSTS_TABLE, {
+        'filterByFormula': '{Gender Checked} = TRUE()',
+        'fields[]': ['Locations', 'Gender']
+    })
 
 def update_post_gender(record_id, update_data):
     """
     Function to update gender information for a post in Location Posts table
     """
     
-    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_LOCATION_POSTS_TABLE}/{record_id}'
+    url = _shard_url(shard_for_record(AIRTABLE_LOCATION_POSTS_TABLE, {'id': record_id}), record_id)
     headers = {
         'Authorization': f'Bearer {AIRTABLE_API_KEY}',
         'Content-Type': 'application/json'
@@ -189,7 +494,7 @@ def update_post_gender(record_id, update_data):
     }
     
     try:
-        response = requests.patch(url, headers=headers, json=payload)
+        response = http_client.patch(url, idempotent=True, headers=headers, json=payload)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
@@ -215,7 +520,7 @@ def fetch_business_targets(offset=None, all_records=None):
     if offset:
         query_params['offset'] = offset
 
-    response = requests.get(url, headers=headers, params=query_params)
+    response = http_client.get(url, headers=headers, params=query_params)
     response.raise_for_status()
     data = response.json()
     
@@ -226,40 +531,19 @@ def fetch_business_targets(offset=None, all_records=None):
     else:
         return all_records
 
-def create_business_network_records(records):
+def create_business_network_records(records, upsert_on=None):
     """
     Function to create new business network records in Airtable
     Handles batches of 10 records at a time
+    upsert_on (e.g. ['Pk Id']) merges into existing rows instead of creating duplicates
+    Returns a WriteResult (created/updated counts, written records), falsy if any record wasn't saved
+    An existing row keeps the targets it was found from and gains the new Targets (Business) link
     """
     
-    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_BUSINESS_NETWORK_TABLE}'
-    headers = {
-        'Authorization': f'Bearer {AIRTABLE_API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    
-    batch_size = 10
-    total_created = 0
-    
-    for i in range(0, len(records), batch_size):
-        batch = records[i:i + batch_size]
-        payload = {
-            "records": batch
-        }
-        
-        try:
-            response = requests.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            total_created += len(batch)
-            print(f"Successfully created batch of {len(batch)} network records")
-        except requests.exceptions.RequestException as e:
-            print(f"Error creating network records batch: {e}")
-            if hasattr(e.response, 'text'):
-                print(f"Response text: {e.response.text}")
-            return False
-    
-    print(f"Total network records created: {total_created}")
-    return True
+    if upsert_on:
+        return merge_records(AIRTABLE_BUSINESS_NETWORK_TABLE, records, upsert_on, link_fields=('Targets (Business)',),
+                             label='network records')
+    return create_records(AIRTABLE_BUSINESS_NETWORK_TABLE, records, 'network records')
 
 def update_target_as_scraped(record_id):
     """
@@ -278,56 +562,26 @@ def update_target_as_scraped(record_id):
     }
     
     try:
-        response = requests.patch(url, headers=headers, json=payload)
+        response = http_client.patch(url, idempotent=True, headers=headers, json=payload)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
         print(f"Error updating target as scraped: {e}")
         return False
 
-def fetch_existing_business_network_accounts(offset=None, all_records=None):
+def fetch_existing_business_network_accounts():
     """
     Function to fetch all existing network accounts from Airtable
-    Includes rate limiting (5 requests per second max)
+    Pacing and retries are handled by http_client (each shard's base has its own rate limit)
     """
-    
-    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_BUSINESS_NETWORK_TABLE}'
-    headers = {
-        'Authorization': f'Bearer {AIRTABLE_API_KEY}',
-    }
+    return fetch_all(AIRTABLE_BUSINESS_NETWORK_TABLE)
 
-    if all_records is None:
-        all_records = []
-        
-    query_params = {}
-    if offset:
-        query_params['offset'] = offset
-
-    try:
-        response = requests.get(url, headers=headers, params=query_params)
-        response.raise_for_status()
-        data = response.json()
-        
-        all_records.extend(data.get('records', []))
-        
-        if 'offset' in data:
-            print(f"Fetched {len(data.get('records', []))} records, waiting before next request...")
-            time.sleep(0.25)  # Wait 250ms between requests (4 requests per second to be safe)
-            return fetch_existing_business_network_accounts(data['offset'], all_records)
-        else:
-            return all_records
-            
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching records, retrying in 2 seconds: {e}")
-        time.sleep(2)  # Wait longer on error
-        return fetch_existing_business_network_accounts(offset, all_records)
-    
 def update_business_network_gender(record_id, update_data):
     """
     Function to update gender information for a account in Business Network table
     """
     
-    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_BUSINESS_NETWORK_TABLE}/{record_id}'
+    url = _shard_url(shard_for_record(AIRTABLE_BUSINESS_NETWORK_TABLE, {'id': record_id}), record_id)
     headers = {
         'Authorization': f'Bearer {AIRTABLE_API_KEY}',
         'Content-Type': 'application/json'
@@ -338,48 +592,26 @@ def update_business_network_gender(record_id, update_data):
     }
     
     try:
-        response = requests.patch(url, headers=headers, json=payload)
+        response = http_client.patch(url, idempotent=True, headers=headers, json=payload)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
         print(f"Error updating post gender: {e}")
         return False
 
+def update_business_network_records(records):
+    """
+    Function to update several Business Network accounts, 10 per request
+    Returns a WriteResult listing the records that were updated (not necessarily the first ones, shards write in parallel)
+    """
+    written = _update_written(AIRTABLE_BUSINESS_NETWORK_TABLE, records, 'network records')
+    return WriteResult(written, len(written) == len(records), updated=len(written))
+
 def fetch_business_network_without_gender():
     """
     Fetch business network accounts that haven't been gender checked.
-    Uses a while loop instead of recursion to prevent maximum recursion depth error.
     """
-    
-    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_BUSINESS_NETWORK_TABLE}'
-    headers = {
-        'Authorization': f'Bearer {AIRTABLE_API_KEY}',
-    }
-    
-    all_records = []
-    offset = None
-
-    while True:
-        query_params = {
-            'filterByFormula': '{Gender Checked} != TRUE()'
-        }
-        if offset:
-            query_params['offset'] = offset
-
-        response = requests.get(url, headers=headers, params=query_params)
-        response.raise_for_status()
-        data = response.json()
-
-        all_records.extend(data.get('records', []))
-
-        # If there is no offset, break the loop (no more pages)
-        if 'offset' not in data:
-            break
-
-        # Set offset for next request
-        offset = data['offset']
-
-    return all_records
+    return fetch_all(AIRTABLE_BUSINESS_NETWORK_TABLE, {'filterByFormula': '{Gender Checked} != TRUE()'})
 
 def update_target_pagination_token(record_id, pagination_token):
     """
@@ -398,7 +630,7 @@ def update_target_pagination_token(record_id, pagination_token):
     }
     
     try:
-        response = requests.patch(url, headers=headers, json=payload)
+        response = http_client.patch(url, idempotent=True, headers=headers, json=payload)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
@@ -0,0 +1,139 @@
+import queue
+import threading
+from collections import deque
+
+# Background writer shared by concurrent scrapers
+# Records from every producer are packed into full Airtable batches of 10 and written by one thread,
+# so the writes stay in order and under the Airtable rate limit however many producers there are
+AIRTABLE_BATCH_SIZE = 10
+
+class BatchWriter:
+    """
+    Queues records from several producers and writes them in batches on a background thread
+    Each submission can carry a callback that runs once its records (and every earlier submission
+    with the same key) are written, e.g. to save a pagination token only after its page is stored
+    After a failed write the writer stops writing and drops everything still queued
+    """
+
+    def __init__(self, write_batch, batch_size=AIRTABLE_BATCH_SIZE, on_written=None, flush_interval=1.0,
+                 max_pending=50, label='records'):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.on_written = on_written
+        self.flush_interval = flush_interval
+        self.label = label
+        self.queue = queue.Queue(maxsize=max_pending)  # producers block here if writes fall behind
+        self.failed = False
+        self.written = 0
+        self._buffer = []  # (record, ticket)
+        self._chains = {}  # key -> tickets in submission order
+        self._thread = threading.Thread(target=self._run, name=f'{label}-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, records, key=None, callback=None):
+        """
+        Function to queue records for writing
+        Returns False (and queues nothing) once a write has failed
+        """
+        item = (list(records), key, callback)
+        while not self.failed:
+            try:
+                # Wait in short steps so a producer never blocks on a writer that has stopped
+                self.queue.put(item, timeout=self.flush_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def close(self):
+        """
+        Function to write everything still queued and stop the writer thread
+        Returns True if every write succeeded
+        """
+        while self._thread.is_alive():
+            try:
+                self.queue.put(None, timeout=self.flush_interval)
+                break
+            except queue.Full:
+                continue
+        self._thread.join()
+        print(f"Wrote {self.written} {self.label}")
+        return not self.failed
+
+    def _run(self):
+        try:
+            self._write_queued()
+        except Exception as e:
+            print(f"Error in {self.label} writer: {e}, dropping the rest of the queue")
+            self._stop()
+
+    def _write_queued(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval if self._buffer else None)
+            except queue.Empty:
+                # Nothing new arrived for a while, write the partial batch rather than holding it back
+                self._flush(len(self._buffer))
+                continue
+
+            if item is None:
+                while self._buffer and not self.failed:
+                    self._flush(self.batch_size)
+                break
+
+            records, key, callback = item
+            if self.failed:
+                # Keep draining so producers and close() never wait on a full queue
+                continue
+
+            ticket = {'remaining': len(records), 'callback': callback}
+            self._chains.setdefault(key, deque()).append(ticket)
+            self._buffer.extend((record, ticket) for record in records)
+            while len(self._buffer) >= self.batch_size and not self.failed:
+                self._flush(self.batch_size)
+            self._run_callbacks()
+
+    def _flush(self, count):
+        batch = self._buffer[:count]
+        del self._buffer[:count]
+        if not batch:
+            return
+
+        records = [record for record, _ in batch]
+        try:
+            written = self.write_batch(records)
+        except Exception as e:
+            print(f"Error in {self.label} writer: {e}")
+            written = False
+        if not written:
+            print(f"Error writing batch of {len(records)} {self.label}, dropping the rest of the queue")
+            self._stop()
+            return
+
+        self.written += len(records)
+        if self.on_written:
+            try:
+                self.on_written(records)
+            except Exception as e:
+                # The records are in Airtable but weren't recorded locally, carrying on would let them be queued again
+                print(f"Error recording written {self.label}: {e}, dropping the rest of the queue")
+                self._stop()
+                return
+        for _, ticket in batch:
+            ticket['remaining'] -= 1
+        self._run_callbacks()
+
+    def _stop(self):
+        self.failed = True
+        self._buffer = []
+
+    def _run_callbacks(self):
+        for chain in self._chains.values():
+            while chain and chain[0]['remaining'] == 0:
+                ticket = chain.popleft()
+                if ticket['callback']:
+                    try:
+                        ticket['callback']()
+                    except Exception as e:
+                        # Keep the writer alive, producers would block forever without it
+                        print(f"Error in {self.label} writer callback: {e}")
@@ -0,0 +1,108 @@
+import math
+import os
+from yield_tracker import load_yield_stats
+
+# UCB1 bandit that decides which location gets the next RapidAPI call
+# Reward is new usernames per call, optionally weighted by how many of a location's leads turn out female
+DEFAULT_EXPLORATION = float(os.getenv('ALLOCATOR_EXPLORATION', 1.0))
+PRIOR_CALLS_CAP = 20  # history counts as at most this many calls so the allocator keeps adapting
+FEMALE_RATIO_SMOOTHING = 10  # pseudo-posts pulling small locations towards the overall female ratio
+
+class BudgetAllocator:
+    """
+    Upper confidence bound allocator
+    Each call goes to the arm with the best mean reward plus an exploration bonus that shrinks as the arm is used
+    """
+
+    def __init__(self, arm_ids, priors=None, exploration=DEFAULT_EXPLORATION):
+        self.exploration = exploration
+        self.arms = {}
+        priors = priors or {}
+        for arm_id in arm_ids:
+            prior = priors.get(arm_id, {})
+            calls = min(prior.get('calls', 0), PRIOR_CALLS_CAP)
+            mean = prior.get('mean', 0.0)
+            self.arms[arm_id] = {'calls': calls, 'reward': mean * calls, 'run_calls': 0, 'run_reward': 0.0}
+
+    def mean(self, arm_id):
+        arm = self.arms[arm_id]
+        return arm['reward'] / arm['calls'] if arm['calls'] else 0.0
+
+    def choose(self, candidates):
+        """
+        Function to pick the arm for the next call from the candidates still open
+        Arms that have never been tried go first
+        """
+        for arm_id in candidates:
+            if self.arms[arm_id]['calls'] == 0:
+                return arm_id
+
+        total_calls = sum(self.arms[arm_id]['calls'] for arm_id in candidates)
+        # Scale the bonus to the size of the rewards so it works for any reward unit
+        scale = max((self.mean(arm_id) for arm_id in candidates), default=1.0) or 1.0
+
+        def upper_bound(arm_id):
+            bonus = self.exploration * scale * math.sqrt(2 * math.log(total_calls) / self.arms[arm_id]['calls'])
+            return self.mean(arm_id) + bonus
+
+        return max(candidates, key=upper_bound)
+
+    def update(self, arm_id, reward):
+        arm = self.arms[arm_id]
+        arm['calls'] += 1
+        arm['reward'] += reward
+        arm['run_calls'] += 1
+        arm['run_reward'] += reward
+
+    def print_summary(self, labels=None):
+        labels = labels or {}
+        print("\nBudget allocation this run:")
+        ranked = sorted(self.arms.items(), key=lambda item: item[1]['run_calls'], reverse=True)
+        for arm_id, arm in ranked:
+            if not arm['run_calls']:
+                continue
+            print(f"  {labels.get(arm_id, arm_id)}: {arm['run_calls']} calls, "
+                  f"{arm['run_reward']:.1f} reward ({arm['run_reward'] / arm['run_calls']:.2f} per call)")
+
+def location_female_ratios(gender_records):
+    """
+    Function to work out the share of gender checked posts that are female, per location record id
+    Small samples are smoothed towards the overall ratio
+    """
+    totals = {}
+    overall_checked = 0
+    overall_female = 0
+    for record in gender_records:
+        fields = record.get('fields', {})
+        is_female = fields.get('Gender') == 'Female'
+        overall_checked += 1
+        overall_female += is_female
+        for location_record_id in fields.get('Locations', []):
+            counts = totals.setdefault(location_record_id, [0, 0])
+            counts[0] += 1
+            counts[1] += is_female
+
+    overall_ratio = overall_female / overall_checked if overall_checked else 0.5
+    ratios = {
+        location_record_id: (female + FEMALE_RATIO_SMOOTHING * overall_ratio) / (checked + FEMALE_RATIO_SMOOTHING)
+        for location_record_id, (checked, female) in totals.items()
+    }
+    return ratios, overall_ratio
+
+def location_priors(location_record_ids, weights=None, default_weight=1.0):
+    """
+    Function to build allocator priors from the yield stats saved by earlier runs
+    """
+    weights = weights or {}
+    history = load_yield_stats().get('location_posts', {})
+    priors = {}
+    for location_record_id in location_record_ids:
+        stats = history.get(location_record_id)
+        if not stats or not stats.get('calls'):
+            continue
+        weight = weights.get(location_record_id, default_weight)
+        priors[location_record_id] = {
+            'calls': stats['calls'],
+            'mean': stats['new'] / stats['calls'] * weight
+        }
+    return priors
@@ -0,0 +1,313 @@
+import argparse
+import base64
+import hashlib
+import importlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+# Record/replay transport for the shared HTTP sessions (Airtable, RapidAPI, PicPurify and image downloads)
+# HTTP_CASSETTE=path/to/file.jsonl with HTTP_CASSETTE_MODE=record saves every real response,
+# HTTP_CASSETTE_MODE=replay serves them back offline after their recorded latency times HTTP_REPLAY_SPEED
+# (0 replays instantly), so any entry point can be re-run without quota for request count and wall time
+HTTP_CASSETTE = os.getenv('HTTP_CASSETTE')
+HTTP_CASSETTE_MODE = os.getenv('HTTP_CASSETTE_MODE', 'replay')
+HTTP_REPLAY_SPEED = float(os.getenv('HTTP_REPLAY_SPEED', 1.0))
+
+# Never written to cassettes
+SECRET_ENV_VARS = ('AIRTABLE_API_KEY', 'RAPIDAPI_KEY', 'PICPURIFY_API_KEY')
+SECRET_QUERY_PARAMS = {'api_key', 'key'}
+RECORDED_HEADERS = {'content-type', 'retry-after'}
+
+# State files redirected to a scratch directory for regression runs, so they start clean and leave real data alone
+STATE_ENV_VARS = {
+    'ACCOUNT_REGISTRY_FILE': 'accounts.sqlite3',
+    'ENDPOINT_STATS_FILE': 'endpoint_stats.json',
+    'IMAGE_STORE_DIR': 'images',
+    'LINEAGE_FILE': 'lineage.jsonl',
+    'RAPIDAPI_USAGE_FILE': 'rapidapi_usage.json',
+    'SEEN_STORE_DIR': 'seen',
+    'SNAPSHOT_DIR': 'snapshots',
+    'WATERMARKS_FILE': 'watermarks.json',
+    'YIELD_STATS_FILE': 'yield_stats.json',
+    'QUOTA_BROKER_SOCKET': 'no_broker.sock'
+}
+
+class CassetteMiss(requests.exceptions.RequestException):
+    """
+    Raised in replay mode for a request the cassette has no response for
+    Retrying can't fix it, so the HTTP layer passes it straight up
+    """
+
+def replaying():
+    """
+    Function to tell whether responses come from a cassette, nothing is sent so there are no keys or rate limits to respect
+    """
+    return bool(HTTP_CASSETTE) and HTTP_CASSETTE_MODE == 'replay'
+
+def _secrets():
+    values = [os.getenv(name) for name in SECRET_ENV_VARS]
+    for entry in (os.getenv('RAPIDAPI_KEYS') or '').split(','):
+        values.append(entry.strip().split(':')[0])
+    return [value for value in values if value]
+
+def _redact(text):
+    for secret in _secrets():
+        text = text.replace(secret, 'REDACTED')
+    return text
+
+def _normalize_url(url):
+    """
+    Function to get a stable, secret-free form of a url (query parameters sorted, api keys removed)
+    """
+    parts = urlparse(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in SECRET_QUERY_PARAMS)
+    return _redact(urlunparse(parts._replace(query=urlencode(query))))
+
+def _body_digest(request):
+    body = request.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    # Multipart boundaries are random, replace them so uploads match between runs
+    match = re.search(r'boundary=([^;\s]+)', request.headers.get('Content-Type', ''))
+    if match:
+        body = body.replace(match.group(1).encode('utf-8'), b'BOUNDARY')
+    for secret in _secrets():
+        body = body.replace(secret.encode('utf-8'), b'REDACTED')
+    return hashlib.sha256(body).hexdigest()[:16]
+
+def _endpoint(url):
+    parts = urlparse(url)
+    if 'airtable' in parts.netloc:
+        return 'airtable'
+    if 'picpurify' in parts.netloc:
+        return 'picpurify'
+    if 'rapidapi' in parts.netloc:
+        return parts.path.rstrip('/').rsplit('/', 1)[-1]
+    return parts.netloc
+
+class _Cassette:
+    """
+    The entries of one cassette file, shared by every adapter mounted on it
+    (the API and image sessions record into the same file, so writes and replays go through one lock)
+    """
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.lock = threading.Lock()
+        self.exact = {}
+        self.loose = {}
+        if mode == 'replay':
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _load(self):
+        with open(self.path, 'r') as f:
+            for line in f:
+                entry = json.loads(line)
+                self.exact.setdefault(entry['key'], deque()).append(entry)
+                self.loose.setdefault(entry['loose_key'], deque()).append(entry)
+
+    def append(self, entry):
+        line = json.dumps(entry) + '\n'
+        with self.lock, open(self.path, 'a') as f:
+            f.write(line)
+
+    def take(self, key, loose_key):
+        """
+        Function to pop the recorded entry for a request, None if there isn't one left
+        """
+        with self.lock:
+            if self.exact.get(key):
+                entry = self.exact[key].popleft()
+                self.loose[loose_key].remove(entry)
+                return entry
+            if self.loose.get(loose_key):
+                entry = self.loose[loose_key].popleft()
+                self.exact[entry['key']].remove(entry)
+                return entry
+            return None
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+def _open_cassette(path, mode):
+    with _cassettes_lock:
+        key = (os.path.abspath(path), mode)
+        if key not in _cassettes:
+            _cassettes[key] = _Cassette(path, mode)
+        return _cassettes[key]
+
+class CassetteAdapter(HTTPAdapter):
+    """
+    Transport adapter that records responses to, or replays them from, a JSONL cassette
+    Requests are matched on method, url and body; if the body differs (e.g. a timestamp in a PATCH)
+    the next recorded response for the same method and url is used
+    """
+
+    def __init__(self, path, mode, speed=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.cassette = _open_cassette(path, mode)
+        self.lock = threading.Lock()
+        self.request_counts = {}
+        self.replayed_seconds = 0.0
+        self.misses = 0
+
+    def _count(self, request):
+        with self.lock:
+            endpoint = _endpoint(request.url)
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+    def send(self, request, **kwargs):
+        self._count(request)
+        url = _normalize_url(request.url)
+        loose_key = f"{request.method} {url}"
+        key = f"{loose_key} {_body_digest(request)}"
+        if self.mode == 'replay':
+            return self._replay(request, key, loose_key)
+
+        started = time.monotonic()
+        response = super().send(request, **kwargs)
+        entry = {
+            'key': key,
+            'loose_key': loose_key,
+            'method': request.method,
+            'url': url,
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {k: v for k, v in response.headers.items() if k.lower() in RECORDED_HEADERS},
+            'body': base64.b64encode(response.content).decode('ascii'),
+            'elapsed': round(time.monotonic() - started, 4)
+        }
+        self.cassette.append(entry)
+        return response
+
+    def _replay(self, request, key, loose_key):
+        entry = self.cassette.take(key, loose_key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                raise CassetteMiss(f"No recorded response for {loose_key}", request=request)
+            self.replayed_seconds += entry['elapsed']
+
+        if self.speed:
+            time.sleep(entry['elapsed'] * self.speed)
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = base64.b64decode(entry['body'])
+        response.url = request.url
+        response.request = request
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+_adapters = []
+
+def mount_cassette(session, **adapter_kwargs):
+    """
+    Function to put a session's https traffic through the cassette when HTTP_CASSETTE is set
+    adapter_kwargs are the HTTPAdapter pool settings the session would otherwise mount with
+    """
+    if not HTTP_CASSETTE:
+        return None
+    adapter = CassetteAdapter(HTTP_CASSETTE, HTTP_CASSETTE_MODE, HTTP_REPLAY_SPEED, **adapter_kwargs)
+    session.mount('https://', adapter)
+    _adapters.append(adapter)
+    return adapter
+
+def cassette_report():
+    """
+    Function to sum request counts and replay stats over every mounted cassette adapter
+    """
+    counts = {}
+    for adapter in _adapters:
+        for endpoint, count in adapter.request_counts.items():
+            counts[endpoint] = counts.get(endpoint, 0) + count
+    return {
+        'requests': counts,
+        'total_requests': sum(counts.values()),
+        'misses': sum(adapter.misses for adapter in _adapters)
+    }
+
+def compare_to_baseline(report, baseline, wall_tolerance):
+    """
+    Function to list regressions against a saved report: more requests to any endpoint, or slower wall time
+    """
+    problems = []
+    for endpoint, count in report['requests'].items():
+        expected = baseline['requests'].get(endpoint, 0)
+        if count > expected:
+            problems.append(f"{endpoint}: {count} requests, baseline {expected}")
+    limit = baseline['wall_seconds'] * (1 + wall_tolerance)
+    if report['wall_seconds'] > limit:
+        problems.append(f"wall time {report['wall_seconds']:.1f}s, baseline {baseline['wall_seconds']:.1f}s (+{wall_tolerance:.0%} allowed)")
+    if report['misses']:
+        problems.append(f"{report['misses']} requests had no recorded response")
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a pipeline entry point against a cassette and report its request count and wall time",
+        epilog="e.g. python cassette.py record posts.jsonl fetch_location_posts:process_location_posts --kwargs '{\"budget\": 20}'")
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('cassette', help="cassette file (JSONL)")
+    parser.add_argument('entry', help="module:function to run, e.g. gender_label:process_gender_labels")
+    parser.add_argument('--kwargs', default='{}', help="JSON keyword arguments for the function")
+    parser.add_argument('--speed', type=float, default=HTTP_REPLAY_SPEED, help="replay latency multiplier (0 = instant)")
+    parser.add_argument('--save-report', metavar='FILE', help="write the run's report as JSON, e.g. as a baseline")
+    parser.add_argument('--baseline', metavar='FILE', help="exit 1 if the run makes more requests or is slower than this report")
+    parser.add_argument('--wall-tolerance', type=float, default=0.2, help="allowed wall time increase over the baseline")
+    args = parser.parse_args()
+
+    # Must be set before the pipeline modules are imported, they read these at import time
+    state_dir = tempfile.mkdtemp(prefix='cassette-state-')
+    for name, filename in STATE_ENV_VARS.items():
+        os.environ[name] = os.path.join(state_dir, filename)
+    os.environ['HTTP_CASSETTE'] = HTTP_CASSETTE = args.cassette
+    os.environ['HTTP_CASSETTE_MODE'] = HTTP_CASSETTE_MODE = args.mode
+    HTTP_REPLAY_SPEED = args.speed
+    sys.modules.setdefault('cassette', sys.modules[__name__])
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "suggested_accounts"))
+
+    module_name, function_name = args.entry.split(':')
+    entry_point = getattr(importlib.import_module(module_name), function_name)
+
+    started = time.monotonic()
+    entry_point(**json.loads(args.kwargs))
+    report = cassette_report()
+    report['wall_seconds'] = round(time.monotonic() - started, 2)
+    report['entry'] = args.entry
+
+    print(f"\n{args.entry} ({args.mode}): {report['total_requests']} requests in {report['wall_seconds']:.1f}s")
+    for endpoint, count in sorted(report['requests'].items()):
+        print(f"  {endpoint:<20} {count:>6}")
+    print(f"State files written to {state_dir}")
+
+    if args.save_report:
+        with open(args.save_report, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            problems = compare_to_baseline(report, json.load(f), args.wall_tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        sys.exit(1 if problems else 0)
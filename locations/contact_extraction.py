@@ -0,0 +1,263 @@
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from account_registry import LOCATION_POSTS, BUSINESS_NETWORK, NETWORK
+from airtable import fetch_all, update_records
+from batch_writer import AIRTABLE_BATCH_SIZE, BatchWriter
+from enrichment import enriched_at
+from profiling import add_profile_argument, mark_stage, profile_run
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+# Contact details parsed out of the text we already store (post captions, bios and bio links)
+# so contactable leads show up without an extra /v1/info call per account
+# Text is parsed in chunks on a process pool (the regexes are CPU bound, threads wouldn't help)
+# and results are written back as fields, 10 records per PATCH
+CONTACT_WORKERS = int(os.getenv('CONTACT_WORKERS', 0))  # 0 = one per CPU
+CONTACT_CHUNK_SIZE = int(os.getenv('CONTACT_CHUNK_SIZE', 500))
+
+# Link-in-bio and fan sites, plus messaging links
+LINK_DOMAINS = [domain.strip() for domain in os.getenv('CONTACT_LINK_DOMAINS', ','.join([
+    'linktr.ee', 'onlyfans.com', 'fansly.com', 'fanvue.com', 'patreon.com', 'beacons.ai', 'allmylinks.com',
+    'linkin.bio', 'lnk.bio', 'hoo.be', 'snipfeed.co', 'solo.to', 'bio.link', 'campsite.bio', 't.me', 'wa.me'
+])).split(',') if domain.strip()]
+
+EMAIL_RE = re.compile(r'[a-z0-9][a-z0-9._%+-]*@[a-z0-9-]+(?:\.[a-z0-9-]+)*\.[a-z]{2,}', re.IGNORECASE)
+# "name [at] gmail [dot] com" style spellings, rewritten to plain addresses before matching
+OBFUSCATED_AT_RE = re.compile(r'\s*[\[(]\s*at\s*[\])]\s*', re.IGNORECASE)
+OBFUSCATED_DOT_RE = re.compile(r'\s*[\[(]\s*dot\s*[\])]\s*', re.IGNORECASE)
+# Digit groups with at most one separator between them, optionally led by +country code and an (area code)
+PHONE_RE = re.compile(r'(?<![\w+])(?:\+\d{1,3}[ .-]?)?(?:\(\d{1,4}\)[ .-]?)?\d{2,}(?:[ .-]\d{2,})*(?![\w+])')
+# Without a +country code or (area code) a phone has to be one unbroken run of 10-15 digits or use one of
+# these group layouts, anything else is separate numbers that happen to sit next to each other
+PHONE_GROUP_LAYOUTS = [
+    (3, 3, 4),        # 555 123 4567
+    (3, 4, 4),        # 138 1234 5678
+    (4, 3, 3),        # 0612 345 678
+    (4, 3, 4),        # 0201 234 5678
+    (5, 6),           # 07946 095858
+    (5, 3, 3),        # 07946 095 858
+    (2, 2, 2, 2, 2)   # 06 12 34 56 78, only with a leading 0 (trunk prefix)
+]
+LINK_RE = re.compile(
+    r'(?:https?://)?(?:www\.)?((?:' + '|'.join(re.escape(domain) for domain in LINK_DOMAINS) + r')/[a-z0-9._~-]+)',
+    re.IGNORECASE)
+# Mentions, not the local part of an email address
+HANDLE_RE = re.compile(r'(?<![\w.@])@([a-z0-9._]{1,30})', re.IGNORECASE)
+
+# Captions and bios the phone pattern has to get right, run `python contact_extraction.py --check` after changing it
+PHONE_CHECKS = [
+    ("📞 +1 (555) 123-4567", ['+15551234567']),
+    ("+44 20 7946 0958", ['+442079460958']),
+    ("whatsapp 555-123-4567, 555-987-6543", ['5551234567', '5559876543']),
+    ("call 0612345678", ['0612345678']),
+    ("met in 2020 5551234567", ['5551234567']),
+    ("since 1999 10000000 followers", []),
+    ("10000000 followers 2000000 likes", []),
+    ("est. 2015 - 12 000 000 views", []),
+    ("trips 2019 2020 2021 2022", []),
+    ("2019-2024", []),
+    ("2024-05-06", []),
+    ("price 1500000", []),
+    ("1 2 3 4 5 6 7 8 9 10", []),
+    ("top 10 20 30 40 50 60 ranks", []),
+    ("scores 99 98 97 96 95", []),
+    ("views 1500000 2500000", []),
+    ("Order #123456 12345", []),
+    ("06 12 34 56 78", ['0612345678']),
+    ("2019 555.123.4567", ['5551234567']),
+    ("prices 100 200 300 4000", [])
+]
+
+# Source text fields and (emails, phones, links, handles, contactable, extracted at) output fields per table
+CONTACT_TABLES = {
+    LOCATION_POSTS: (os.getenv('AIRTABLE_LOCATION_POSTS_TABLE'), ('Post Caption',),
+                     ('Contact Emails', 'Contact Phones', 'Contact Links', 'Contact Handles', 'Contactable', 'Contacts Extracted At')),
+    BUSINESS_NETWORK: (os.getenv('AIRTABLE_BUSINESS_NETWORK_TABLE'), ('Bio', 'Bio Link'),
+                       ('Contact Emails', 'Contact Phones', 'Contact Links', 'Contact Handles', 'Contactable', 'Contacts Extracted At')),
+    NETWORK: (os.getenv('AIRTABLE_NETWORK_TABLE'), ('bio', 'bio_link'),
+              ('contact_emails', 'contact_phones', 'contact_links', 'contact_handles', 'contactable', 'contacts_extracted_at'))
+}
+
+def _unique(values):
+    return list(dict.fromkeys(values))
+
+def _grouped_phones(candidate):
+    """
+    Function to find the phone numbers in a PHONE_RE match without a country or area code
+    The match is cut into runs of groups joined by the same separator ("2019 555.123.4567" is "2019 555" and
+    "555.123.4567"), a run is a phone if its groups are exactly one of PHONE_GROUP_LAYOUTS, the groups
+    left over only if they are a single 10-15 digit run
+    """
+    tokens = re.split(r'([ .-])', candidate)
+    groups, separators = tokens[::2], tokens[1::2]
+    runs = [[0]]
+    for i, separator in enumerate(separators):
+        if i and separator != separators[i - 1]:
+            runs.append([i])
+        runs[-1].append(i + 1)
+    found = {}
+    for run in runs:
+        layout = tuple(len(groups[i]) for i in run)
+        if (layout in PHONE_GROUP_LAYOUTS and (len(layout) < 5 or groups[run[0]].startswith('0'))
+                and not any(i in found for i in run)):
+            found.update((i, run[0]) for i in run)
+    phones = []
+    for i, group in enumerate(groups):
+        if found.get(i) == i:
+            phones.append(''.join(groups[j] for j in found if found[j] == i))
+        elif i not in found and 10 <= len(group) <= 15:
+            phones.append(group)
+    return phones
+
+def extract_phones(text):
+    phones = []
+    for match in PHONE_RE.finditer(text):
+        candidate = match.group()
+        digits = re.sub(r'\D', '', candidate)
+        # A +country code or (area code) is phone-like grouping on its own
+        if candidate.startswith('+') or '(' in candidate:
+            if 8 <= len(digits) <= 15:
+                phones.append(('+' if candidate.startswith('+') else '') + digits)
+            continue
+        phones.extend(_grouped_phones(candidate))
+    return phones
+
+def check_phone_patterns():
+    """
+    Function to run extract_phones over PHONE_CHECKS, printing any mismatch, True if all pass
+    """
+    failures = 0
+    for text, expected in PHONE_CHECKS:
+        found = extract_phones(text)
+        if found != expected:
+            failures += 1
+            print(f"{text!r}: expected {expected}, got {found}")
+    print(f"{len(PHONE_CHECKS) - failures} of {len(PHONE_CHECKS)} phone checks passed")
+    return not failures
+
+def extract_contacts(text):
+    """
+    Function to pull emails, phone numbers, link-in-bio / fan site links and @handles out of a caption or bio
+    """
+    if not text:
+        return {'emails': [], 'phones': [], 'links': [], 'handles': []}
+    deobfuscated = OBFUSCATED_DOT_RE.sub('.', OBFUSCATED_AT_RE.sub('@', text))
+    return {
+        'emails': _unique(email.lower() for email in EMAIL_RE.findall(deobfuscated)),
+        'phones': _unique(extract_phones(text)),
+        'links': _unique(link.lower().rstrip('.') for link in LINK_RE.findall(text)),
+        'handles': _unique(handle.lower().rstrip('.') for handle in HANDLE_RE.findall(text))
+    }
+
+def extract_batch(texts):
+    """
+    Function for the process pool workers, one chunk of texts per task keeps the pickling overhead low
+    """
+    return [extract_contacts(text) for text in texts]
+
+def extract_all(texts, workers=None, chunk_size=CONTACT_CHUNK_SIZE):
+    """
+    Function to extract the contacts of many texts, in order, yielding one chunk of results at a time
+    Small inputs (or workers=1) are parsed in this process, starting the pool would cost more than it saves
+    """
+    workers = workers or CONTACT_WORKERS or os.cpu_count() or 1
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield extract_batch(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        yield from executor.map(extract_batch, chunks)
+
+def pending_formula(source_fields, extracted_field, include_extracted=False):
+    """
+    Function to build the filterByFormula for rows with text that was never parsed or changed since
+    """
+    has_text = f"OR({', '.join(f'{{{field}}}' for field in source_fields)})"
+    if include_extracted:
+        return has_text
+    stale = (f"OR({{{extracted_field}}} = BLANK(), IS_AFTER(LAST_MODIFIED_TIME({', '.join(f'{{{field}}}' for field in source_fields)}), "
+             f"{{{extracted_field}}}))")
+    return f"AND({has_text}, {stale})"
+
+def contact_fields(contacts, output_fields):
+    emails, phones, links, handles, contactable, extracted = output_fields
+    return {
+        emails: ', '.join(contacts['emails']) or None,
+        phones: ', '.join(contacts['phones']) or None,
+        links: ', '.join(contacts['links']) or None,
+        handles: ', '.join(contacts['handles']) or None,
+        contactable: bool(contacts['emails'] or contacts['phones'] or contacts['links']),
+        extracted: enriched_at()
+    }
+
+def extract_table_contacts(table, workers=None, include_extracted=False, dry_run=False):
+    """
+    Function to parse the contacts of every new or changed row of a table and write them back
+    include_extracted re-parses rows that were already done (e.g. after adding link domains)
+    Returns a dict of parsed / contactable / written counts
+    """
+    airtable_table, source_fields, output_fields = CONTACT_TABLES[table]
+    counts = {'parsed': 0, 'contactable': 0, 'written': 0}
+    if not airtable_table:
+        print(f"No Airtable table configured for {table}, skipping")
+        return counts
+
+    mark_stage(f'fetch {table}')
+    records = fetch_all(airtable_table, {
+        'fields[]': list(source_fields),
+        'filterByFormula': pending_formula(source_fields, output_fields[-1], include_extracted)
+    })
+    if not records:
+        print(f"No {table} rows need contact extraction")
+        return counts
+    texts = ['\n'.join(str(record.get('fields', {}).get(field) or '') for field in source_fields) for record in records]
+    print(f"Parsing {len(texts)} {table} rows")
+
+    mark_stage(f'extract {table}')
+    started = time.monotonic()
+    writer = None if dry_run else BatchWriter(
+        lambda batch: update_records(airtable_table, batch, f'{table} contacts') == len(batch),
+        batch_size=AIRTABLE_BATCH_SIZE * 10,
+        label=f'{table} contact rows'
+    )
+    position = 0
+    for results in extract_all(texts, workers):
+        batch = []
+        for record, contacts in zip(records[position:position + len(results)], results):
+            fields = contact_fields(contacts, output_fields)
+            counts['contactable'] += fields[output_fields[4]]
+            batch.append({"id": record['id'], "fields": fields})
+        position += len(results)
+        counts['parsed'] += len(results)
+        if writer and not writer.submit(batch):
+            break
+    elapsed = time.monotonic() - started
+
+    if writer:
+        if not writer.close():
+            print("Stopped after a failed write, re-run to continue (written rows are skipped)")
+        counts['written'] = writer.written
+    print(f"{table}: parsed {counts['parsed']} rows in {elapsed:.1f}s ({counts['parsed'] / max(elapsed, 1e-6):.0f}/s), "
+          f"{counts['contactable']} contactable, {counts['written']} written")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract emails, phone numbers, links and handles from captions and bios")
+    parser.add_argument('--table', choices=list(CONTACT_TABLES), help="only this table (default: every table)")
+    parser.add_argument('--all', action='store_true', help="re-parse rows that were already extracted")
+    parser.add_argument('--workers', type=int, help="parser processes (default: one per CPU)")
+    parser.add_argument('--dry-run', action='store_true', help="parse and count without writing anything")
+    parser.add_argument('--check', action='store_true', help="only run the phone pattern checks (PHONE_CHECKS)")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(0 if check_phone_patterns() else 1)
+    with profile_run('extract_contacts', args.profile):
+        for table in ([args.table] if args.table else list(CONTACT_TABLES)):
+            extract_table_contacts(table, workers=args.workers, include_extracted=args.all, dry_run=args.dry_run)
@@ -0,0 +1,125 @@
+import atexit
+import json
+import math
+import os
+import tempfile
+import threading
+from collections import deque
+
+# Measured per-endpoint latency and page size, used by planner.py to estimate runs
+# Endpoint names are the last part of the RapidAPI url path, plus 'airtable' and 'picpurify'
+STATS_FILE = os.getenv('ENDPOINT_STATS_FILE') or os.path.join(os.path.dirname(__file__), "..", "data", "endpoint_stats.json")
+
+# Used until we have measurements of our own
+DEFAULT_STATS = {
+    'search_location': {'latency': 1.5, 'page_size': 50},
+    'location_posts': {'latency': 1.5, 'page_size': 20},
+    'followers': {'latency': 1.5, 'page_size': 50},
+    'info': {'latency': 1.5, 'page_size': 1},
+    'similar_accounts': {'latency': 1.5, 'page_size': 80},
+    'airtable': {'latency': 0.3, 'page_size': 100},
+    'picpurify': {'latency': 2.0, 'page_size': 1}
+}
+
+ENDPOINT_SERVICES = {
+    'airtable': 'airtable',
+    'picpurify': 'picpurify'
+}
+
+# Measurements are an exponential moving average, this is the smallest weight a new sample gets
+MIN_SAMPLE_WEIGHT = 0.05
+# Recent latencies kept in memory per endpoint for percentiles (used to time hedged requests)
+LATENCY_WINDOW = 200
+
+_lock = threading.Lock()
+_stats = None
+_recent_latencies = {}
+
+def _load():
+    global _stats
+    if _stats is None:
+        try:
+            with open(STATS_FILE, 'r') as f:
+                _stats = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _stats = {}
+        atexit.register(save_stats)
+    return _stats
+
+def _record(endpoint, metric, value):
+    with _lock:
+        stats = _load().setdefault(endpoint, {})
+        count = stats.get(f'{metric}_samples', 0) + 1
+        weight = max(1.0 / count, MIN_SAMPLE_WEIGHT)
+        previous = stats.get(metric, value)
+        stats[metric] = previous + weight * (value - previous)
+        stats[f'{metric}_samples'] = count
+
+def record_latency(endpoint, seconds, sample=True):
+    """
+    Function to record how long a call to an endpoint took
+    sample=False leaves it out of the percentile window (e.g. a hedged call, which is faster than a single request)
+    """
+    _record(endpoint, 'latency', seconds)
+    if sample:
+        record_latency_sample(endpoint, seconds)
+
+def record_latency_sample(endpoint, seconds):
+    """
+    Function to add a single request's latency to the endpoint's percentile window
+    """
+    with _lock:
+        _recent_latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+def latency_percentile(endpoint, fraction, min_samples=1):
+    """
+    Function to get a percentile of the endpoint's recent latencies this run, None with fewer than min_samples
+    """
+    with _lock:
+        samples = sorted(_recent_latencies.get(endpoint, ()))
+    if len(samples) < max(min_samples, 1):
+        return None
+    return samples[min(len(samples) - 1, max(0, math.ceil(fraction * len(samples)) - 1))]
+
+def record_page_size(endpoint, items):
+    """
+    Function to record how many items a page from an endpoint returned
+    """
+    _record(endpoint, 'page_size', items)
+
+def get_stat(endpoint, metric):
+    """
+    Function to get the measured value for an endpoint, falling back to the defaults
+    """
+    with _lock:
+        measured = _load().get(endpoint, {}).get(metric)
+    if measured is not None:
+        return measured
+    return DEFAULT_STATS.get(endpoint, {}).get(metric, DEFAULT_STATS['info'][metric])
+
+def is_measured(endpoint, metric):
+    with _lock:
+        return _load().get(endpoint, {}).get(f'{metric}_samples', 0) > 0
+
+def service_for(endpoint):
+    return ENDPOINT_SERVICES.get(endpoint, 'rapidapi')
+
+def endpoint_from_url(url):
+    """
+    Function to get the endpoint name from a RapidAPI url, e.g. .../v1/location_posts -> location_posts
+    """
+    return url.split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+
+def save_stats():
+    """
+    Function to persist the measurements for the next run
+    """
+    with _lock:
+        if not _stats:
+            return
+        data = json.dumps(_stats, indent=2, sort_keys=True)
+    os.makedirs(os.path.dirname(STATS_FILE), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(STATS_FILE), prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        f.write(data)
+    os.replace(tmp_path, STATS_FILE)
@@ -0,0 +1,84 @@
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from batch_writer import BatchWriter
+from endpoint_stats import get_stat
+from rapidapi_keys import get_key_pool
+from lineage import record_span, ENRICHED
+
+# Shared engine for the profile enrichment pipelines:
+# lookups run on a bounded thread pool (the RapidAPI key pool paces the actual calls)
+# and results are written back through one BatchWriter in 10-record PATCHes
+ENRICH_WORKERS = int(os.getenv('ENRICH_WORKERS', 0))  # 0 = size the pool from the rate limit
+MAX_ENRICH_WORKERS = 32
+
+def enriched_at():
+    """
+    Function to get the timestamp written to a record's enriched at field
+    """
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+def stale_formula(field, ttl_days=None):
+    """
+    Function to build an Airtable filterByFormula for rows never enriched, or enriched more than ttl_days ago
+    """
+    never_enriched = f"{{{field}}} = BLANK()"
+    if not ttl_days:
+        return never_enriched
+    return f"OR({never_enriched}, IS_BEFORE({{{field}}}, DATEADD(NOW(), -{ttl_days:g}, 'days')))"
+
+def default_workers(endpoint):
+    """
+    Function to pick a pool size that keeps the RapidAPI rate limit busy
+    Enough concurrent calls to cover the endpoint's latency at the combined rate of all keys
+    """
+    if ENRICH_WORKERS:
+        return ENRICH_WORKERS
+    rate = sum(1.0 / k['min_interval'] for k in get_key_pool().keys if k['min_interval'])
+    if not rate:
+        return 4
+    return max(1, min(MAX_ENRICH_WORKERS, math.ceil(rate * get_stat(endpoint, 'latency')) + 1))
+
+def enrich_records(records, lookup, build_fields, write_batch, workers, label='records', pk_id_field=None, pipeline=None):
+    """
+    Function to enrich records concurrently and write the results back in batches
+    lookup(record) fetches the data for one record on a worker thread, returning None if there is nothing to write
+    build_fields(record, data) turns the data into the fields to update
+    write_batch(records) writes up to 10 {"id", "fields"} records, returning a truthy value on success
+    pk_id_field names the field holding the pk id, used for the lineage span written once a record is saved
+    Returns a dict of enriched / failed counts
+    """
+    counts = {'enriched': 0, 'failed': 0}
+    writer = BatchWriter(write_batch, label=label)
+
+    def timed_lookup(record):
+        started = time.time()
+        return started, lookup(record)
+
+    def traced(pk_id, started):
+        return lambda: record_span(pk_id, ENRICHED, started, pipeline=pipeline)
+
+    print(f"Enriching {len(records)} {label} with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(timed_lookup, record): record for record in records}
+        for future in as_completed(futures):
+            record = futures[future]
+            started, data = future.result()
+            if data is None:
+                counts['failed'] += 1
+                continue
+            pk_id = record.get('fields', {}).get(pk_id_field) if pk_id_field else None
+            if not writer.submit([{"id": record.get('id'), "fields": build_fields(record, data)}],
+                                 callback=traced(pk_id, started) if pk_id_field else None):
+                # A write failed, don't spend API calls on results we can't save
+                for pending in futures:
+                    pending.cancel()
+                break
+            counts['enriched'] += 1
+
+    if not writer.close():
+        print(f"Stopped early after a failed write, unsaved {label} will be picked up next run")
+    print(f"Enriched {counts['enriched']} {label}, {counts['failed']} lookups failed")
+    return counts
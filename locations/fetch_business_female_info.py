@@ -1,8 +1,13 @@
+import argparse
 import os
 from dotenv import load_dotenv
 from instagram import get_user_info
-from airtable import update_business_network_gender
-import requests
+from airtable import fetch_all, update_business_network_records
+from planner import Plan, add_plan_arguments, airtable_read_calls, airtable_write_calls
+from account_registry import get_registry
+from enrichment import enrich_records, enriched_at, stale_formula, default_workers
+from profiling import add_profile_argument, mark_stage, profile_run
+from lead_scoring import rank_by_lead_score
 
 # Get Airtable credentials from .env
 AIRTABLE_API_KEY = os.getenv('AIRTABLE_API_KEY')
@@ -14,105 +19,116 @@ AIRTABLE_BUSINESS_TARGETS_TABLE = os.getenv('AIRTABLE_BUSINESS_TARGETS_TABLE')
 AIRTABLE_BUSINESS_NETWORK_TABLE = os.getenv('AIRTABLE_BUSINESS_NETWORK_TABLE')
 AIRTABLE_BUSINESS_NETWORK_FEMALE_VIEW = os.getenv('AIRTABLE_BUSINESS_NETWORK_FEMALE_VIEW')
 
+# Accounts are re-enriched once their Enriched At is older than this many days (0 = enrich once only)
+ENRICH_TTL_DAYS = float(os.getenv('ENRICH_TTL_DAYS', 30))
+
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
 
-def fetch_female_business_accounts(offset=None, all_records=None):
+def fetch_female_business_accounts(ttl_days=ENRICH_TTL_DAYS):
     """
     Function to fetch female accounts from Business Network table using a filtered view
+    Only accounts never enriched, or enriched more than ttl_days ago, are returned
     """
-    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_BUSINESS_NETWORK_TABLE}?view={os.getenv("AIRTABLE_BUSINESS_NETWORK_FEMALE_VIEW")}'
-    headers = {
-        'Authorization': f'Bearer {AIRTABLE_API_KEY}',
-    }
+    return fetch_all(AIRTABLE_BUSINESS_NETWORK_TABLE, {
+        'view': AIRTABLE_BUSINESS_NETWORK_FEMALE_VIEW,
+        'filterByFormula': stale_formula('Enriched At', ttl_days)
+    })
 
-    if all_records is None:
-        all_records = []
-        
-    query_params = {}
-    if offset:
-        query_params['offset'] = offset
+def plan_female_business_info(accounts, workers=1):
+    """
+    Function to estimate the calls needed to fetch info for every pending female account
+    """
+    plan = Plan('process_female_business_info', concurrency=workers)
+    plan.add_fixed({'airtable': airtable_read_calls(len(accounts)) + airtable_write_calls(len(accounts))})
 
-    response = requests.get(url, headers=headers, params=query_params)
-    response.raise_for_status()
-    data = response.json()
-    
-    all_records.extend(data.get('records', []))
-    
-    if 'offset' in data:
-        return fetch_female_business_accounts(data['offset'], all_records)
-    else:
-        return all_records
+    for account in accounts:
+        fields = account.get('fields', {})
+        if not fields.get('Username'):
+            continue
+        plan.add_item(fields.get('Username'), account, {'info': 1})
+
+    plan.add_note("accounts with a fresh profile in the account registry are counted as API calls")
+    return plan
 
-def update_account_info(record_id, update_data):
+def lookup_account_info(account, ttl_days=ENRICH_TTL_DAYS):
     """
-    Function to update business account info in Business Network table
+    Function to get the Instagram info for an account, from the account registry if it was fetched within ttl_days
+    Returns (info, fetched at), fetched at is None for info fetched just now
     """
-    url = f'https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_BUSINESS_NETWORK_TABLE}/{record_id}'
-    headers = {
-        'Authorization': f'Bearer {AIRTABLE_API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    
-    payload = {
-        "fields": update_data
+    fields = account.get('fields', {})
+    username = fields.get('Username')
+
+    # Get Instagram user info, looked up once across all our tables
+    registry = get_registry()
+    info, fetched_at = registry.get_profile_fetched(fields.get('Pk Id'), username, max_age_days=ttl_days or None)
+    if info:
+        return info, fetched_at
+
+    user_info = get_user_info(username)
+    if not user_info or 'data' not in user_info:
+        print(f"Could not get user info for {username}")
+        return None
+    registry.record_profile(user_info['data'])
+    return user_info['data'], None
+
+def account_info_fields(account, lookup):
+    # Info from the registry is as old as its fetch, so Enriched At keeps that time and the ttl still applies to it
+    info, fetched_at = lookup
+    return {
+        "Bio": info.get('biography'),
+        "Bio Link": info.get('external_url'),
+        "Follower Count": info.get('follower_count'),
+        "Following Count": info.get('following_count'),
+        "Enriched At": fetched_at or enriched_at()
     }
-    
-    try:
-        response = requests.patch(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return True
-    except requests.exceptions.RequestException as e:
-        print(f"Error updating account info: {e}")
-        return False
 
-def process_female_business_info():
+def process_female_business_info(plan_only=False, budget=None, ttl_days=ENRICH_TTL_DAYS, workers=None):
     """
     Function to:
-    1. Fetch female accounts from Business Network table
-    2. Get additional Instagram info for each account
-    3. Update Airtable with the new info
+    1. Fetch female accounts from Business Network table that are new or past the re-enrichment ttl
+    2. Get additional Instagram info for each account concurrently (from the account registry if it was fetched recently)
+    3. Update Airtable with the new info and an Enriched At timestamp, 10 accounts per request
+    plan_only prints the estimated cost instead, budget limits the run to the accounts that fit in that many RapidAPI calls
     """
+    workers = workers or default_workers('info')
     
     # Get female accounts that need info fetched
-    accounts = fetch_female_business_accounts()
+    mark_stage('fetch accounts')
+    accounts = [account for account in fetch_female_business_accounts(ttl_days) if account.get('fields', {}).get('Username')]
     if not accounts:
         print("No female business accounts found needing info fetch")
         return
         
     print(f"Found {len(accounts)} female business accounts to process")
-    
-    for account in accounts:
-        if account.get('Follower Count'):
-            continue # skip already scraped accounts
-        record_id = account.get('id')
-        username = account.get('fields', {}).get('Username')
-        
-        if not username:
-            print("No username found for account, skipping")
-            continue
-            
-        print(f"\nProcessing info for {username}")
-        
-        # Get Instagram user info
-        user_info = get_user_info(username)
-        if not user_info or 'data' not in user_info:
-            print(f"Could not get user info for {username}")
-            continue
-        
-        # Extract relevant info
-        info = user_info['data']
-        update_data = {
-            "Bio": info.get('biography'),
-            "Bio Link": info.get('external_url'),
-            "Follower Count": info.get('follower_count'),
-            "Following Count": info.get('following_count'),
-        }
-        
-        # Update Airtable
-        if update_account_info(record_id, update_data):
-            print(f"Updated info for {username}")
-        else:
-            print(f"Failed to update info for {username}")
+    # Best leads first, so a budget-limited or interrupted run enriches those
+    accounts = rank_by_lead_score(accounts, 'Pk Id')
+
+    if plan_only or budget is not None:
+        plan = plan_female_business_info(accounts, workers)
+        if plan_only:
+            plan.print_summary(budget)
+            return
+        accounts = plan.fit_to_budget(budget)
+
+    mark_stage('enrich')
+    enrich_records(
+        accounts,
+        lambda account: lookup_account_info(account, ttl_days),
+        account_info_fields,
+        update_business_network_records,
+        workers,
+        label='female business accounts',
+        pk_id_field='Pk Id',
+        pipeline='female_business_info'
+    )
 
 if __name__ == "__main__":
-    process_female_business_info()
+    parser = argparse.ArgumentParser(description="Fetch Instagram info for female Business Network accounts")
+    add_plan_arguments(parser)
+    add_profile_argument(parser)
+    parser.add_argument('--ttl-days', type=float, default=ENRICH_TTL_DAYS,
+                        help="re-enrich accounts whose Enriched At is older than this many days (0 = never)")
+    parser.add_argument('--workers', type=int, help="concurrent lookups (default: enough to keep the RapidAPI rate limit busy)")
+    args = parser.parse_args()
+    with profile_run('process_female_business_info', args.profile):
+        process_female_business_info(plan_only=args.plan, budget=args.budget, ttl_days=args.ttl_days, workers=args.workers)
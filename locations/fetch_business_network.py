@@ -1,3 +1,8 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from airtable import (
     fetch_business_targets,
     create_business_network_records,
@@ -6,126 +11,234 @@ from airtable import (
     update_target_pagination_token
 )
 from instagram import get_followers
+from image_store import prefetch_from_records, wait_for_prefetch
+from planner import Plan, add_plan_arguments, pages_for, airtable_read_calls, airtable_write_calls
+from seen_store import SeenStore, open_seen_store
+from yield_tracker import YieldTracker, add_early_stop_arguments, DEFAULT_MIN_YIELD, DEFAULT_LOW_YIELD_PAGES
+from batch_writer import BatchWriter
+from account_registry import get_registry, identity_from_fields, BUSINESS_NETWORK
+from lineage import record_spans, CREATED
+from profiling import add_profile_argument, mark_stage, profile_run
 
-def process_business_network():
+# Used by the planner for targets without a Follower Count field
+DEFAULT_TARGET_FOLLOWERS = int(os.getenv('DEFAULT_TARGET_FOLLOWERS', 1000))
+
+def plan_business_network(targets, upsert_on=None, workers=1):
+    """
+    Function to estimate the calls needed to scrape every follower of the pending targets
+    """
+    plan = Plan('process_business_network', concurrency=workers)
+    plan.add_fixed({'airtable': airtable_read_calls(len(targets))})
+
+    for target in targets:
+        fields = target.get('fields', {})
+        if not fields.get('Username'):
+            continue
+
+        followers = fields.get('Follower Count')
+        if not followers:
+            followers = DEFAULT_TARGET_FOLLOWERS
+            plan.add_note(f"targets without Follower Count are assumed to have {DEFAULT_TARGET_FOLLOWERS} followers")
+        if fields.get('Last Pagination Token'):
+            plan.add_note("targets resuming from a saved pagination token are counted from the start")
+
+        pages = pages_for('followers', followers)
+        plan.add_item(fields.get('Username'), target, {
+            'followers': pages,
+            # one pagination token save per page, the creates, then clearing the token and marking as scraped
+            'airtable': pages + airtable_write_calls(followers) + 2
+        })
+
+    if not upsert_on and not SeenStore('business_network').seeded:
+        plan.add_note("the one-off Business Network scan that seeds the dedup store is not included (table size is only known after reading it)")
+    return plan
+
+def scrape_target_followers(target, claim, writer, min_yield=DEFAULT_MIN_YIELD, low_yield_pages=DEFAULT_LOW_YIELD_PAGES):
+    """
+    Function to page through one target's followers, queueing new accounts on the shared writer
+    Runs on a worker thread next to other targets, each with its own pagination token
+    The token is only saved once the accounts from its page are written, so a restart resumes without gaps
+    claim(pk_id) returns False for accounts already stored or queued by any target
+    """
+    target_record_id = target.get('id')
+    username = target.get('fields', {}).get('Username')
+    # Get saved pagination token if exists
+    pagination_token = target.get('fields', {}).get('Last Pagination Token')
+
+    if not username:
+        print("No username found for target, skipping")
+        return
+
+    print(f"\nProcessing followers for {username}")
+    if pagination_token:
+        print(f"Continuing from previous pagination token for {username}: {pagination_token[:30]}...")
+
+    totals = {'added': 0}
+    tracker = YieldTracker('business_network', target_record_id, username, min_yield, low_yield_pages)
+
+    def page_written(token, records, page_started):
+        def save_token():
+            totals['added'] += len(records)
+            record_spans([r['fields']['Pk Id'] for r in records], CREATED, page_started, pipeline='business_network')
+            if not update_target_pagination_token(target_record_id, token):
+                print(f"Failed to save pagination token for {username}")
+        return save_token
+
+    while not writer.failed:
+        # Get followers data
+        page_started = time.time()
+        followers_data = get_followers(username, pagination_token)
+        if not followers_data or 'data' not in followers_data:
+            print(f"No followers data returned for {username}")
+            break
+
+        pagination_token = followers_data.get('pagination_token')
+
+        # Process followers
+        followers = followers_data['data'].get('items', [])
+        new_records = []
+        for follower in followers:
+            follower_username = follower.get('username')
+
+            # Skip if account exists in database or has been queued in this run
+            if not claim(follower.get('id') or follower_username):
+                continue
+
+            new_records.append({
+                "fields": {
+                    "Username": follower_username,
+                    "Full Name": follower.get('full_name'),
+                    "Profile Url": f"https://instagram.com/{follower_username}",
+                    "Targets (Business)": [target_record_id],
+                    "Pk Id": follower.get('id'),
+                    "Is Private": follower.get('is_private'),
+                    "Is Verified": follower.get('is_verified'),
+                    "Pfp Url": follower.get('profile_pic_url')
+                }
+            })
+
+        print(f"{username}: {len(new_records)} new of {len(followers)} followers on this page")
+        writer.submit(new_records, key=target_record_id, callback=page_written(pagination_token, new_records, page_started))
+        tracker.record_page(len(followers), len(new_records))
+
+        # Check for pagination token
+        if not pagination_token:
+            print(f"No more pages to fetch for {username}")
+            break
+
+        # Stop paging a follower list that has stopped producing new accounts
+        if tracker.should_stop():
+            break
+
+    tracker.save()
+
+    if writer.failed:
+        print(f"Writes failed, leaving {username} to resume from its last saved pagination token")
+        return
+
+    def mark_scraped():
+        # Clear pagination token and mark as scraped when done
+        if update_target_pagination_token(target_record_id, None) and update_target_as_scraped(target_record_id):
+            print(f"Marked {username} as scraped. Total followers added: {totals['added']}")
+        else:
+            print(f"Error marking {username} as scraped")
+
+    writer.submit([], key=target_record_id, callback=mark_scraped)
+
+def process_business_network(plan_only=False, budget=None, upsert_on=None,
+                             min_yield=DEFAULT_MIN_YIELD, low_yield_pages=DEFAULT_LOW_YIELD_PAGES, workers=1):
     """
     Function to:
     1. Fetch business targets from Airtable
-    2. Get followers for each target using saved pagination token if exists
-    3. Save followers to network table in batches
-    4. Update pagination token after each request
+    2. Get followers for up to workers targets at once, each from its saved pagination token if exists
+    3. Save followers from every target to the network table through one batched writer
+    4. Update each target's pagination token once its page is saved
     5. Mark target as scraped when complete
+    plan_only prints the estimated cost instead, budget limits the run to the targets that fit in that many RapidAPI calls
+    upsert_on (e.g. ['Pk Id']) lets Airtable merge duplicates instead of scanning the whole network table first
+    Paging a target stops early (and it is marked as scraped) after low_yield_pages pages in a row with under min_yield new accounts
+    RapidAPI calls are paced by the key pool and Airtable calls by the shared rate limiter, whatever the number of workers
     """
     
     # Get targets that haven't been scraped
+    mark_stage('fetch targets')
     targets = fetch_business_targets()
     if not targets:
         print("No targets found needing network scrape")
         return
         
     print(f"Found {len(targets)} targets to process")
+
+    if plan_only or budget is not None:
+        plan = plan_business_network(targets, upsert_on, workers)
+        if plan_only:
+            plan.print_summary(budget)
+            return
+        targets = plan.fit_to_budget(budget)
     
-    # Get ALL existing network accounts for global deduplication
-    existing_accounts = fetch_existing_business_network_accounts()
-    # Create a set of all usernames across all targets
-    all_existing_usernames = set(account.get('fields', {}).get('Username') for account in existing_accounts)
-    print(f"Found {len(all_existing_usernames)} existing unique accounts in database")
-    
-    # Track all usernames seen across all targets in this run
-    global_seen_usernames = set()
-    
-    for target in targets:
-        target_record_id = target.get('id')
-        username = target.get('fields', {}).get('Username')
-        # Get saved pagination token if exists
-        pagination_token = target.get('fields', {}).get('Last Pagination Token')
-        
-        if not username:
-            print("No username found for target, skipping")
-            continue
-            
-        print(f"\nProcessing followers for {username}")
-        if pagination_token:
-            print(f"Continuing from previous pagination token: {pagination_token}")
-        
-        # Track followers for batch processing
-        current_batch = []
-        total_followers_added = 0
-        batch_size = 100  # Process in larger batches for efficiency
-        
-        while True:
-            # Get followers data
-            followers_data = get_followers(username, pagination_token)
-            if not followers_data or 'data' not in followers_data:
-                print(f"No followers data returned for {username}")
-                break
-            
-            # Save pagination token immediately after each request
-            new_pagination_token = followers_data.get('pagination_token')
-            if update_target_pagination_token(target_record_id, new_pagination_token):
-                pagination_token = new_pagination_token
-                if pagination_token:
-                    print(f"Saved new pagination token: {pagination_token[:30]}...")
-            else:
-                print("Failed to save pagination token")
-            
-            # Process followers
-            for follower in followers_data['data'].get('items', []):
-                follower_username = follower.get('username')
-                
-                # Skip if username exists in database or has been seen in this run
-                if follower_username in all_existing_usernames or follower_username in global_seen_usernames:
-                    print(f"Username {follower_username} already exists in database or current run")
-                    continue
-                
-                # Add username to global seen set
-                global_seen_usernames.add(follower_username)
-                
-                follower_data = {
-                    "fields": {
-                        "Username": follower_username,
-                        "Full Name": follower.get('full_name'),
-                        "Profile Url": f"https://instagram.com/{follower_username}",
-                        "Targets (Business)": [target_record_id],
-                        "Pk Id": follower.get('id'),
-                        "Is Private": follower.get('is_private'),
-                        "Is Verified": follower.get('is_verified'),
-                        "Pfp Url": follower.get('profile_pic_url')
-                    }
-                }
-                current_batch.append(follower_data)
-                
-                # If batch is full, send to Airtable
-                if len(current_batch) >= batch_size:
-                    if create_business_network_records(current_batch):
-                        total_followers_added += len(current_batch)
-                        print(f"Added batch of {len(current_batch)} followers. Total for {username}: {total_followers_added}")
-                        current_batch = []  # Clear the batch
-                    else:
-                        print("Error adding batch to Airtable, stopping process")
-                        return
-            
-            # Check for pagination token
-            if not pagination_token:
-                print("No more pages to fetch")
-                break
-                
-            print(f"Fetching next page...")
-        
-        # Send any remaining followers in the final batch
-        if current_batch:
-            if create_business_network_records(current_batch):
-                total_followers_added += len(current_batch)
-                print(f"Added final batch of {len(current_batch)} followers. Total for {username}: {total_followers_added}")
-            else:
-                print("Error adding final batch to Airtable")
-                return
-        
-        # Clear pagination token and mark as scraped when done
-        if update_target_pagination_token(target_record_id, None) and update_target_as_scraped(target_record_id):
-            print(f"Marked {username} as scraped. Total followers added: {total_followers_added}")
-        else:
-            print(f"Error marking {username} as scraped")
+    # Persistent pk id index of every account already written, shared across targets and runs
+    # It is seeded from the whole network table on the first run only (not needed when upserting)
+    mark_stage('load seen store')
+    if upsert_on:
+        print(f"Upserting on {', '.join(upsert_on)}, skipping existing network scan")
+    seen_pk_ids = open_seen_store('business_network', None if upsert_on else fetch_existing_business_network_accounts)
+    print(f"Found {len(seen_pk_ids)} existing unique accounts in local dedup store")
+
+    # pk ids queued by any target this run, only added to the store once written
+    queued_pk_ids = set()
+    queued_lock = threading.Lock()
+
+    def claim(pk_id):
+        with queued_lock:
+            if pk_id in queued_pk_ids or pk_id in seen_pk_ids:
+                return False
+            queued_pk_ids.add(pk_id)
+            return True
+
+    registry = get_registry()
+
+    def record_written(records):
+        seen_pk_ids.add_many(r['fields'].get('Pk Id') or r['fields'].get('Username') for r in records)
+        registry.record_accounts(
+            [dict(identity_from_fields(r['fields']), source=r['fields']['Targets (Business)'][0]) for r in records],
+            BUSINESS_NETWORK)
+        prefetch_from_records(records)
+
+    def write_batch(batch):
+        result = create_business_network_records(batch, upsert_on)
+        if not result and result.written:
+            # Another shard or batch failed, the accounts that were stored still have to be recorded
+            # or the rerun would add them again
+            record_written(result.written)
+        return result
+
+    writer = BatchWriter(write_batch, on_written=record_written, label='network records')
+
+    mark_stage('scrape')
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = [
+                executor.submit(scrape_target_followers, target, claim, writer, min_yield, low_yield_pages)
+                for target in targets
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        mark_stage('finish')
+        if not writer.close():
+            print("Error adding followers to Airtable, stopped early")
+        seen_pk_ids.close()
+        wait_for_prefetch()
 
 if __name__ == "__main__":
-    process_business_network()
+    parser = argparse.ArgumentParser(description="Scrape followers of business targets into Business Network")
+    add_plan_arguments(parser)
+    add_profile_argument(parser)
+    add_early_stop_arguments(parser)
+    parser.add_argument('--upsert', nargs='?', const='Pk Id', metavar='FIELD',
+                        help="merge into existing accounts on FIELD (default 'Pk Id') instead of scanning the network table first")
+    parser.add_argument('--workers', type=int, default=1, help="number of targets to scrape concurrently")
+    args = parser.parse_args()
+    with profile_run('process_business_network', args.profile):
+        process_business_network(plan_only=args.plan, budget=args.budget, upsert_on=[args.upsert] if args.upsert else None,
+                                 min_yield=args.min_yield, low_yield_pages=args.low_yield_pages, workers=args.workers)
@@ -1,39 +1,35 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from airtable import fetch_existing_locations, create_location_records
 from instagram import get_location_ids
+from planner import Plan, add_plan_arguments, airtable_write_calls
+from endpoint_stats import get_stat
 
-def populate_location_data():
+def fetch_existing_location_ids():
     """
-    Function to:
-    1. Get search term from user input
-    2. Fetch location data from Instagram API
-    3. Compare with existing locations in Airtable
-    4. Save new unique locations to Airtable
+    Function to build a set of every location id already in Airtable
+    Uses the whole table (not just the 🔥 view) so lookups are O(1) and nothing is re-added
+    """
+    existing_locations = fetch_existing_locations(view=None)
+    return {loc.get('fields', {}).get('Id') for loc in existing_locations}
+
+def build_location_records(search_term, location_data, existing_location_ids):
+    """
+    Function to turn a search_location response into new location records
+    Adds the new ids to existing_location_ids so later search terms don't duplicate them
     """
-    
-    # Get search term from user
-    search_term = input("Enter location to search (e.g. 'London', 'Bali'): ")
-    
-    # Fetch data from Instagram API
-    location_data = get_location_ids(search_term)
-    if not location_data or 'data' not in location_data:
-        print("No data returned from Instagram API")
-        return
-    
-    # Fetch existing locations from Airtable
-    existing_locations = fetch_existing_locations()
-    existing_location_ids = [loc.get('fields', {}).get('Id') for loc in existing_locations]
-    
-    # Process new locations
     new_locations = []
     for location in location_data['data'].get('items', []):
         location_id = location.get('id')
         location_name = location.get('name')
-        
+
         # Skip if location already exists
         if location_id in existing_location_ids:
             print(f"Location {location.get('name')} already exists in database")
             continue
-            
+
+        existing_location_ids.add(location_id)
+
         # Create new location record
         new_location = {
             "fields": {
@@ -43,7 +39,33 @@ def populate_location_data():
             }
         }
         new_locations.append(new_location)
-    
+
+    return new_locations
+
+def populate_location_data():
+    """
+    Function to:
+    1. Get search term from user input
+    2. Fetch location data from Instagram API
+    3. Compare with existing locations in Airtable
+    4. Save new unique locations to Airtable
+    """
+
+    # Get search term from user
+    search_term = input("Enter location to search (e.g. 'London', 'Bali'): ")
+
+    # Fetch data from Instagram API
+    location_data = get_location_ids(search_term)
+    if not location_data or 'data' not in location_data:
+        print("No data returned from Instagram API")
+        return
+
+    # Fetch existing locations from Airtable
+    existing_location_ids = fetch_existing_location_ids()
+
+    # Process new locations
+    new_locations = build_location_records(search_term, location_data, existing_location_ids)
+
     if new_locations:
         # Create records in Airtable
         create_location_records(new_locations)
@@ -51,5 +73,96 @@ def populate_location_data():
     else:
         print("No new locations to add")
 
+def read_search_terms(terms_file):
+    """
+    Function to read search terms from a file, one per line
+    Blank lines and lines starting with # are ignored, repeated terms are only searched once
+    """
+    search_terms = []
+    seen_terms = set()
+    with open(terms_file, encoding='utf-8') as f:
+        for line in f:
+            term = line.strip()
+            if not term or term.startswith('#'):
+                continue
+            if term.lower() in seen_terms:
+                continue
+            seen_terms.add(term.lower())
+            search_terms.append(term)
+    return search_terms
+
+def plan_location_search(search_terms):
+    """
+    Function to estimate the calls needed to search every term in a batch
+    """
+    plan = Plan('populate_location_data_batch')
+    # The existing Locations read is counted as a single page
+    plan.add_fixed({'airtable': 1})
+
+    for search_term in search_terms:
+        plan.add_item(search_term, search_term, {
+            'search_location': 1,
+            'airtable': airtable_write_calls(get_stat('search_location', 'page_size'))
+        })
+
+    plan.add_note("creates assume every search result is a new location")
+    return plan
+
+def populate_location_data_batch(terms_file, workers=4, plan_only=False, budget=None):
+    """
+    Function to:
+    1. Read search terms from a file
+    2. Fetch location data for all terms concurrently (existing locations are fetched alongside)
+    3. Dedup against a set of existing location ids and across search terms
+    4. Save all new locations to Airtable in batches of 10
+    plan_only prints the estimated cost instead, budget limits the run to the terms that fit in that many RapidAPI calls
+    """
+
+    search_terms = read_search_terms(terms_file)
+    if not search_terms:
+        print(f"No search terms found in {terms_file}")
+        return
+
+    if plan_only or budget is not None:
+        plan = plan_location_search(search_terms)
+        if plan_only:
+            plan.print_summary(budget)
+            return
+        search_terms = plan.fit_to_budget(budget)
+
+    print(f"Searching {len(search_terms)} locations with {workers} workers")
+
+    with ThreadPoolExecutor(max_workers=workers + 1) as executor:
+        existing_future = executor.submit(fetch_existing_location_ids)
+        # map keeps results in the same order as the terms file
+        results = list(executor.map(get_location_ids, search_terms))
+        existing_location_ids = existing_future.result()
+
+    new_locations = []
+    for search_term, location_data in zip(search_terms, results):
+        if not location_data or 'data' not in location_data:
+            print(f"No data returned from Instagram API for '{search_term}'")
+            continue
+
+        term_locations = build_location_records(search_term, location_data, existing_location_ids)
+        print(f"Found {len(term_locations)} new locations for '{search_term}'")
+        new_locations.extend(term_locations)
+
+    if new_locations:
+        # create_location_records writes in batches of 10
+        create_location_records(new_locations)
+        print(f"Added {len(new_locations)} new locations to database")
+    else:
+        print("No new locations to add")
+
 if __name__ == "__main__":
-    populate_location_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Search Instagram locations and save new ones to Airtable")
+    parser.add_argument('--batch', metavar='FILE', help="file of search terms, one per line (skips the interactive prompt)")
+    parser.add_argument('--workers', type=int, default=4, help="concurrent location lookups in batch mode")
+    add_plan_arguments(parser)
+    args = parser.parse_args()
+
+    if args.batch:
+        populate_location_data_batch(args.batch, args.workers, plan_only=args.plan, budget=args.budget)
+    else:
+        populate_location_data()
@@ -1,34 +1,321 @@
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
 from airtable import (
     fetch_existing_locations, 
     fetch_existing_location_posts, 
-    create_location_post_records
+    create_location_post_records,
+    fetch_location_post_genders
 )
 from instagram import get_location_posts
 from misc_functions import convert_taken_at_to_iso
+from image_store import prefetch_from_records, wait_for_prefetch
+from planner import Plan, add_plan_arguments, pages_for, airtable_read_calls, airtable_write_calls
+from seen_store import SeenStore, open_seen_store
+from yield_tracker import YieldTracker, add_early_stop_arguments, DEFAULT_MIN_YIELD, DEFAULT_LOW_YIELD_PAGES
+from budget_allocator import BudgetAllocator, location_female_ratios, location_priors, DEFAULT_EXPLORATION
+from account_registry import get_registry, LOCATION_POSTS
+from watermarks import get_watermark, update_watermark
+from lineage import record_spans, CREATED
+from profiling import add_profile_argument, mark_stage, profile_run
 
-def process_location_posts():
+POSTS_PER_LOCATION = 300
+
+def window_start(max_age_days=None, since=None):
+    """
+    Function to turn the --max-age / --since options into the unix time posts must be newer than, None for no window
+    since is a YYYY-MM-DD date (UTC), if both are given the later start wins
+    """
+    starts = []
+    if max_age_days:
+        starts.append((datetime.now(timezone.utc) - timedelta(days=max_age_days)).timestamp())
+    if since:
+        starts.append(datetime.strptime(since, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+    return int(max(starts)) - 1 if starts else None
+
+def plan_location_posts(locations, upsert_on=None):
+    """
+    Function to estimate the calls needed to bring every location up to POSTS_PER_LOCATION posts
+    """
+    plan = Plan('process_location_posts')
+
+    # Reading the locations plus the one-off posts table scan that seeds the dedup store
+    plan.add_fixed({'airtable': airtable_read_calls(len(locations))})
+    if not upsert_on and not SeenStore('location_posts').seeded:
+        scraped_rows = sum(location.get('fields', {}).get('Total Posts Scraped For Location', 0) or 0 for location in locations)
+        plan.add_fixed({'airtable': airtable_read_calls(scraped_rows)})
+
+    for location in locations:
+        fields = location.get('fields', {})
+        current_post_count = fields.get('Total Posts Scraped For Location', 0) or 0
+        if current_post_count >= POSTS_PER_LOCATION or not fields.get('Location Id'):
+            continue
+
+        posts_needed = POSTS_PER_LOCATION - current_post_count
+        pages = pages_for('location_posts', posts_needed)
+        plan.add_item(fields.get('Location Name'), location, {
+            'location_posts': pages,
+            'airtable': max(airtable_write_calls(posts_needed), pages)
+        })
+
+    plan.add_note("assumes every post is from a new username, repeat posters make the real page count higher")
+    return plan
+
+def start_location_scrape(location, posts_needed, min_yield, low_yield_pages, not_before=None, new_only=False):
+    """
+    Function to set up the paging state for one location
+    Paging stops at the first page reaching posts taken at or before not_before (unix time),
+    new_only also stops at the newest post seen for the location in earlier runs
+    """
+    location_record_id = location.get('id')
+    location_name = location.get('fields', {}).get('Location Name')
+    cutoff = not_before
+    if new_only:
+        newest_seen = get_watermark('location_posts', location_record_id)
+        if newest_seen:
+            cutoff = max(cutoff or 0, newest_seen)
+    return {
+        'record_id': location_record_id,
+        'name': location_name,
+        'location_id': location.get('fields', {}).get('Location Id'),
+        'posts_needed': posts_needed,
+        'posts_scraped': 0,
+        'pagination_token': None,
+        'cutoff': cutoff,
+        'newest_taken_at': None,
+        'write_failed': False,
+        'tracker': YieldTracker('location_posts', location_record_id, location_name, min_yield, low_yield_pages),
+        'done': False
+    }
+
+def finish_location_scrape(scrape):
+    """
+    Function to save a location's yield and the newest post time saved, so the next run can stop there
+    The watermark is left alone if any page failed to save, the next run has to page back over those posts
+    """
+    scrape['tracker'].save()
+    if scrape['write_failed']:
+        print(f"Not moving the new-only watermark for {scrape['name']}, some posts weren't saved")
+        return
+    update_watermark('location_posts', scrape['record_id'], scrape['newest_taken_at'])
+
+def scrape_location_page(scrape, seen_pk_ids, upsert_on=None):
+    """
+    Function to fetch and save one page of posts for a location
+    Sets scrape['done'] once the location hits its target, runs out of pages, reaches posts older than
+    its cutoff or stops producing new usernames
+    Returns the number of new posts saved
+    """
+    location_name = scrape['name']
+    posts_needed = scrape['posts_needed']
+
+    # Get posts data from Instagram
+    page_started = time.time()
+    posts_data = get_location_posts(scrape['location_id'], scrape['pagination_token'])
+    if not posts_data or 'data' not in posts_data:
+        print(f"No posts data returned for {location_name}")
+        scrape['done'] = True
+        return 0
+    
+    # Process new posts
+    new_posts = []
+    # pk ids in this page's batch, only added to the store once the batch is written
+    pending_pk_ids = set()
+    posts_examined = 0
+    reached_cutoff = False
+    # Newest post examined on this page, it only moves the watermark once the page is saved
+    page_newest = None
+    for post in posts_data['data'].get('items', []):
+        taken_at = post.get('taken_at')
+
+        # Posts come newest first, so once they pass the cutoff there is nothing newer further on
+        if scrape['cutoff'] and taken_at and taken_at <= scrape['cutoff']:
+            reached_cutoff = True
+            continue
+
+        # Check if we've reached our target
+        if scrape['posts_scraped'] >= posts_needed:
+            break
+        posts_examined += 1
+        if taken_at and (page_newest is None or taken_at > page_newest):
+            page_newest = taken_at
+            
+        user_info = post.get('user', {})
+        username = user_info.get('username')
+        pk_id = user_info.get('id') or username
+        
+        # Skip if account exists in database or has been seen in this run
+        if pk_id in pending_pk_ids or pk_id in seen_pk_ids:
+            print(f"Username {username} already exists in database or current run")
+            continue
+        
+        pending_pk_ids.add(pk_id)
+        
+        if post.get('caption'): 
+            caption_info = post.get('caption', {})
+        
+        # Create new post record
+        new_post = {
+            "fields": {
+                "Post Id": post.get('id'),
+                "Username": username,
+                "Full Name": user_info.get('full_name'),
+                "Pfp Url": user_info.get('profile_pic_url'),
+                "Pk Id": user_info.get('id'),
+                "Locations": [scrape['record_id']],
+                "Posted Date": convert_taken_at_to_iso(post.get('taken_at')),
+                "Post Caption": caption_info.get('text') if post.get('caption') else None
+            }
+        }
+        new_posts.append(new_post)
+        scrape['posts_scraped'] += 1
+    
+    new_this_page = len(new_posts)
+    if new_posts:
+        # Create records in Airtable
+        result = create_location_post_records(new_posts, upsert_on)
+        # Posts on shards or batches that did save are recorded even if the rest failed
+        saved = result.written
+        if not result:
+            print(f"Failed to save {len(new_posts) - len(saved)} of {len(new_posts)} posts for {location_name}")
+            scrape['write_failed'] = True
+        if saved:
+            seen_pk_ids.add_many(post['fields'].get('Pk Id') or post['fields'].get('Username') for post in saved)
+            get_registry().record_records(saved, LOCATION_POSTS, scrape['record_id'])
+            record_spans([post['fields']['Pk Id'] for post in saved], CREATED, page_started, pipeline='location_posts')
+            # Download profile pictures now, while the signed CDN urls are still valid
+            prefetch_from_records(saved)
+        # Unsaved posts, and updated rows that were already in the database, don't count towards the target
+        scrape['posts_scraped'] -= len(new_posts) - len(saved) + result['updated']
+        new_this_page = len(saved) - result['updated']
+        if upsert_on:
+            print(f"Upserted {len(saved)} posts for {location_name} ({result['created']} new, {result['updated']} updated)")
+        else:
+            print(f"Added {len(saved)} new posts for {location_name}")
+        print(f"Total posts scraped this run: {scrape['posts_scraped']}")
+
+    if page_newest and (not new_posts or result):
+        if scrape['newest_taken_at'] is None or page_newest > scrape['newest_taken_at']:
+            scrape['newest_taken_at'] = page_newest
+    
+    tracker = scrape['tracker']
+    tracker.record_page(posts_examined, new_this_page)
+    
+    # Check if we've reached our target
+    if scrape['posts_scraped'] >= posts_needed:
+        print(f"Reached target of {posts_needed} new posts")
+        scrape['done'] = True
+    elif reached_cutoff:
+        print(f"Reached posts older than the cutoff for {location_name}")
+        scrape['done'] = True
+    # Stop paging a location that has stopped producing new usernames
+    elif tracker.should_stop():
+        scrape['done'] = True
+    else:
+        # Check for pagination token
+        scrape['pagination_token'] = posts_data.get('pagination_token')
+        if not scrape['pagination_token']:
+            print("No more pages to fetch")
+            scrape['done'] = True
+        else:
+            print(f"Fetching next page with token: {scrape['pagination_token'][:30]}...")
+
+    if scrape['done']:
+        finish_location_scrape(scrape)
+    return new_this_page
+
+def allocate_location_budget(locations, call_budget, seen_pk_ids, upsert_on=None, reward='new',
+                             exploration=DEFAULT_EXPLORATION, min_yield=DEFAULT_MIN_YIELD, low_yield_pages=DEFAULT_LOW_YIELD_PAGES,
+                             not_before=None, new_only=False):
+    """
+    Function to spread call_budget RapidAPI calls across locations by observed yield instead of a fixed post target
+    Every call goes to the location the bandit currently rates best, reward is new usernames per call
+    (reward='female' weights that by the location's share of female leads in Location Posts)
+    """
+    scrapes = {}
+    for location in locations:
+        if location.get('fields', {}).get('Location Id'):
+            scrapes[location.get('id')] = start_location_scrape(location, float('inf'), min_yield, low_yield_pages,
+                                                                   not_before, new_only)
+    if not scrapes:
+        print("No locations with a location id to allocate budget to")
+        return
+
+    weights = {}
+    default_weight = 1.0
+    if reward == 'female':
+        weights, default_weight = location_female_ratios(fetch_location_post_genders())
+        print(f"Weighting yield by female share of leads (overall {default_weight:.0%})")
+
+    allocator = BudgetAllocator(list(scrapes), location_priors(scrapes, weights, default_weight), exploration)
+    print(f"Allocating {call_budget} calls across {len(scrapes)} locations")
+
+    for _ in range(call_budget):
+        open_locations = [record_id for record_id, scrape in scrapes.items() if not scrape['done']]
+        if not open_locations:
+            print("Every location is exhausted or saturated, stopping before the budget is spent")
+            break
+
+        record_id = allocator.choose(open_locations)
+        print(f"\nProcessing posts for location: {scrapes[record_id]['name']}")
+        new_posts = scrape_location_page(scrapes[record_id], seen_pk_ids, upsert_on)
+        allocator.update(record_id, new_posts * weights.get(record_id, default_weight))
+
+    # Save yield for locations that were still open when the budget ran out
+    for scrape in scrapes.values():
+        if not scrape['done']:
+            finish_location_scrape(scrape)
+
+    allocator.print_summary({record_id: scrape['name'] for record_id, scrape in scrapes.items()})
+
+def process_location_posts(plan_only=False, budget=None, upsert_on=None,
+                           min_yield=DEFAULT_MIN_YIELD, low_yield_pages=DEFAULT_LOW_YIELD_PAGES,
+                           allocate_budget=None, reward='new', exploration=DEFAULT_EXPLORATION,
+                           max_age_days=None, since=None, new_only=False):
     """
     Function to:
     1. Fetch locations from Airtable
     2. Get posts for each location from Instagram API
     3. Compare with existing posts to avoid duplicates (by username)
     4. Save new posts to Airtable
+    plan_only prints the estimated cost instead, budget limits the run to the locations that fit in that many RapidAPI calls
+    upsert_on (e.g. ['Pk Id']) lets Airtable merge duplicates instead of scanning the whole posts table first
+    Paging a location stops early after low_yield_pages pages in a row with under min_yield new usernames
+    allocate_budget switches from the fixed POSTS_PER_LOCATION target to allocate_location_budget
+    max_age_days / since (YYYY-MM-DD) stop paging once posts are older than the window,
+    new_only stops at the newest post seen for each location in earlier runs
     """
+    not_before = window_start(max_age_days, since)
 
     # Get locations from Airtable
+    mark_stage('fetch locations')
     locations = fetch_existing_locations()
     if not locations:
         print("No locations found in Airtable")
         return
 
-    # Get ALL existing posts for global deduplication
-    existing_posts = fetch_existing_location_posts()
-    # Create a set of all usernames across all locations
-    all_existing_usernames = set(post.get('fields', {}).get('Username') for post in existing_posts)
-    print(f"Found {len(all_existing_usernames)} existing unique usernames in database")
+    if plan_only or budget is not None:
+        plan = plan_location_posts(locations, upsert_on)
+        if not_before or new_only:
+            plan.add_note("the time window can end paging before a location reaches its post target")
+        if plan_only:
+            plan.print_summary(budget)
+            return
+        locations = plan.fit_to_budget(budget)
 
-    # Track all usernames seen across all locations in this run
-    global_seen_usernames = set()
+    # Persistent pk id index of every account already written, shared across locations and runs
+    # It is seeded from the whole posts table on the first run only (not needed when upserting)
+    mark_stage('load seen store')
+    if upsert_on:
+        print(f"Upserting on {', '.join(upsert_on)}, skipping existing posts scan")
+    seen_pk_ids = open_seen_store('location_posts', None if upsert_on else fetch_existing_location_posts)
+    print(f"Found {len(seen_pk_ids)} existing accounts in local dedup store")
+
+    mark_stage('scrape')
+    if allocate_budget:
+        allocate_location_budget(locations, allocate_budget, seen_pk_ids, upsert_on, reward,
+                                 exploration, min_yield, low_yield_pages, not_before, new_only)
+        locations = []
 
     # Process each location
     for location in locations:
@@ -37,92 +324,48 @@ def process_location_posts():
         
         # Get current post count and calculate remaining needed
         current_post_count = location.get('fields', {}).get('Total Posts Scraped For Location', 0) or 0
-        if current_post_count >= 300:
-            print(f'Skipping {location_name} as 300 posts already scraped.')
+        if current_post_count >= POSTS_PER_LOCATION:
+            print(f'Skipping {location_name} as {POSTS_PER_LOCATION} posts already scraped.')
             continue
             
-        posts_needed = 300 - current_post_count
+        posts_needed = POSTS_PER_LOCATION - current_post_count
         print(f"Need to scrape {posts_needed} more posts for {location_name}")
         
-        location_record_id = location.get('id')
-        location_id = location.get('fields', {}).get('Location Id')
-        
-        if not location_id:
+        if not location.get('fields', {}).get('Location Id'):
             print('No location id, skipping record')
             continue
             
         print(f"\nProcessing posts for location: {location_name}")
         
-        pagination_token = None
-        posts_scraped_this_run = 0
-        
-        while True:
-            # Check if we've reached our target
-            if posts_scraped_this_run >= posts_needed:
-                print(f"Reached target of {posts_needed} new posts")
-                break
-                
-            # Get posts data from Instagram
-            posts_data = get_location_posts(location_id, pagination_token)
-            if not posts_data or 'data' not in posts_data:
-                print(f"No posts data returned for {location_name}")
-                break
-            
-            # Process new posts
-            new_posts = []
-            for post in posts_data['data'].get('items', []):
-                # Check if we've reached our target
-                if posts_scraped_this_run >= posts_needed:
-                    break
-                    
-                user_info = post.get('user', {})
-                username = user_info.get('username')
-                
-                # Skip if username exists in database or has been seen in this run
-                if username in all_existing_usernames or username in global_seen_usernames:
-                    print(f"Username {username} already exists in database or current run")
-                    continue
-                
-                # Add username to global seen set
-                global_seen_usernames.add(username)
-                
-                if post.get('caption'): 
-                    caption_info = post.get('caption', {})
-                
-                # Create new post record
-                new_post = {
-                    "fields": {
-                        "Post Id": post.get('id'),
-                        "Username": username,
-                        "Full Name": user_info.get('full_name'),
-                        "Pfp Url": user_info.get('profile_pic_url'),
-                        "Pk Id": user_info.get('id'),
-                        "Locations": [location_record_id],
-                        "Posted Date": convert_taken_at_to_iso(post.get('taken_at')),
-                        "Post Caption": caption_info.get('text') if post.get('caption') else None
-                    }
-                }
-                new_posts.append(new_post)
-                posts_scraped_this_run += 1
-            
-            if new_posts:
-                # Create records in Airtable
-                create_location_post_records(new_posts)
-                print(f"Added {len(new_posts)} new posts for {location_name}")
-                print(f"Total posts scraped this run: {posts_scraped_this_run}")
-            
-            # Check if we've reached our target
-            if posts_scraped_this_run >= posts_needed:
-                print(f"Reached target of {posts_needed} new posts")
-                break
-            
-            # Check for pagination token
-            pagination_token = posts_data.get('pagination_token')
-            if not pagination_token:
-                print("No more pages to fetch")
-                break
-            
-            print(f"Fetching next page with token: {pagination_token[:30]}...")
+        scrape = start_location_scrape(location, posts_needed, min_yield, low_yield_pages, not_before, new_only)
+        while not scrape['done']:
+            scrape_location_page(scrape, seen_pk_ids, upsert_on)
+
+    mark_stage('finish')
+    seen_pk_ids.close()
+    wait_for_prefetch()
 
 if __name__ == "__main__":
-    process_location_posts()
+    parser = argparse.ArgumentParser(description="Scrape posts for the 🔥 locations into Location Posts")
+    add_plan_arguments(parser)
+    add_profile_argument(parser)
+    add_early_stop_arguments(parser)
+    parser.add_argument('--upsert', nargs='?', const='Pk Id', metavar='FIELD',
+                        help="merge into existing posts on FIELD (default 'Pk Id') instead of scanning the posts table first")
+    parser.add_argument('--allocate', type=int, metavar='CALLS',
+                        help="spread this many RapidAPI calls across locations by observed yield instead of the fixed post target")
+    parser.add_argument('--reward', choices=['new', 'female'], default='new',
+                        help="what --allocate optimises: new usernames per call, or new usernames weighted by female share")
+    parser.add_argument('--exploration', type=float, default=DEFAULT_EXPLORATION,
+                        help="how strongly --allocate tries less used locations")
+    parser.add_argument('--max-age', type=float, metavar='DAYS',
+                        help="only scrape posts taken in the last DAYS days, paging stops at the first older post")
+    parser.add_argument('--since', metavar='YYYY-MM-DD', help="only scrape posts taken on or after this date (UTC)")
+    parser.add_argument('--new-only', action='store_true',
+                        help="stop at the newest post seen for each location in earlier runs")
+    args = parser.parse_args()
+    with profile_run('process_location_posts', args.profile):
+        process_location_posts(plan_only=args.plan, budget=args.budget, upsert_on=[args.upsert] if args.upsert else None,
+                               min_yield=args.min_yield, low_yield_pages=args.low_yield_pages,
+                               allocate_budget=args.allocate, reward=args.reward, exploration=args.exploration,
+                               max_age_days=args.max_age, since=args.since, new_only=args.new_only)
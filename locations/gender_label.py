@@ -1,12 +1,22 @@
+import argparse
 import requests
+import http_client
 import os
+import time
 from dotenv import load_dotenv
 from airtable import (
     fetch_location_posts_without_gender, 
     update_post_gender, 
     update_business_network_gender,
+    update_business_network_records,
     fetch_business_network_without_gender
 )
+from image_store import read_image, download_image, image_key
+from planner import Plan, add_plan_arguments, airtable_read_calls, airtable_write_calls
+from gender_prefilter import prefilter_accounts, print_prefilter_summary
+from account_registry import get_registry
+from lineage import record_span, GENDER
+from profiling import add_profile_argument, mark_stage, profile_run
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
 
@@ -28,32 +38,37 @@ def get_gender_from_image(image_url):
     }
     
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = http_client.post(url, idempotent=True, json=payload, headers=headers)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error getting gender prediction: {e}")
         return None
 
-def get_gender_from_image_picpurify(image_url):
+def get_gender_from_image_picpurify(image_url, image_bytes=None):
     """
     Function to get gender prediction from profile picture URL using PicPurify API
     https://www.picpurify.com/api-services.html#single_image_api_doc
+    If image_bytes is given the picture is uploaded directly instead of PicPurify fetching the url
     """
     url = "https://www.picpurify.com/analyse/1.1"
     
-    headers = {
-        'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    
     payload = {
         'API_KEY': os.getenv('PICPURIFY_API_KEY'),
-        'url_image': image_url,
         'task': 'face_gender_detection'
     }
     
     try:
-        response = requests.post(url, data=payload, headers=headers)
+        if image_bytes:
+            # requests sets the multipart Content-Type header itself
+            files = {'file_image': ('pfp.jpg', image_bytes)}
+            response = http_client.post(url, idempotent=True, data=payload, files=files)
+        else:
+            headers = {
+                'Content-Type': 'application/x-www-form-urlencoded'
+            }
+            payload['url_image'] = image_url
+            response = http_client.post(url, idempotent=True, data=payload, headers=headers)
         response.raise_for_status()
         result = response.json()
         
@@ -78,22 +93,100 @@ def get_gender_from_image_picpurify(image_url):
         print(f"Error getting gender prediction from PicPurify: {e}")
         return None
 
-def process_gender_labels():
+def registry_gender_updates(posts):
+    """
+    Function to split off accounts whose gender is already in the account registry (e.g. checked through another table)
+    Returns (updates, remaining_posts) where updates are ready for a batch PATCH
+    """
+    registry = get_registry()
+    updates = []
+    remaining = []
+    for post in posts:
+        fields = post.get('fields', {})
+        known = registry.get_gender(fields.get('Pk Id'), fields.get('Username'))
+        if known and known['gender']:
+            updates.append({"id": post.get('id'), "fields": {
+                "Gender": known['gender'],
+                "Gender Confidence": known['confidence'],
+                "Gender Checked": True
+            }})
+        else:
+            remaining.append(post)
+    return updates, remaining
+
+def plan_gender_labels(posts, prefiltered=0):
+    """
+    Function to estimate the calls needed to gender check every pending account
+    prefiltered is the number of accounts the pre-filter settles, written back in batches
+    """
+    plan = Plan('process_gender_labels', budget_service='picpurify')
+    plan.add_fixed({'airtable': airtable_read_calls(len(posts) + prefiltered) + airtable_write_calls(prefiltered)})
+
+    for post in posts:
+        fields = post.get('fields', {})
+        if not fields.get('Pfp Url'):
+            continue
+        plan.add_item(fields.get('Username'), post, {'picpurify': 1, 'airtable': 1})
+
+    return plan
+
+def process_gender_labels(plan_only=False, budget=None, prefilter=True):
     """
     Function to:
     1. Fetch posts without gender labels
-    2. Get gender prediction for each profile picture
-    3. Update Airtable with results
+    2. Reuse genders already in the account registry
+    3. Settle the accounts the cheap pre-filter can decide (names, avatars, private/verified/business pages)
+    4. Get gender prediction for each remaining profile picture
+    5. Update Airtable and the registry with results
+    plan_only prints the estimated cost instead, budget limits the run to that many PicPurify calls
     """
     
     # Get posts that haven't been gender checked
+    mark_stage('fetch accounts')
     posts = fetch_business_network_without_gender()
     if not posts:
         print("No business network accounts found needing gender check")
         return
         
     print(f"Found {len(posts)} business network accounts needing gender check")
+
+    mark_stage('prefilter')
+    registry = get_registry()
+    pk_ids = {post.get('id'): post.get('fields', {}).get('Pk Id') for post in posts}
+    settle_started = time.time()
+    updates, posts = registry_gender_updates(posts)
+    from_registry = len(updates)
+    if updates:
+        print(f"{len(updates)} accounts already have a gender in the account registry")
+
+    if prefilter:
+        prefilter_updates, posts, counts = prefilter_accounts(posts)
+        print_prefilter_summary(counts)
+        if not plan_only:
+            for update in prefilter_updates:
+                if update['fields'].get('Gender'):
+                    registry.record_gender(pk_ids[update['id']], update['fields']['Gender'],
+                                           update['fields']['Gender Confidence'], 'name')
+        updates.extend(prefilter_updates)
+
+    mark_stage('write prefiltered')
+    if updates and not plan_only:
+        written = {id(update) for update in update_business_network_records(updates).written}
+        settled_at = time.time()
+        for i, update in enumerate(updates):
+            if id(update) in written:
+                record_span(pk_ids[update['id']], GENDER, settle_started, settled_at,
+                            method='registry' if i < from_registry else 'prefilter')
+    print(f"{len(posts)} accounts left for PicPurify")
+
+    if plan_only or budget is not None:
+        plan = plan_gender_labels(posts, prefiltered=len(updates))
+        if plan_only:
+            plan.print_summary(budget)
+            return
+        posts = plan.fit_to_budget(budget)
     
+    mark_stage('picpurify')
     for post in posts:
         record_id = post.get('id')
         pfp_url = post.get('fields', {}).get('Pfp Url')
@@ -104,12 +197,25 @@ def process_gender_labels():
             continue
             
         print(f"\nProcessing gender for {username}")
+        started = time.time()
+        pk_id = post.get('fields', {}).get('Pk Id')
+        
+        # Use the locally stored picture if we have it (prefetched at record creation),
+        # otherwise download it once now so retries don't depend on the CDN url
+        store_key = image_key(post.get('fields', {}))
+        image_bytes = None
+        if store_key:
+            image_bytes = read_image(store_key)
+            if image_bytes is None and download_image(store_key, pfp_url):
+                image_bytes = read_image(store_key)
         
         # Get gender prediction using PicPurify API
-        gender_data = get_gender_from_image_picpurify(pfp_url)
+        gender_data = get_gender_from_image_picpurify(pfp_url, image_bytes)
             
         # Get gender from first (and likely only) face
         if gender_data and 'labelName' in gender_data:
+            registry.record_gender(pk_id, gender_data.get('labelName'),
+                                   gender_data.get('confidence'), 'picpurify')
                 
             # Update Airtable with gender data
             update_data = {
@@ -119,6 +225,7 @@ def process_gender_labels():
             }
                 
             if update_business_network_gender(record_id, update_data):
+                record_span(pk_id, GENDER, started, method='picpurify')
                 print(f"Updated gender for {username}")
             else:
                 print(f"Failed to update gender for {username}")
@@ -129,9 +236,17 @@ def process_gender_labels():
                 "No Face Detected": True
             }
             if update_business_network_gender(record_id, update_data):
+                record_span(pk_id, GENDER, started, method='picpurify', face=False)
                 print(f"Marked {username} as checked - no faces detected")
             else:
                 print(f"Failed to update no face detection status for {username}")
 
 if __name__ == "__main__":
-    process_gender_labels()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Label Business Network accounts by gender from their profile picture")
+    add_plan_arguments(parser, budget_unit='PicPurify')
+    add_profile_argument(parser)
+    parser.add_argument('--no-prefilter', action='store_true',
+                        help="send every account to PicPurify instead of settling the obvious ones from name and profile first")
+    args = parser.parse_args()
+    with profile_run('process_gender_labels', args.profile):
+        process_gender_labels(plan_only=args.plan, budget=args.budget, prefilter=not args.no_prefilter)
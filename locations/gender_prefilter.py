@@ -0,0 +1,133 @@
+import csv
+import os
+import re
+import unicodedata
+
+# Cheap checks run before PicPurify so only ambiguous accounts cost an image API call
+# Every account ends up resolved (gender known from the name), skipped (never a lead) or ambiguous
+FIRST_NAMES_FILE = os.getenv('FIRST_NAMES_FILE') or os.path.join(os.path.dirname(__file__), "first_names.csv")
+NAME_MIN_PROBABILITY = float(os.getenv('NAME_MIN_PROBABILITY', 0.95))
+
+# Instagram serves the same picture for every account without one
+DEFAULT_AVATAR_PATTERNS = (
+    '44884218_345707102882519_2446069589734326272_n',
+    '/static/images/anonymousUser'
+)
+
+# Only unambiguous business terms in the display name skip an account, creators often use words like
+# fitness, beauty, studio or official in their names and handles (jess.fitness, anna_official)
+BUSINESS_KEYWORDS = {
+    'agency', 'apartments', 'bakery', 'cafe', 'clinic', 'company', 'gmbh', 'hostel', 'hotel', 'inc', 'llc',
+    'ltd', 'magazine', 'resort', 'restaurant', 'tours', 'villas'
+}
+# Weaker hits, in the display name or handle, skip the first name lookup and go to image classification
+MAYBE_BUSINESS_KEYWORDS = {
+    'bar', 'beauty', 'boutique', 'brand', 'club', 'coffee', 'events', 'fitness', 'gallery', 'gym', 'kitchen',
+    'media', 'official', 'salon', 'shop', 'spa', 'store', 'studio', 'travel', 'villa'
+}
+
+RESOLVED = 'resolved'
+SKIPPED = 'skipped'
+AMBIGUOUS = 'ambiguous'
+
+_WORD_RE = re.compile(r'[a-z]+')
+
+def load_first_names(path=FIRST_NAMES_FILE):
+    """
+    Function to load the first name -> (gender, probability) table
+    """
+    names = {}
+    try:
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                names[row['name'].strip().lower()] = (row['gender'].strip(), float(row['probability']))
+    except FileNotFoundError:
+        print(f"First name table {path} not found, name lookups disabled")
+    return names
+
+FIRST_NAMES = load_first_names()
+
+def _words(text):
+    """
+    Function to split a display name into lowercase ascii words, dropping emojis and accents
+    """
+    normalized = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii').lower()
+    return _WORD_RE.findall(normalized)
+
+def is_default_avatar(pfp_url):
+    return any(pattern in pfp_url for pattern in DEFAULT_AVATAR_PATTERNS)
+
+def looks_like_business(fields):
+    return bool(set(_words(fields.get('Full Name'))) & BUSINESS_KEYWORDS)
+
+def might_be_business(fields):
+    words = set(_words(fields.get('Full Name'))) | set(_words((fields.get('Username') or '').replace('_', ' ').replace('.', ' ')))
+    return bool(words & MAYBE_BUSINESS_KEYWORDS)
+
+def gender_from_name(full_name, min_probability=NAME_MIN_PROBABILITY):
+    """
+    Function to look up the first word of a display name in the first name table
+    Returns (gender, probability) or None when the name is unknown or not clear enough
+    """
+    words = _words(full_name)
+    if not words:
+        return None
+    match = FIRST_NAMES.get(words[0])
+    if not match or match[1] < min_probability:
+        return None
+    return match
+
+def classify_account(fields, min_probability=NAME_MIN_PROBABILITY):
+    """
+    Function to decide what to do with an account before paying for image classification
+    Returns (outcome, update_fields, reason), update_fields is None for ambiguous accounts
+    """
+    pfp_url = fields.get('Pfp Url')
+
+    if not pfp_url:
+        return SKIPPED, {"Gender Checked": True, "No Face Detected": True}, 'no profile picture'
+    if is_default_avatar(pfp_url):
+        return SKIPPED, {"Gender Checked": True, "No Face Detected": True}, 'default avatar'
+    if fields.get('Is Private'):
+        return SKIPPED, {"Gender Checked": True}, 'private account'
+    if fields.get('Is Verified'):
+        return SKIPPED, {"Gender Checked": True}, 'verified account'
+    if looks_like_business(fields):
+        return SKIPPED, {"Gender Checked": True}, 'business page'
+    if might_be_business(fields):
+        # A salon named after its owner would otherwise resolve from the first name
+        return AMBIGUOUS, None, 'possible business page'
+
+    match = gender_from_name(fields.get('Full Name'), min_probability)
+    if match:
+        gender, probability = match
+        return RESOLVED, {"Gender": gender, "Gender Confidence": probability, "Gender Checked": True}, 'first name'
+
+    return AMBIGUOUS, None, None
+
+def prefilter_accounts(records, min_probability=NAME_MIN_PROBABILITY):
+    """
+    Function to run the pre-filter over Business Network records
+    Returns (updates, ambiguous_records, counts) where updates are ready for a batch PATCH
+    and counts tallies the outcome per reason
+    """
+    updates = []
+    ambiguous = []
+    counts = {}
+
+    for record in records:
+        outcome, update_fields, reason = classify_account(record.get('fields', {}), min_probability)
+        if outcome == AMBIGUOUS:
+            ambiguous.append(record)
+            reason = f"ambiguous ({reason})" if reason else 'ambiguous'
+        else:
+            updates.append({"id": record.get('id'), "fields": update_fields})
+        counts[reason] = counts.get(reason, 0) + 1
+
+    return updates, ambiguous, counts
+
+def print_prefilter_summary(counts):
+    total = sum(counts.values())
+    print(f"\nPre-filter results for {total} accounts:")
+    for reason, count in sorted(counts.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {reason}: {count}")
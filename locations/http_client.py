@@ -0,0 +1,382 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from endpoint_stats import endpoint_from_url, latency_percentile, record_latency, record_latency_sample, service_for
+from quota_broker import acquire_quota, report_throttle
+from cassette import CassetteMiss, mount_cassette, replaying
+from profiling import note_request
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+# Shared HTTP layer for Airtable, RapidAPI and PicPurify calls:
+# one pooled session, bounded retries with decorrelated jitter, and a circuit breaker per host
+# Requests also take a token from the host-wide quota broker when one is running (see quota_broker.py)
+HTTP_MAX_ATTEMPTS = int(os.getenv('HTTP_MAX_ATTEMPTS', 5))
+HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', 0.5))
+HTTP_BACKOFF_CAP = float(os.getenv('HTTP_BACKOFF_CAP', 30))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', 30))
+# Every request gets a (connect, read) timeout so a stalled connection fails and is retried instead of hanging the run
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+# Hedged requests: calls made with hedge=True send a backup copy if the first one is still running after
+# the endpoint's HEDGE_PERCENTILE latency, and use whichever answers first
+# HEDGE_BUDGET caps backups as a fraction of hedgeable calls, since each one costs an extra API call
+HTTP_HEDGING = os.getenv('HTTP_HEDGING', '0') == '1'
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 0.95))
+HEDGE_BUDGET = float(os.getenv('HEDGE_BUDGET', 0.05))
+HEDGE_MIN_SAMPLES = 20  # latencies needed this run before the percentile is trusted
+HEDGE_WORKERS = 64
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+# Requests per second allowed per host, shared by every thread in the process
+# Airtable's limit applies to each base, so its hosts get one limiter per base
+HOST_RATE_LIMITS = {
+    'api.airtable.com': float(os.getenv('AIRTABLE_RATE_LIMIT', 5))
+}
+PER_BASE_HOSTS = {'api.airtable.com'}
+
+# Endpoint names used for latency stats, anything else is named from its url path
+HOST_ENDPOINTS = {
+    'api.airtable.com': 'airtable',
+    'www.picpurify.com': 'picpurify'
+}
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of making a request while a host's circuit is open
+    Subclasses ConnectionError so existing RequestException handling still applies
+    """
+
+class NonRetryableError(requests.exceptions.RequestException):
+    """
+    Base for errors raised before a request is sent that retrying can't fix (e.g. no API key budget left)
+    """
+
+class RetryPolicy:
+    """
+    Bounded retries with decorrelated jitter backoff (each delay is random between base and 3x the previous one)
+    """
+
+    def __init__(self, max_attempts=HTTP_MAX_ATTEMPTS, base_delay=HTTP_BACKOFF_BASE, max_delay=HTTP_BACKOFF_CAP):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def next_delay(self, previous_delay):
+        return min(self.max_delay, random.uniform(self.base_delay, max(previous_delay, self.base_delay) * 3))
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker
+    After CIRCUIT_FAILURE_THRESHOLD consecutive failures the host is skipped for CIRCUIT_RESET_SECONDS,
+    then a single trial request decides whether it closes again
+    """
+
+    def __init__(self, host, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def before_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_seconds or self.trial_in_flight:
+                raise CircuitOpenError(f"Circuit open for {self.host}, failing fast")
+            # Half-open: let one trial request through
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"Circuit for {self.host} closed again")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"Circuit for {self.host} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        with self.lock:
+            self.trial_in_flight = False
+
+    def seconds_until_trial(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+            return max(self.reset_seconds - (time.monotonic() - self.opened_at), 0)
+
+class RateLimiter:
+    """
+    Spaces requests to a host evenly so concurrent threads together stay under its rate limit
+    """
+
+    def __init__(self, rate):
+        self.min_interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_allowed = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_allowed)
+            self.next_allowed = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+DEFAULT_POLICY = RetryPolicy()
+
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=32))
+mount_cassette(_session, pool_connections=16, pool_maxsize=32)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+_hedge_executor = None
+_hedge_lock = threading.Lock()
+_hedge_stats = {'calls': 0, 'hedged': 0, 'backup_won': 0}
+
+def get_session():
+    return _session
+
+def get_breaker(url):
+    host = urlparse(url).netloc
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+def get_rate_limiter(url):
+    """
+    Function to get the shared rate limiter for a url's host (per base for Airtable), None if the host isn't rate limited here
+    (or a cassette is being replayed)
+    """
+    host = urlparse(url).netloc
+    if host not in HOST_RATE_LIMITS or replaying():
+        return None
+    key = f"{host}/{_airtable_base(url)}" if host in PER_BASE_HOSTS else host
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter(HOST_RATE_LIMITS[host])
+        return _rate_limiters[key]
+
+def _airtable_base(url):
+    """
+    Function to get the base id from an Airtable API url, '' for urls outside a base (e.g. the meta API)
+    """
+    segments = urlparse(url).path.strip('/').split('/')
+    if len(segments) > 1 and segments[0] == 'v0' and segments[1] != 'meta':
+        return segments[1]
+    return ''
+
+def _stats_endpoint(url):
+    return HOST_ENDPOINTS.get(urlparse(url).netloc) or endpoint_from_url(url)
+
+def _quota_service(url):
+    """
+    Function to get the quota broker service a url belongs to, None for hosts the broker doesn't manage
+    (and while replaying a cassette, which uses no quota)
+    """
+    host = urlparse(url).netloc
+    if replaying():
+        return None
+    if host in PER_BASE_HOSTS and _airtable_base(url):
+        # One broker bucket per base, e.g. airtable/appXXXX
+        return f"{service_for(HOST_ENDPOINTS[host])}/{_airtable_base(url)}"
+    if host in HOST_ENDPOINTS:
+        return service_for(HOST_ENDPOINTS[host])
+    if host.endswith('.rapidapi.com'):
+        return 'rapidapi'
+    return None
+
+def _retry_after(response):
+    """
+    Function to read a Retry-After header in seconds, if the server sent one
+    """
+    value = response.headers.get('Retry-After')
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+def _allow_hedge():
+    """
+    Function to count a hedgeable call and decide whether it may send a backup within the hedge budget
+    """
+    with _hedge_lock:
+        _hedge_stats['calls'] += 1
+        return _hedge_stats['hedged'] < HEDGE_BUDGET * _hedge_stats['calls']
+
+def _hedged_send(send, endpoint, service):
+    """
+    Function to run send() and, if it's slower than the endpoint's usual tail latency, a backup send()
+    Returns the first response to arrive; the slower request is left to finish in the background
+    """
+    global _hedge_executor
+    hedge_after = latency_percentile(endpoint, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+    with _hedge_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='hedge')
+
+    def timed_send(backup=False):
+        if backup and service is not None:
+            acquire_quota(service)
+        started = time.monotonic()
+        response = send()
+        record_latency_sample(endpoint, time.monotonic() - started)
+        return response
+
+    if hedge_after is None:
+        return timed_send()  # not enough latencies measured yet to know what slow is
+    primary = _hedge_executor.submit(timed_send)
+    if not _allow_hedge():
+        return primary.result()
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    with _hedge_lock:
+        _hedge_stats['hedged'] += 1
+    backup = _hedge_executor.submit(timed_send, True)
+    pending = {primary, backup}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                response = future.result()
+            except requests.exceptions.RequestException as e:
+                error = error or e
+                continue
+            if future is backup:
+                with _hedge_lock:
+                    _hedge_stats['backup_won'] += 1
+            return response
+    raise error
+
+def hedge_stats():
+    """
+    Function to get how many hedgeable calls were made, how many sent a backup and how many the backup won
+    """
+    with _hedge_lock:
+        return dict(_hedge_stats)
+
+def call_with_retry(method, url, send, idempotent=None, policy=None, hedge=False):
+    """
+    Function to run send() (one attempt of a request) under the retry policy, the host's circuit breaker and rate limit
+    Retries connection errors, timeouts, 429 and 5xx responses
+    Non-idempotent requests (POST/PATCH unless idempotent=True) are only retried when the server
+    can't have acted on them: connect timeouts and 429s
+    hedge=True lets an idempotent request send a backup copy when HTTP_HEDGING is on (see _hedged_send)
+    Returns the last response (callers still call raise_for_status()), or raises the last error
+    """
+    policy = policy or DEFAULT_POLICY
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    hedged = hedge and idempotent and HTTP_HEDGING
+    breaker = get_breaker(url)
+    rate_limiter = get_rate_limiter(url)
+    endpoint = _stats_endpoint(url)
+    service = _quota_service(url)
+    delay = policy.base_delay
+
+    for attempt in range(1, policy.max_attempts + 1):
+        last_attempt = attempt == policy.max_attempts
+        try:
+            breaker.before_request()
+        except CircuitOpenError:
+            until_trial = breaker.seconds_until_trial()
+            if last_attempt or until_trial > policy.max_delay:
+                raise
+            if not until_trial:
+                # Another thread's trial request is in flight, give it the usual backoff to finish
+                delay = policy.next_delay(delay)
+                until_trial = delay
+            time.sleep(until_trial)
+            continue
+
+        # The broker paces every process on the host, without one this process paces itself
+        brokered = service is not None and acquire_quota(service)
+        if rate_limiter and not brokered:
+            rate_limiter.wait()
+        started = time.monotonic()
+        try:
+            response = _hedged_send(send, endpoint, service) if hedged else send()
+        except (NonRetryableError, CassetteMiss):
+            # Nothing was sent, so this says nothing about the host
+            breaker.release_trial()
+            raise
+        except requests.exceptions.RequestException as e:
+            breaker.record_failure()
+            safe_to_retry = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+            if last_attempt or not safe_to_retry:
+                raise
+            delay = policy.next_delay(delay)
+            print(f"{method} {endpoint} failed ({e}), retry {attempt}/{policy.max_attempts - 1} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        elapsed = time.monotonic() - started
+        record_latency(endpoint, elapsed, sample=not hedged)
+        note_request(elapsed)
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+            return response
+        if response.status_code != 429 and not idempotent:
+            return response
+
+        delay = policy.next_delay(delay)
+        retry_after = _retry_after(response)
+        if retry_after is not None:
+            delay = min(max(delay, retry_after), policy.max_delay)
+        if response.status_code == 429 and service is not None:
+            report_throttle(service, delay)
+        print(f"{method} {endpoint} returned {response.status_code}, retry {attempt}/{policy.max_attempts - 1} in {delay:.1f}s")
+        time.sleep(delay)
+
+def request(method, url, idempotent=None, policy=None, **kwargs):
+    """
+    Function to make an HTTP request through the shared session with retries
+    Takes the same keyword arguments as requests.request, timeout defaults to DEFAULT_TIMEOUT
+    """
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    return call_with_retry(method, url, lambda: _session.request(method, url, **kwargs), idempotent, policy)
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, idempotent=False, **kwargs):
+    return request('POST', url, idempotent=idempotent, **kwargs)
+
+def patch(url, idempotent=False, **kwargs):
+    return request('PATCH', url, idempotent=idempotent, **kwargs)
@@ -0,0 +1,170 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from cassette import mount_cassette
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+# Local content-addressed store for profile pictures
+# objects/<aa>/<sha256> holds the image bytes, refs/<sha1(key)> holds the digest for an account
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR') or os.path.join(os.path.dirname(__file__), "..", "data", "images")
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', 8))
+
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=PREFETCH_WORKERS, pool_maxsize=PREFETCH_WORKERS))
+mount_cassette(_session, pool_connections=PREFETCH_WORKERS, pool_maxsize=PREFETCH_WORKERS)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = []
+
+def _object_path(digest):
+    return os.path.join(IMAGE_STORE_DIR, 'objects', digest[:2], digest)
+
+def _ref_path(key):
+    key_hash = hashlib.sha1(str(key).encode('utf-8')).hexdigest()
+    return os.path.join(IMAGE_STORE_DIR, 'refs', key_hash[:2], key_hash)
+
+def _atomic_write(path, data):
+    """
+    Function to write a file atomically so readers never see a partial image
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def store_image_bytes(data):
+    """
+    Function to store image bytes under their sha256 digest
+    Identical pictures (e.g. default avatars) are only stored once
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    path = _object_path(digest)
+    if not os.path.exists(path):
+        _atomic_write(path, data)
+    return digest
+
+def link_image(key, digest):
+    """
+    Function to point an account key (Pk Id or Username) at a stored image
+    """
+    _atomic_write(_ref_path(key), digest.encode('ascii'))
+
+def get_image_digest(key):
+    """
+    Function to look up the stored image digest for an account key
+    Returns None if the picture has not been fetched yet
+    """
+    try:
+        with open(_ref_path(key), 'r') as f:
+            digest = f.read().strip()
+    except FileNotFoundError:
+        return None
+
+    if digest and os.path.exists(_object_path(digest)):
+        return digest
+    return None
+
+def read_image(key):
+    """
+    Function to read the stored profile picture bytes for an account key
+    Uses a memory-mapped read, returns None if nothing is stored
+    """
+    digest = get_image_digest(key)
+    if not digest:
+        return None
+
+    with open(_object_path(digest), 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[:]
+
+def download_image(key, image_url):
+    """
+    Function to download a profile picture and store it locally
+    Skips the download if the account already has a stored picture
+    Returns the digest, or None if the download failed (e.g. expired CDN url)
+    """
+    digest = get_image_digest(key)
+    if digest:
+        return digest
+
+    try:
+        response = _session.get(image_url, timeout=(5, 30))
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Error downloading profile picture for {key}: {e}")
+        return None
+
+    if not response.content:
+        return None
+
+    digest = store_image_bytes(response.content)
+    link_image(key, digest)
+    return digest
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='pfp-prefetch')
+        return _executor
+
+def prefetch_profile_pictures(accounts):
+    """
+    Function to queue profile picture downloads in the background
+    accounts is an iterable of (key, image_url) pairs, returns immediately
+    """
+    executor = _get_executor()
+    futures = []
+    for key, image_url in accounts:
+        if not key or not image_url:
+            continue
+        futures.append(executor.submit(download_image, key, image_url))
+
+    with _executor_lock:
+        _pending[:] = [f for f in _pending if not f.done()]
+        _pending.extend(futures)
+    return futures
+
+def prefetch_from_records(records):
+    """
+    Function to queue downloads for Airtable record payloads that have Pk Id / Username and Pfp Url fields
+    """
+    accounts = []
+    for record in records:
+        fields = record.get('fields', {})
+        accounts.append((image_key(fields), fields.get('Pfp Url')))
+    return prefetch_profile_pictures(accounts)
+
+def image_key(fields):
+    """
+    Function to build the store key for an account from its Airtable fields
+    Prefers the stable Pk Id over the username
+    """
+    key = fields.get('Pk Id') or fields.get('Username')
+    return str(key) if key else None
+
+def wait_for_prefetch():
+    """
+    Function to block until all queued downloads are finished
+    """
+    with _executor_lock:
+        pending = list(_pending)
+        _pending.clear()
+    if pending:
+        wait(pending)
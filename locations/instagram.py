@@ -2,9 +2,12 @@ import os
 import requests
 from dotenv import load_dotenv
 
+from rapidapi_keys import rapidapi_get
+from endpoint_stats import record_page_size
+
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
 
-RAPIDAPI_KEY = os.getenv('RAPIDAPI_KEY')
+# Keys come from the pool in rapidapi_keys.py (RAPIDAPI_KEYS, or the single RAPIDAPI_KEY)
 RAPIDAPI_HOST = os.getenv('RAPIDAPI_HOST')
 
 def get_location_ids(location_name):
@@ -15,17 +18,12 @@ def get_location_ids(location_name):
     
     url = "https://instagram-scraper-api2.p.rapidapi.com/v1/search_location"
     
-    headers = {
-        "x-rapidapi-key": os.getenv('RAPIDAPI_KEY'),
-        "x-rapidapi-host": os.getenv('RAPIDAPI_HOST')
-    }
-    
     query_params = {
         "search_query": location_name
     }
     
     try:
-        response = requests.get(url, headers=headers, params=query_params)
+        response = rapidapi_get(url, params=query_params)
         response.raise_for_status()  # Raises a HTTPError if the status is 4XX, 5XX
         return response.json()
         
@@ -41,11 +39,6 @@ def get_location_posts(location_id, pagination_token=None):
     
     url = "https://instagram-scraper-api2.p.rapidapi.com/v1/location_posts"
     
-    headers = {
-        "x-rapidapi-key": os.getenv('RAPIDAPI_KEY'),
-        "x-rapidapi-host": os.getenv('RAPIDAPI_HOST')
-    }
-    
     query_params = {
         "location_id": location_id
     }
@@ -54,9 +47,11 @@ def get_location_posts(location_id, pagination_token=None):
         query_params["pagination_token"] = pagination_token
     
     try:
-        response = requests.get(url, headers=headers, params=query_params)
+        response = rapidapi_get(url, params=query_params, hedge=True)
         response.raise_for_status()
-        return response.json()
+        data = response.json()
+        record_page_size('location_posts', len(data.get('data', {}).get('items', [])))
+        return data
         
     except requests.exceptions.RequestException as e:
         print(f"Error fetching location posts: {e}")
@@ -70,11 +65,6 @@ def get_followers(username, pagination_token=None):
     
     url = "https://instagram-scraper-api2.p.rapidapi.com/v1/followers"
     
-    headers = {
-        "x-rapidapi-key": os.getenv('RAPIDAPI_KEY'),
-        "x-rapidapi-host": os.getenv('RAPIDAPI_HOST')
-    }
-    
     query_params = {
         "username_or_id_or_url": username
     }
@@ -83,9 +73,11 @@ def get_followers(username, pagination_token=None):
         query_params["pagination_token"] = pagination_token
     
     try:
-        response = requests.get(url, headers=headers, params=query_params)
+        response = rapidapi_get(url, params=query_params)
         response.raise_for_status()
-        return response.json()
+        data = response.json()
+        record_page_size('followers', len(data.get('data', {}).get('items', [])))
+        return data
         
     except requests.exceptions.RequestException as e:
         print(f"Error fetching followers: {e}")
@@ -97,17 +89,12 @@ def get_user_info(username):
     """
     url = "https://instagram-scraper-api2.p.rapidapi.com/v1/info"
     
-    headers = {
-        "x-rapidapi-key": os.getenv('RAPIDAPI_KEY'),
-        "x-rapidapi-host": os.getenv('RAPIDAPI_HOST')
-    }
-    
     query_params = {
         "username_or_id_or_url": username
     }
     
     try:
-        response = requests.get(url, headers=headers, params=query_params)
+        response = rapidapi_get(url, params=query_params, hedge=True)
         response.raise_for_status()
         return response.json()
         
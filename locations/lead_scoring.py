@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from dotenv import load_dotenv
+from account_registry import get_registry, LOCATION_POSTS, BUSINESS_NETWORK, NETWORK
+from airtable import fetch_all, update_records
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+# Lead scoring over the local account registry
+# Follower / following / media counts, gender, private / verified flags and how recently the account was
+# seen at a location are loaded into NumPy columns and every account is scored in one vectorized pass
+# Scores are saved in the registry (so pipelines can work through their queues best lead first)
+# and written to the Airtable tables, where network_to_targets picks up the qualified accounts
+# LEAD_SCORING_CONFIG points at a JSON file overriding any of the DEFAULT_SCORING values
+LEAD_SCORING_CONFIG = os.getenv('LEAD_SCORING_CONFIG')
+
+DEFAULT_SCORING = {
+    # Each component is 0-1, the score is their weighted average
+    'weights': {
+        'followers': 0.3,   # log scaled across follower_range
+        'ratio': 0.15,      # followers per following, 100x and up scores 1
+        'media': 0.1,       # log scaled, 1000 posts and up scores 1
+        'female': 0.3,      # gender confidence if female, 0 if male, neutral if unchecked
+        'recency': 0.15,    # halves every recency_half_life_days since last seen at a location
+        'verified': 0.0
+    },
+    # Hard requirements for a qualified lead
+    'follower_range': [1000, 100000],
+    'min_media': 5,
+    'exclude_private': True,
+    'exclude_male': True,
+    'min_score': 0.5,
+    'recency_half_life_days': 30,
+    # Components that can't be worked out yet (e.g. no profile fetched) count as this
+    'unknown_value': 0.5
+}
+
+# Airtable table and (pk id, score, qualified) fields per registry table
+SCORED_TABLES = {
+    NETWORK: (os.getenv('AIRTABLE_NETWORK_TABLE'), 'pk_id', 'lead_score', 'lead_qualified'),
+    BUSINESS_NETWORK: (os.getenv('AIRTABLE_BUSINESS_NETWORK_TABLE'), 'Pk Id', 'Lead Score', 'Lead Qualified'),
+    LOCATION_POSTS: (os.getenv('AIRTABLE_LOCATION_POSTS_TABLE'), 'Pk Id', 'Lead Score', 'Lead Qualified')
+}
+# Scores that moved less than this since they were written aren't rewritten
+SYNC_MIN_CHANGE = 0.01
+
+def load_scoring_config(path=LEAD_SCORING_CONFIG):
+    config = json.loads(json.dumps(DEFAULT_SCORING))
+    if path:
+        with open(path, 'r') as f:
+            overrides = json.load(f)
+        config['weights'].update(overrides.pop('weights', {}))
+        config.update(overrides)
+    return config
+
+def load_columns(rows):
+    """
+    Function to turn registry scoring rows into a dict of NumPy columns, missing numbers become NaN
+    """
+    pk_ids, followers, following, media, private, verified, gender, confidence, last_seen = (
+        zip(*rows) if rows else ([],) * 9)
+    return {
+        'pk_id': np.array(pk_ids, dtype=object),
+        'followers': np.array(followers, dtype=float),
+        'following': np.array(following, dtype=float),
+        'media': np.array(media, dtype=float),
+        'private': np.array([p == 1 for p in private], dtype=bool),
+        'verified': np.array([v == 1 for v in verified], dtype=bool),
+        'gender': np.array([(g or '').lower() for g in gender], dtype=object),
+        'gender_confidence': np.array(confidence, dtype=float),
+        'last_seen': np.array(last_seen, dtype=float)
+    }
+
+def score_columns(columns, config=None, now=None):
+    """
+    Function to score every account at once
+    Returns (scores, qualified) arrays in the same order as the columns
+    """
+    config = config or load_scoring_config()
+    now = now or time.time()
+    unknown = config['unknown_value']
+    low, high = (np.log10(max(v, 1)) for v in config['follower_range'])
+    followers = columns['followers']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_followers = np.log10(np.maximum(followers, 1))
+        components = {
+            'followers': np.clip((log_followers - low) / max(high - low, 1e-9), 0, 1),
+            'ratio': np.clip(np.log10(followers / (columns['following'] + 1) + 1) / 2, 0, 1),
+            'media': np.clip(np.log10(columns['media'] + 1) / 3, 0, 1),
+            'recency': np.exp2(-(now - columns['last_seen']) / 86400 / config['recency_half_life_days']),
+            'verified': columns['verified'].astype(float)
+        }
+    gender = columns['gender']
+    confidence = np.nan_to_num(columns['gender_confidence'], nan=1.0)
+    components['female'] = np.where(gender == 'female', np.clip(confidence, 0, 1),
+                                    np.where(gender == 'male', 0.0, unknown))
+
+    total_weight = sum(abs(w) for w in config['weights'].values()) or 1.0
+    scores = np.zeros(len(followers))
+    for name, weight in config['weights'].items():
+        if weight:
+            scores += weight * np.nan_to_num(components[name], nan=unknown)
+    scores = np.clip(scores / total_weight, 0, 1)
+
+    # NaN comparisons are False, so accounts without a fetched profile never qualify
+    qualified = ((followers >= config['follower_range'][0]) & (followers <= config['follower_range'][1]) &
+                 (columns['media'] >= config['min_media']) & (scores >= config['min_score']))
+    if config['exclude_private']:
+        qualified &= ~columns['private']
+    if config['exclude_male']:
+        qualified &= gender != 'male'
+    return scores, qualified
+
+def score_accounts(table=None, config=None):
+    """
+    Function to score every registry account (or those in one registry table) and save the scores
+    Returns the columns with 'score' and 'qualified' added
+    """
+    registry = get_registry()
+    started = time.monotonic()
+    columns = load_columns(registry.scoring_rows(table))
+    loaded = time.monotonic()
+    scores, qualified = score_columns(columns, config)
+    scored = time.monotonic()
+    registry.record_lead_scores(columns['pk_id'], scores, qualified)
+    print(f"Scored {len(scores)} accounts ({int(qualified.sum())} qualified): "
+          f"load {loaded - started:.2f}s, score {scored - loaded:.3f}s, save {time.monotonic() - scored:.2f}s")
+    columns['score'] = scores
+    columns['qualified'] = qualified
+    return columns
+
+def sync_lead_scores(table, min_change=SYNC_MIN_CHANGE):
+    """
+    Function to write changed lead scores of the accounts in a registry table to its Airtable table
+    Only rows that already exist are updated (PATCH by record id, 10 per request), every row holding the
+    account's pk id gets its score and accounts without a row are skipped
+    Returns the number of rows written
+    """
+    airtable_table, pk_field, score_field, qualified_field = SCORED_TABLES[table]
+    if not airtable_table:
+        print(f"No Airtable table configured for {table}, not writing scores")
+        return 0
+    registry = get_registry()
+    rows = registry.unsynced_lead_scores(table, min_change)
+    if not rows:
+        print(f"Lead scores in {table} are up to date")
+        return 0
+
+    # One scan of the pk id field maps accounts to their rows
+    record_ids = {}
+    for record in fetch_all(airtable_table, {'fields[]': [pk_field]}):
+        pk_id = record.get('fields', {}).get(pk_field)
+        if pk_id is not None:
+            record_ids.setdefault(str(pk_id), []).append(record['id'])
+    scores = [(row['pk_id'], round(row['lead_score'], 4), row['lead_qualified']) for row in rows]
+    missing = sum(1 for pk_id, _, _ in scores if str(pk_id) not in record_ids)
+    scores = [score for score in scores if str(score[0]) in record_ids]
+
+    written = 0
+    # Chunks keep progress when a long sync stops part way
+    for i in range(0, len(scores), 500):
+        chunk = scores[i:i + 500]
+        records = [{"id": record_id, "fields": {score_field: score, qualified_field: bool(ok)}}
+                   for pk_id, score, ok in chunk for record_id in record_ids[str(pk_id)]]
+        if update_records(airtable_table, records, 'lead scores') < len(records):
+            print(f"Error writing lead scores to {airtable_table}, stopping (the rest are written next time)")
+            break
+        registry.mark_lead_scores_synced(table, chunk)
+        written += len(records)
+    print(f"Wrote {written} lead scores to {airtable_table}"
+          + (f", skipped {missing} accounts with no row in the table" if missing else ""))
+    return written
+
+def rank_by_lead_score(records, pk_id_field):
+    """
+    Function to order Airtable records best lead first by their saved score, unscored records last (in their order)
+    """
+    scores = get_registry().lead_scores(record.get('fields', {}).get(pk_id_field) for record in records)
+    if not scores:
+        return records
+    return sorted(records, key=lambda record: -scores.get(str(record.get('fields', {}).get(pk_id_field)), -1.0))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score leads in the account registry and write the scores to Airtable")
+    parser.add_argument('--table', choices=list(SCORED_TABLES), help="only score accounts in this table (default: every account)")
+    parser.add_argument('--write', action='store_true', help="write changed scores to the Airtable table(s)")
+    parser.add_argument('--top', type=int, default=10, help="show the best N leads")
+    args = parser.parse_args()
+
+    columns = score_accounts(args.table)
+    scores = columns['score']
+    if len(scores):
+        print("score percentiles: " + ", ".join(f"p{p} {v:.2f}" for p, v in zip((10, 50, 90, 99), np.percentile(scores, [10, 50, 90, 99]))))
+        for i in np.argsort(-scores)[:args.top]:
+            print(f"  {columns['pk_id'][i]:<22} {scores[i]:.3f} {'qualified' if columns['qualified'][i] else ''}")
+    if args.write:
+        for table in ([args.table] if args.table else list(SCORED_TABLES)):
+            sync_lead_scores(table)
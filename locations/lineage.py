@@ -0,0 +1,142 @@
+import argparse
+import atexit
+import json
+import math
+import os
+import threading
+import time
+
+# Lightweight per-lead tracing: every pipeline stage appends one span per account (keyed by pk id)
+# to data/lineage.jsonl with when the stage started and finished work on it
+# The summary splits each stage into queueing (waiting since the previous stage) and service time
+LINEAGE_FILE = os.getenv('LINEAGE_FILE') or os.path.join(os.path.dirname(__file__), "..", "data", "lineage.jsonl")
+LINEAGE_ENABLED = os.getenv('LINEAGE_TRACING', '1') != '0'
+
+# Stages in pipeline order
+CREATED = 'created'
+GENDER = 'gender'
+ENRICHED = 'enriched'
+STAGES = (CREATED, GENDER, ENRICHED)
+
+_lock = threading.Lock()
+_file = None
+
+def _close():
+    global _file
+    with _lock:
+        if _file:
+            _file.close()
+            _file = None
+
+def record_span(pk_id, stage, started, ended=None, **attributes):
+    """
+    Function to append a span for one account
+    started / ended are unix times (ended defaults to now), attributes are extra context such as the pipeline
+    """
+    global _file
+    if not LINEAGE_ENABLED or pk_id is None:
+        return
+    span = {'pk_id': str(pk_id), 'stage': stage, 'start': round(started, 3),
+            'end': round(ended if ended is not None else time.time(), 3)}
+    span.update(attributes)
+    line = json.dumps(span) + '\n'
+    with _lock:
+        if _file is None:
+            os.makedirs(os.path.dirname(LINEAGE_FILE), exist_ok=True)
+            _file = open(LINEAGE_FILE, 'a', buffering=1)
+            atexit.register(_close)
+        _file.write(line)
+
+def record_spans(pk_ids, stage, started, ended=None, **attributes):
+    """
+    Function to append the same span for several accounts handled together (e.g. one page or batch)
+    """
+    ended = ended if ended is not None else time.time()
+    for pk_id in pk_ids:
+        record_span(pk_id, stage, started, ended, **attributes)
+
+def load_spans(path=LINEAGE_FILE):
+    spans = []
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # a line cut short by a crash
+    except FileNotFoundError:
+        pass
+    return spans
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+def summarize(spans):
+    """
+    Function to work out per-stage queueing and service times
+    Queueing is the gap between an account's previous stage finishing and this stage starting
+    Returns {stage: {'service': [...], 'queue': [...]}} plus the end-to-end times under 'end_to_end'
+    """
+    by_account = {}
+    for span in spans:
+        by_account.setdefault(span['pk_id'], []).append(span)
+
+    stages = {stage: {'service': [], 'queue': []} for stage in STAGES}
+    end_to_end = []
+    for account_spans in by_account.values():
+        # Only an account's first span per stage counts, later ones are re-runs (e.g. re-enrichment)
+        first = {}
+        for span in sorted(account_spans, key=lambda s: s['start']):
+            first.setdefault(span['stage'], span)
+
+        previous_end = None
+        for stage in STAGES:
+            span = first.get(stage)
+            if not span:
+                continue
+            entry = stages.setdefault(stage, {'service': [], 'queue': []})
+            entry['service'].append(span['end'] - span['start'])
+            if previous_end is not None:
+                entry['queue'].append(max(span['start'] - previous_end, 0))
+            previous_end = span['end']
+
+        if all(stage in first for stage in STAGES):
+            end_to_end.append(first[STAGES[-1]]['end'] - first[STAGES[0]]['start'])
+
+    stages['end_to_end'] = end_to_end
+    return stages
+
+def format_seconds(seconds):
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f}min"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f}h"
+    return f"{seconds / 86400:.1f}d"
+
+def print_distribution(label, values):
+    if not values:
+        print(f"  {label:<10} no data")
+        return
+    print(f"  {label:<10} n={len(values):<7} p50 {format_seconds(percentile(values, 0.5)):>8}  "
+          f"p90 {format_seconds(percentile(values, 0.9)):>8}  p99 {format_seconds(percentile(values, 0.99)):>8}  "
+          f"max {format_seconds(max(values)):>8}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise lead lineage spans: where leads wait between pipeline stages")
+    parser.add_argument('--file', default=LINEAGE_FILE, help="trace file to read")
+    args = parser.parse_args()
+
+    spans = load_spans(args.file)
+    print(f"{len(spans)} spans for {len({span['pk_id'] for span in spans})} accounts")
+    summary = summarize(spans)
+    for stage in STAGES:
+        print(f"\n{stage}")
+        print_distribution('queueing', summary[stage]['queue'])
+        print_distribution('service', summary[stage]['service'])
+    print("\nfirst created to enriched")
+    print_distribution('total', summary['end_to_end'])
@@ -0,0 +1,156 @@
+import math
+from endpoint_stats import get_stat, is_measured, service_for
+from rapidapi_keys import get_key_pool
+
+# Requests per second allowed per service, Airtable allows 5 per base
+SERVICE_RATE_LIMITS = {
+    'airtable': 5.0
+}
+
+def pages_for(endpoint, items_needed):
+    """
+    Function to estimate how many pages an endpoint needs to return items_needed items
+    """
+    if items_needed <= 0:
+        return 0
+    return math.ceil(items_needed / max(get_stat(endpoint, 'page_size'), 1))
+
+def airtable_read_calls(rows):
+    """
+    Function to estimate the list requests needed to read rows (100 per page)
+    """
+    return max(1, math.ceil(rows / 100))
+
+def airtable_write_calls(rows):
+    """
+    Function to estimate the create/update requests needed to write rows (10 per request)
+    """
+    return math.ceil(rows / 10)
+
+def add_plan_arguments(parser, budget_unit='RapidAPI'):
+    """
+    Function to add the shared --plan / --budget options to an entry point's argument parser
+    """
+    parser.add_argument('--plan', action='store_true', help="estimate requests, quota and wall time for the pending work, then exit")
+    parser.add_argument('--budget', type=int, help=f"cap the run to the pending work that fits in this many {budget_unit} calls")
+
+class Plan:
+    """
+    Estimated requests for a pipeline run
+    Each work item (location, target, row...) has its own per-endpoint call counts so the run can be cut to a budget
+    """
+
+    def __init__(self, name, budget_service='rapidapi', concurrency=1):
+        self.name = name
+        self.budget_service = budget_service
+        self.concurrency = max(concurrency, 1)
+        self.fixed_calls = {}
+        self.items = []
+        self.notes = []
+
+    def add_fixed(self, calls):
+        """
+        Function to add calls that happen once per run (e.g. reading the pending work)
+        """
+        for endpoint, count in calls.items():
+            self.fixed_calls[endpoint] = self.fixed_calls.get(endpoint, 0) + count
+
+    def add_item(self, label, item, calls):
+        self.items.append({'label': label, 'item': item, 'calls': calls})
+
+    def add_note(self, note):
+        if note not in self.notes:
+            self.notes.append(note)
+
+    def endpoint_calls(self, items=None):
+        totals = dict(self.fixed_calls)
+        for entry in self.items if items is None else items:
+            for endpoint, count in entry['calls'].items():
+                totals[endpoint] = totals.get(endpoint, 0) + count
+        return totals
+
+    def service_calls(self, items=None):
+        totals = {}
+        for endpoint, count in self.endpoint_calls(items).items():
+            service = service_for(endpoint)
+            totals[service] = totals.get(service, 0) + count
+        return totals
+
+    def wall_time(self, items=None):
+        """
+        Function to estimate wall time for a run making concurrency calls at once
+        Each call takes its measured latency (shared between the concurrent calls), or longer if the service rate limit is the bottleneck
+        """
+        rate_limits = dict(SERVICE_RATE_LIMITS)
+        rapidapi_rate = sum(1.0 / k['min_interval'] for k in get_key_pool().keys if k['min_interval'])
+        if rapidapi_rate:
+            rate_limits['rapidapi'] = rapidapi_rate
+
+        seconds = 0.0
+        for endpoint, count in self.endpoint_calls(items).items():
+            per_call = get_stat(endpoint, 'latency') / self.concurrency
+            rate = rate_limits.get(service_for(endpoint))
+            if rate:
+                per_call = max(per_call, 1.0 / rate)
+            seconds += count * per_call
+        return seconds
+
+    def fit_to_budget(self, budget):
+        """
+        Function to get the work items (in order) that fit in a budget of budget_service calls
+        """
+        spent = self.service_calls([]).get(self.budget_service, 0)
+        fitted = []
+        for entry in self.items:
+            cost = sum(count for endpoint, count in entry['calls'].items() if service_for(endpoint) == self.budget_service)
+            if spent + cost > budget:
+                break
+            spent += cost
+            fitted.append(entry)
+
+        print(f"Budget of {budget} {self.budget_service} calls covers {len(fitted)} of {len(self.items)} items "
+              f"(~{spent} calls, ~{format_duration(self.wall_time(fitted))})")
+        return [entry['item'] for entry in fitted]
+
+    def print_summary(self, budget=None):
+        print(f"\nPlan for {self.name}: {len(self.items)} pending items")
+        for endpoint, count in sorted(self.endpoint_calls().items()):
+            source = 'measured' if is_measured(endpoint, 'latency') else 'default'
+            print(f"  {endpoint:<18} {count:>8} calls  ({get_stat(endpoint, 'latency'):.2f}s each, {source})")
+
+        for service, count in sorted(self.service_calls().items()):
+            print(f"  total {service:<12} {count:>8} calls")
+
+        rapidapi_calls = self.service_calls().get('rapidapi', 0)
+        remaining = remaining_monthly_quota()
+        if rapidapi_calls and remaining is not None:
+            print(f"  RapidAPI quota: {rapidapi_calls} of {remaining} calls left this month ({rapidapi_calls / max(remaining, 1):.0%})")
+
+        print(f"  estimated wall time: {format_duration(self.wall_time())}")
+
+        for note in self.notes:
+            print(f"  note: {note}")
+
+        if budget is not None:
+            self.fit_to_budget(budget)
+
+def remaining_monthly_quota():
+    """
+    Function to get the RapidAPI calls left this month across all keys, None if any key is unlimited
+    """
+    keys = get_key_pool().keys
+    if not keys:
+        return None
+    remaining = 0
+    for key in keys:
+        if not key['monthly_quota']:
+            return None
+        remaining += max(key['monthly_quota'] - key['month_calls'], 0)
+    return remaining
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f}min"
+    return f"{seconds / 3600:.1f}h"
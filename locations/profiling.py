@@ -0,0 +1,197 @@
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Opt-in profiling for the pipeline entry points (--profile)
+# A run is split into named stages marked with mark_stage(); for each stage the report has wall time,
+# tracemalloc peak memory and the time spent in HTTP calls (summed over threads, so it can exceed the wall time)
+# The main thread also runs under cProfile. Reports go to data/profiles/<entry>-<time>.json (sorted, for
+# `python profiling.py diff old.json new.json`), plus a readable .txt and the raw .prof for snakeviz etc.
+PROFILE_DIR = os.getenv('PROFILE_DIR') or os.path.join(os.path.dirname(__file__), "..", "data", "profiles")
+PROFILE_TOP_FUNCTIONS = int(os.getenv('PROFILE_TOP_FUNCTIONS', 40))
+
+_active = None
+
+class _Profile:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.stages = []
+        self.current = None
+        self.profiler = cProfile.Profile()
+
+    def start_stage(self, stage):
+        now = time.monotonic()
+        with self.lock:
+            self._end_stage(now)
+            tracemalloc.reset_peak()
+            self.current = {'stage': stage, 'started': now, 'http_seconds': 0.0, 'requests': 0,
+                            'memory_start': tracemalloc.get_traced_memory()[0]}
+
+    def _end_stage(self, now):
+        if self.current is None:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        stage = self.current
+        self.stages.append({
+            'stage': stage['stage'],
+            'wall_seconds': round(now - stage['started'], 3),
+            'http_seconds': round(stage['http_seconds'], 3),
+            'requests': stage['requests'],
+            'peak_memory_kb': round(peak / 1024),
+            'memory_growth_kb': round((current - stage['memory_start']) / 1024)
+        })
+        self.current = None
+
+    def note_request(self, seconds):
+        with self.lock:
+            if self.current is not None:
+                self.current['http_seconds'] += seconds
+                self.current['requests'] += 1
+
+    def finish(self):
+        with self.lock:
+            self._end_stage(time.monotonic())
+
+def mark_stage(stage):
+    """
+    Function to start a new profiling stage (ending the previous one), does nothing unless the run is profiled
+    """
+    if _active is not None:
+        _active.start_stage(stage)
+
+def note_request(seconds):
+    """
+    Function for http_client to add one request's duration to the current stage
+    """
+    if _active is not None:
+        _active.note_request(seconds)
+
+def add_profile_argument(parser):
+    """
+    Function to add the shared --profile option to an entry point's argument parser
+    """
+    parser.add_argument('--profile', action='store_true',
+                        help="profile the run (CPU, wall time and peak memory per stage) and write a report to data/profiles")
+
+def _function_stats(profiler):
+    """
+    Function to get the top functions by cumulative time, keyed by a stable file:line(function) name
+    """
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        name = f"{os.path.basename(filename)}:{line}({function})"
+        rows.append((name, {'calls': calls, 'tottime': round(tottime, 4), 'cumtime': round(cumtime, 4)}))
+    rows.sort(key=lambda row: row[1]['cumtime'], reverse=True)
+    return dict(rows[:PROFILE_TOP_FUNCTIONS])
+
+def _write_reports(profile, wall_seconds, profile_dir):
+    os.makedirs(profile_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    base_path = os.path.join(profile_dir, f"{profile.name}-{stamp}")
+
+    report = {
+        'entry': profile.name,
+        'started_at': stamp,
+        'wall_seconds': round(wall_seconds, 3),
+        'stages': profile.stages,
+        'functions': _function_stats(profile.profiler)
+    }
+    with open(f"{base_path}.json", 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    profile.profiler.dump_stats(f"{base_path}.prof")
+
+    text = io.StringIO()
+    text.write(f"{profile.name}: {wall_seconds:.1f}s wall\n\n")
+    text.write(format_stages(profile.stages))
+    text.write("\nMain thread CPU profile (worker threads show up as waits)\n")
+    pstats.Stats(profile.profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    with open(f"{base_path}.txt", 'w') as f:
+        f.write(text.getvalue())
+    return f"{base_path}.json"
+
+def format_stages(stages):
+    lines = [f"{'stage':<24} {'wall':>9} {'http':>9} {'requests':>9} {'peak mem':>10}\n"]
+    for stage in stages:
+        lines.append(f"{stage['stage']:<24} {stage['wall_seconds']:>8.1f}s {stage['http_seconds']:>8.1f}s "
+                     f"{stage['requests']:>9} {stage['peak_memory_kb'] / 1024:>8.1f}MB\n")
+    return ''.join(lines)
+
+@contextmanager
+def profile_run(name, enabled=True, profile_dir=PROFILE_DIR):
+    """
+    Context manager to profile an entry point run when enabled, e.g.
+    with profile_run('process_gender_labels', args.profile): process_gender_labels(...)
+    """
+    global _active
+    if not enabled:
+        yield
+        return
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _active = _Profile(name)
+    _active.start_stage('setup')
+    started = time.monotonic()
+    _active.profiler.enable()
+    try:
+        yield
+    finally:
+        _active.profiler.disable()
+        _active.finish()
+        profile, _active = _active, None
+        if started_tracing:
+            tracemalloc.stop()
+        path = _write_reports(profile, time.monotonic() - started, profile_dir)
+        print(f"\nProfile of {name}\n{format_stages(profile.stages)}Report written to {path}")
+
+def diff_reports(old, new):
+    """
+    Function to get the stage and function changes between two JSON reports as printable lines
+    """
+    lines = [f"wall {old['wall_seconds']:.1f}s -> {new['wall_seconds']:.1f}s"]
+    old_stages = {stage['stage']: stage for stage in old['stages']}
+    for stage in new['stages']:
+        before = old_stages.get(stage['stage'])
+        if not before:
+            lines.append(f"  {stage['stage']}: new stage, {stage['wall_seconds']:.1f}s")
+            continue
+        lines.append(f"  {stage['stage']}: wall {before['wall_seconds']:.1f}s -> {stage['wall_seconds']:.1f}s, "
+                     f"http {before['http_seconds']:.1f}s -> {stage['http_seconds']:.1f}s, "
+                     f"requests {before['requests']} -> {stage['requests']}, "
+                     f"peak {before['peak_memory_kb'] / 1024:.1f}MB -> {stage['peak_memory_kb'] / 1024:.1f}MB")
+
+    changes = []
+    for function in set(old['functions']) | set(new['functions']):
+        before = old['functions'].get(function, {}).get('cumtime', 0.0)
+        after = new['functions'].get(function, {}).get('cumtime', 0.0)
+        changes.append((after - before, function, before, after))
+    changes.sort(key=lambda change: abs(change[0]), reverse=True)
+    lines.append("largest cumulative time changes")
+    for delta, function, before, after in changes[:20]:
+        lines.append(f"  {delta:+8.3f}s  {before:8.3f}s -> {after:8.3f}s  {function}")
+    return lines
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two --profile reports")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    diff_parser = subparsers.add_parser('diff', help="show what changed between two JSON reports")
+    diff_parser.add_argument('old')
+    diff_parser.add_argument('new')
+    args = parser.parse_args()
+
+    with open(args.old, 'r') as f:
+        old_report = json.load(f)
+    with open(args.new, 'r') as f:
+        new_report = json.load(f)
+    print('\n'.join(diff_reports(old_report, new_report)))
@@ -0,0 +1,309 @@
+import argparse
+import heapq
+import itertools
+import json
+import os
+import select
+import signal
+import socket
+import socketserver
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+# Host-wide quota broker so every pipeline script running at the same time shares one
+# Airtable base limit and one RapidAPI plan instead of each pacing itself and 429-ing the others
+# Run it with `python quota_broker.py serve`, the HTTP layer of every process then asks it for a token
+# before each request; when no broker is running processes fall back to their own local pacing
+QUOTA_BROKER_SOCKET = os.getenv('QUOTA_BROKER_SOCKET') or os.path.join(os.path.dirname(__file__), "..", "data", "quota_broker.sock")
+# service:requests_per_second[:burst], comma separated, services not listed are not limited by the broker
+# A client asking for service/instance (e.g. airtable/appXXXX, one per base) gets its own bucket with the service's rate
+# The default RapidAPI rate is the whole key pool's, each key adds its own rate (see rapidapi_keys.py)
+def _rapidapi_pool_rate():
+    """
+    Function to add up the requests per second of the keys in RAPIDAPI_KEYS (key[:weight[:requests_per_second[:quota]]])
+    None if a key has no rate limit, so the broker leaves RapidAPI to the key pool
+    """
+    default_rate = float(os.getenv('RAPIDAPI_RATE_LIMIT', 5))
+    entries = [entry.strip().split(':') for entry in (os.getenv('RAPIDAPI_KEYS') or '').split(',') if entry.strip()]
+    rates = [float(parts[2]) if len(parts) > 2 and parts[2] else default_rate for parts in entries if parts[0]]
+    rates = rates or [default_rate]
+    return None if any(rate <= 0 for rate in rates) else sum(rates)
+
+_pool_rate = _rapidapi_pool_rate()
+QUOTA_SERVICES = os.getenv('QUOTA_SERVICES') or ",".join(
+    ["airtable:5:1"] + ([f"rapidapi:{_pool_rate:g}:2"] if _pool_rate else []) + ["picpurify:2:2"])
+# Lower numbers are served first when a service is saturated, e.g. QUOTA_PRIORITY=1 for an interactive job
+QUOTA_PRIORITY = int(os.getenv('QUOTA_PRIORITY', 5))
+# How long to wait for a broker reply before saying so, an ACQUIRE keeps waiting for its token after that
+QUOTA_TIMEOUT = float(os.getenv('QUOTA_TIMEOUT', 120))
+RETRY_BROKER_SECONDS = 30  # after failing to reach the broker, pace locally this long before trying again
+
+def parse_services(raw=QUOTA_SERVICES):
+    """
+    Function to parse QUOTA_SERVICES into {service: (rate, burst)}
+    """
+    services = {}
+    for entry in raw.split(','):
+        parts = entry.strip().split(':')
+        if len(parts) < 2 or not parts[0]:
+            continue
+        rate = float(parts[1])
+        burst = float(parts[2]) if len(parts) > 2 and parts[2] else 1.0
+        services[parts[0]] = (rate, max(burst, 1.0))
+    return services
+
+class ServiceBucket:
+    """
+    Token bucket for one service with a priority queue of waiting requests
+    """
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiters = []  # (priority, arrival, event)
+        self.granted = 0
+        self.throttled = 0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+class QuotaBroker:
+    """
+    Hands out request tokens per service at the configured rate, highest priority (lowest number) first
+    A 429 reported by any client pauses the whole service, so one rate limit hit doesn't turn into a storm
+    """
+
+    def __init__(self, services):
+        self.cond = threading.Condition()
+        self.buckets = {name: ServiceBucket(name, rate, burst) for name, (rate, burst) in services.items()}
+        self.arrivals = itertools.count()
+        threading.Thread(target=self._dispatch, name='quota-dispatch', daemon=True).start()
+
+    def _bucket(self, service):
+        bucket = self.buckets.get(service)
+        if bucket is None and '/' in service:
+            template = self.buckets.get(service.split('/', 1)[0])
+            if template is not None:
+                with self.cond:
+                    bucket = self.buckets.setdefault(service, ServiceBucket(service, template.rate, template.burst))
+        return bucket
+
+    def acquire(self, service, priority, abandoned=None):
+        """
+        Function to wait for a token, True once granted
+        abandoned() is checked every second while waiting, if it returns True the request is dropped
+        from the queue (it no longer takes a token) and False is returned
+        """
+        bucket = self._bucket(service)
+        if bucket is None:
+            return True
+        waiter = (priority, next(self.arrivals), threading.Event())
+        with self.cond:
+            heapq.heappush(bucket.waiters, waiter)
+            self.cond.notify()
+        while not waiter[2].wait(timeout=1.0):
+            if abandoned is not None and abandoned():
+                with self.cond:
+                    if waiter[2].is_set():
+                        bucket.tokens += 1  # granted just now, give the token back
+                    else:
+                        bucket.waiters.remove(waiter)
+                        heapq.heapify(bucket.waiters)
+                    self.cond.notify()
+                return False
+        return True
+
+    def throttle(self, service, seconds):
+        bucket = self._bucket(service)
+        if bucket is None:
+            return
+        with self.cond:
+            bucket.throttled += 1
+            bucket.paused_until = max(bucket.paused_until, time.monotonic() + seconds)
+            bucket.tokens = 0
+            self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            return {name: {
+                'rate': bucket.rate,
+                'granted': bucket.granted,
+                'waiting': len(bucket.waiters),
+                'throttled': bucket.throttled,
+                'paused_for': round(max(bucket.paused_until - time.monotonic(), 0), 1)
+            } for name, bucket in self.buckets.items()}
+
+    def _dispatch(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                next_wake = None
+                for bucket in self.buckets.values():
+                    bucket.refill(now)
+                    while bucket.waiters and bucket.tokens >= 1 and now >= bucket.paused_until:
+                        bucket.tokens -= 1
+                        bucket.granted += 1
+                        heapq.heappop(bucket.waiters)[2].set()
+                    if bucket.waiters:
+                        wait = max(bucket.paused_until - now, (1 - bucket.tokens) / bucket.rate, 0.001)
+                        next_wake = wait if next_wake is None else min(next_wake, wait)
+                self.cond.wait(timeout=next_wake)
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    """
+    Line protocol, one reply line per request:
+    ACQUIRE <service> <priority> -> OK once a token is granted
+    THROTTLE <service> <seconds> -> OK
+    STATS -> json
+    """
+
+    def _client_gone(self):
+        """
+        Function to check whether the client closed its connection, a waiting client sends nothing else
+        so a readable socket means end of file
+        """
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def handle(self):
+        broker = self.server.broker
+        for raw_line in self.rfile:
+            parts = raw_line.decode('utf-8').split()
+            if not parts:
+                continue
+            command = parts[0].upper()
+            try:
+                if command == 'ACQUIRE':
+                    priority = int(parts[2]) if len(parts) > 2 else QUOTA_PRIORITY
+                    if not broker.acquire(parts[1], priority, abandoned=self._client_gone):
+                        return
+                    reply = 'OK'
+                elif command == 'THROTTLE':
+                    broker.throttle(parts[1], float(parts[2]))
+                    reply = 'OK'
+                elif command == 'STATS':
+                    reply = json.dumps(broker.stats())
+                else:
+                    reply = f'ERROR unknown command {command}'
+            except (IndexError, ValueError) as e:
+                reply = f'ERROR {e}'
+            self.wfile.write((reply + '\n').encode('utf-8'))
+
+class _BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(path=QUOTA_BROKER_SOCKET, services=None):
+    """
+    Function to run the broker until interrupted
+    """
+    services = services or parse_services()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)  # left behind by a broker that didn't shut down cleanly
+    server = _BrokerServer(path, _BrokerHandler)
+    server.broker = QuotaBroker(services)
+    # Treat a plain kill like Ctrl-C so the socket file is removed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"Quota broker listening on {path}")
+    for name, (rate, burst) in services.items():
+        print(f"  {name}: {rate:g} requests/s (burst {burst:g})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+# Client side, used by http_client.py
+_local = threading.local()
+_unavailable_until = 0.0
+_unavailable_lock = threading.Lock()
+
+def _close_connection():
+    connection = getattr(_local, 'connection', None)
+    if connection:
+        try:
+            connection[1].close()
+            connection[0].close()
+        except OSError:
+            pass
+    _local.connection = None
+
+def _request(line, timeout=QUOTA_TIMEOUT, keep_waiting=False):
+    """
+    Function to send one request line to the broker, each thread keeps its own connection
+    keep_waiting=True waits past the timeout for the reply (a busy broker is not a missing one)
+    Returns the reply, or None if no broker is reachable (callers then pace themselves)
+    """
+    global _unavailable_until
+    if time.monotonic() < _unavailable_until:
+        return None
+    try:
+        connection = getattr(_local, 'connection', None)
+        if connection is None:
+            if not os.path.exists(QUOTA_BROKER_SOCKET):
+                raise FileNotFoundError(QUOTA_BROKER_SOCKET)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(QUOTA_BROKER_SOCKET)
+            connection = (sock, sock.makefile('rwb'))
+            _local.connection = connection
+        connection[1].write((line + '\n').encode('utf-8'))
+        connection[1].flush()
+        # Replies are read whole, so nothing is buffered and the socket shows when the next one arrives
+        waited = 0.0
+        while keep_waiting and not select.select([connection[0]], [], [], timeout)[0]:
+            waited += timeout
+            print(f"Still waiting for the quota broker after {waited:.0f}s ({line})")
+        reply = connection[1].readline().decode('utf-8').strip()
+        if not reply:
+            raise ConnectionError("quota broker closed the connection")
+        return reply
+    except OSError:
+        _close_connection()
+        with _unavailable_lock:
+            if time.monotonic() >= _unavailable_until and os.path.exists(QUOTA_BROKER_SOCKET):
+                print(f"Quota broker at {QUOTA_BROKER_SOCKET} not reachable, pacing locally")
+            _unavailable_until = time.monotonic() + RETRY_BROKER_SECONDS
+        return None
+
+def acquire_quota(service, priority=QUOTA_PRIORITY):
+    """
+    Function to wait for the broker to grant a request to service
+    Returns True if the broker granted it, False if there is no broker
+    """
+    return _request(f'ACQUIRE {service} {priority}', keep_waiting=True) == 'OK'
+
+def report_throttle(service, seconds):
+    """
+    Function to tell the broker a service rate limited us, so every process backs off together
+    """
+    _request(f'THROTTLE {service} {seconds:.3f}', timeout=5)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Host-wide request quota broker for the pipeline scripts")
+    parser.add_argument('action', choices=['serve', 'stats'])
+    args = parser.parse_args()
+
+    if args.action == 'serve':
+        serve()
+    else:
+        reply = _request('STATS', timeout=5)
+        if reply is None:
+            print(f"No quota broker running at {QUOTA_BROKER_SOCKET}")
+        else:
+            for name, stats in json.loads(reply).items():
+                print(f"{name}: {stats['granted']} granted, {stats['waiting']} waiting, "
+                      f"{stats['throttled']} throttles, paused for {stats['paused_for']}s")
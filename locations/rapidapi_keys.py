@@ -0,0 +1,268 @@
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+import requests
+from dotenv import load_dotenv
+from http_client import DEFAULT_TIMEOUT, NonRetryableError, call_with_retry, get_session, hedge_stats
+from cassette import replaying
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+# RAPIDAPI_KEYS is a comma separated list of key[:weight[:requests_per_second[:monthly_quota]]]
+# e.g. RAPIDAPI_KEYS=abc123:2:10:100000,def456:1:5:50000
+# Falls back to the single RAPIDAPI_KEY if not set
+RAPIDAPI_KEYS = os.getenv('RAPIDAPI_KEYS')
+RAPIDAPI_HOST = os.getenv('RAPIDAPI_HOST')
+DEFAULT_RATE_LIMIT = float(os.getenv('RAPIDAPI_RATE_LIMIT', 5))
+DEFAULT_MONTHLY_QUOTA = int(os.getenv('RAPIDAPI_MONTHLY_QUOTA', 0))  # 0 = unlimited
+QUARANTINE_SECONDS = float(os.getenv('RAPIDAPI_QUARANTINE_SECONDS', 60))
+MAX_QUARANTINE_SECONDS = 3600
+USAGE_FILE = os.getenv('RAPIDAPI_USAGE_FILE') or os.path.join(os.path.dirname(__file__), "..", "data", "rapidapi_usage.json")
+# Replaying a cassette sends nothing, so the pool hands out this key with no rate limit or budget instead of real ones
+REPLAY_KEY_CONFIG = {'key': 'replay', 'weight': 1, 'rate': 0, 'monthly_quota': 0}
+
+class KeyPoolExhausted(NonRetryableError):
+    """
+    Raised when every key is over its monthly budget
+    Is a RequestException so existing error handling treats it like a failed request, but is never retried
+    """
+
+def _current_month():
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+def key_id(api_key):
+    """
+    Function to get a short, non-secret id for a key (used in reports and the usage file)
+    """
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:8]
+
+def parse_key_config(raw_keys=RAPIDAPI_KEYS):
+    """
+    Function to parse the RAPIDAPI_KEYS env value into a list of key configs
+    """
+    if not raw_keys:
+        single_key = os.getenv('RAPIDAPI_KEY')
+        if not single_key:
+            return []
+        return [{
+            'key': single_key,
+            'weight': 1,
+            'rate': DEFAULT_RATE_LIMIT,
+            'monthly_quota': DEFAULT_MONTHLY_QUOTA
+        }]
+
+    configs = []
+    for entry in raw_keys.split(','):
+        parts = entry.strip().split(':')
+        if not parts[0]:
+            continue
+        configs.append({
+            'key': parts[0],
+            'weight': int(parts[1]) if len(parts) > 1 and parts[1] else 1,
+            'rate': float(parts[2]) if len(parts) > 2 and parts[2] else DEFAULT_RATE_LIMIT,
+            'monthly_quota': int(parts[3]) if len(parts) > 3 and parts[3] else DEFAULT_MONTHLY_QUOTA
+        })
+    return configs
+
+class KeyPool:
+    """
+    Pool of RapidAPI keys with smooth weighted round-robin selection,
+    a per-key request rate, a per-key monthly budget and temporary quarantine for keys that get 429s
+    """
+
+    def __init__(self, configs, usage_file=USAGE_FILE):
+        self.lock = threading.Lock()
+        self.usage_file = usage_file
+        self.keys = []
+        saved_usage = self._load_usage()
+        month = _current_month()
+        for config in configs:
+            kid = key_id(config['key'])
+            saved = saved_usage.get(kid, {})
+            self.keys.append({
+                'id': kid,
+                'key': config['key'],
+                'weight': max(config['weight'], 1),
+                'current_weight': 0,
+                'min_interval': 1.0 / config['rate'] if config['rate'] > 0 else 0,
+                'next_allowed': 0.0,
+                'monthly_quota': config['monthly_quota'],
+                'month': month,
+                'month_calls': saved.get('calls', 0) if saved.get('month') == month else 0,
+                'unsaved_calls': 0,  # made since the last save_usage
+                'run_calls': 0,
+                'errors': 0,
+                'rate_limited': 0,
+                'quarantined_until': 0.0,
+                'quarantine_strikes': 0
+            })
+
+    def _load_usage(self):
+        try:
+            with open(self.usage_file, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_usage(self):
+        """
+        Function to persist this month's per-key call counts so budgets carry over between runs
+        Scripts running at the same time share the file: under a file lock the calls made since the last save
+        are added to the counts on disk, and the merged counts (with the other scripts' calls) are used from then on
+        """
+        os.makedirs(os.path.dirname(self.usage_file), exist_ok=True)
+        with open(self.usage_file + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            usage = self._load_usage()
+            with self.lock:
+                for k in self.keys:
+                    self._has_budget(k)  # rolls the count over at the start of a month
+                    saved = usage.get(k['id'], {})
+                    k['month_calls'] = (saved.get('calls', 0) if saved.get('month') == k['month'] else 0) + k['unsaved_calls']
+                    k['unsaved_calls'] = 0
+                    usage[k['id']] = {'month': k['month'], 'calls': k['month_calls']}
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.usage_file), prefix='.tmp-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(usage, f, indent=2)
+            os.replace(tmp_path, self.usage_file)
+
+    def _has_budget(self, key):
+        if key['month'] != _current_month():
+            key['month'] = _current_month()
+            key['month_calls'] = 0
+            key['unsaved_calls'] = 0
+        return not key['monthly_quota'] or key['month_calls'] < key['monthly_quota']
+
+    def acquire(self):
+        """
+        Function to pick the next key to use, waiting if every usable key is at its rate limit
+        Returns the key dict, raises KeyPoolExhausted if no key has budget left this month
+        """
+        while True:
+            with self.lock:
+                if not self.keys:
+                    raise KeyPoolExhausted("No RapidAPI keys configured (set RAPIDAPI_KEYS or RAPIDAPI_KEY)")
+                now = time.monotonic()
+                budgeted = [k for k in self.keys if self._has_budget(k)]
+                if not budgeted:
+                    raise KeyPoolExhausted("All RapidAPI keys are over their monthly budget")
+
+                ready = [k for k in budgeted if k['quarantined_until'] <= now and k['next_allowed'] <= now]
+                if ready:
+                    # Smooth weighted round-robin (same scheme as nginx upstreams)
+                    total_weight = sum(k['weight'] for k in ready)
+                    for k in ready:
+                        k['current_weight'] += k['weight']
+                    chosen = max(ready, key=lambda k: k['current_weight'])
+                    chosen['current_weight'] -= total_weight
+
+                    chosen['next_allowed'] = now + chosen['min_interval']
+                    chosen['month_calls'] += 1
+                    chosen['unsaved_calls'] += 1
+                    chosen['run_calls'] += 1
+                    return chosen
+
+                wake_at = min(max(k['quarantined_until'], k['next_allowed']) for k in budgeted)
+
+            time.sleep(max(wake_at - time.monotonic(), 0.01))
+
+    def report(self, key, status_code):
+        """
+        Function to record the outcome of a call made with a key
+        429s (and 403 quota errors) put the key in quarantine with a growing cool-off
+        """
+        with self.lock:
+            if status_code in (429, 403):
+                key['rate_limited'] += 1
+                key['quarantine_strikes'] += 1
+                cool_off = min(QUARANTINE_SECONDS * (2 ** (key['quarantine_strikes'] - 1)), MAX_QUARANTINE_SECONDS)
+                key['quarantined_until'] = time.monotonic() + cool_off
+                print(f"RapidAPI key {key['id']} got {status_code}, quarantined for {cool_off:.0f}s")
+            elif status_code is None or status_code >= 500:
+                key['errors'] += 1
+            else:
+                key['quarantine_strikes'] = 0
+
+    def usage_report(self):
+        """
+        Function to get a per-key usage summary
+        """
+        now = time.monotonic()
+        with self.lock:
+            return [{
+                'key': k['id'],
+                'weight': k['weight'],
+                'calls_this_run': k['run_calls'],
+                'calls_this_month': k['month_calls'],
+                'monthly_quota': k['monthly_quota'] or None,
+                'rate_limited': k['rate_limited'],
+                'errors': k['errors'],
+                'quarantined_for': round(max(k['quarantined_until'] - now, 0), 1)
+            } for k in self.keys]
+
+    def print_usage_report(self):
+        for row in self.usage_report():
+            quota = row['monthly_quota'] or 'unlimited'
+            print(f"Key {row['key']} (weight {row['weight']}): {row['calls_this_run']} calls this run, "
+                  f"{row['calls_this_month']}/{quota} this month, {row['rate_limited']} rate limited, "
+                  f"{row['errors']} errors")
+        hedges = hedge_stats()
+        if hedges['hedged']:
+            print(f"Hedged {hedges['hedged']}/{hedges['calls']} slow calls, the backup answered first {hedges['backup_won']} times")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_key_pool():
+    """
+    Function to get the process-wide key pool, built from the env on first use
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = KeyPool([REPLAY_KEY_CONFIG] if replaying() else parse_key_config())
+            atexit.register(_pool.save_usage)
+        return _pool
+
+def rapidapi_get(url, params=None, host=None, hedge=False):
+    """
+    Function to make a RapidAPI GET request with a key from the pool
+    Retries go through the shared policy in http_client.py and pick a fresh key each attempt,
+    so a 429 on one key moves on to the next
+    hedge=True allows a backup request for slow responses when HTTP_HEDGING is on (the backup uses another key)
+    Returns the requests Response, callers still call raise_for_status()
+    """
+    pool = get_key_pool()
+
+    def send():
+        key = pool.acquire()
+        headers = {
+            "x-rapidapi-key": key['key'],
+            "x-rapidapi-host": host or RAPIDAPI_HOST
+        }
+
+        try:
+            response = get_session().get(url, headers=headers, params=params, timeout=DEFAULT_TIMEOUT)
+        except requests.exceptions.RequestException:
+            pool.report(key, None)
+            raise
+
+        pool.report(key, response.status_code)
+        # Persist usage every so often so a crash doesn't lose the month's count
+        if key['run_calls'] % 50 == 0:
+            pool.save_usage()
+        return response
+
+    return call_with_retry('GET', url, send, hedge=hedge)
+
+if __name__ == "__main__":
+    pool = get_key_pool()
+    if not pool.keys:
+        print("No RapidAPI keys configured (set RAPIDAPI_KEYS or RAPIDAPI_KEY)")
+    pool.print_usage_report()
@@ -0,0 +1,191 @@
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+# Persistent set of Instagram pk ids we have already written to a table, used for deduplication
+# Each store is an open-addressing hash table of uint64 pk ids in a memory-mapped file (data/seen/<name>.idx),
+# so lookups are O(1), RAM use is bounded by the OS page cache and the set survives between runs
+SEEN_STORE_DIR = os.getenv('SEEN_STORE_DIR') or os.path.join(os.path.dirname(__file__), "..", "data", "seen")
+INITIAL_CAPACITY = 1 << 20  # slots, 8MB on disk
+MAX_LOAD_FACTOR = 0.7
+
+# magic, version, seeded flag, capacity, count
+HEADER = struct.Struct('<4sIIQQ4x')
+SLOT = struct.Struct('<Q')
+MAGIC = b'SEEN'
+VERSION = 1
+EMPTY = 0
+
+def pk_to_key(pk_id):
+    """
+    Function to turn a pk id (int or numeric string) into a non-zero uint64 key
+    Non-numeric values are hashed so the store still works for them
+    """
+    try:
+        key = int(pk_id)
+    except (TypeError, ValueError):
+        key = int.from_bytes(hashlib.blake2b(str(pk_id).encode('utf-8'), digest_size=8).digest(), 'little')
+    key &= 0xFFFFFFFFFFFFFFFF
+    return key or 1
+
+def _slot_index(key, capacity):
+    # Fibonacci hashing, capacity is always a power of two
+    return ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (64 - capacity.bit_length() + 1)
+
+class SeenStore:
+    """
+    Disk-backed set of pk ids
+    seeded records whether the store has been filled from the Airtable table yet
+    """
+
+    def __init__(self, name, directory=SEEN_STORE_DIR, initial_capacity=INITIAL_CAPACITY):
+        self.name = name
+        self.path = os.path.join(directory, f'{name}.idx')
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.path):
+            self._create(self.path, initial_capacity, seeded=False)
+        self._map()
+
+    def _create(self, path, capacity, seeded):
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, int(seeded), capacity, 0))
+            f.truncate(HEADER.size + capacity * SLOT.size)
+
+    def _map(self):
+        self.file = open(self.path, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, version, seeded, capacity, count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a seen store")
+        self.seeded = bool(seeded)
+        self.capacity = capacity
+        self.count = count
+
+    def _write_header(self):
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, int(self.seeded), self.capacity, self.count)
+
+    def _find(self, key):
+        """
+        Function to find the slot holding key, or the empty slot where it would go
+        Returns (offset, found)
+        """
+        index = _slot_index(key, self.capacity)
+        mask = self.capacity - 1
+        while True:
+            offset = HEADER.size + index * SLOT.size
+            value = SLOT.unpack_from(self.mm, offset)[0]
+            if value == key:
+                return offset, True
+            if value == EMPTY:
+                return offset, False
+            index = (index + 1) & mask
+
+    def _grow(self):
+        """
+        Function to rebuild the table at double the capacity once it passes MAX_LOAD_FACTOR
+        """
+        tmp_path = self.path + '.tmp'
+        new_capacity = self.capacity * 2
+        self._create(tmp_path, new_capacity, self.seeded)
+
+        old_mm, old_file, old_capacity = self.mm, self.file, self.capacity
+        self.file = open(tmp_path, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        self.capacity = new_capacity
+
+        for index in range(old_capacity):
+            key = SLOT.unpack_from(old_mm, HEADER.size + index * SLOT.size)[0]
+            if key != EMPTY:
+                offset, _ = self._find(key)
+                SLOT.pack_into(self.mm, offset, key)
+
+        self._write_header()
+        self.mm.flush()
+        old_mm.close()
+        old_file.close()
+        self.mm.close()
+        self.file.close()
+        os.replace(tmp_path, self.path)
+        self._map()
+        print(f"Grew seen store {self.name} to {new_capacity} slots")
+
+    def __contains__(self, pk_id):
+        with self.lock:
+            _, found = self._find(pk_to_key(pk_id))
+            return found
+
+    def add(self, pk_id):
+        """
+        Function to add a pk id, returns True if it wasn't already in the store
+        """
+        key = pk_to_key(pk_id)
+        with self.lock:
+            offset, found = self._find(key)
+            if found:
+                return False
+            if self.count + 1 > self.capacity * MAX_LOAD_FACTOR:
+                self._grow()
+                offset, _ = self._find(key)
+            SLOT.pack_into(self.mm, offset, key)
+            self.count += 1
+            self._write_header()
+            return True
+
+    def add_many(self, pk_ids):
+        """
+        Function to add several pk ids, returns how many were new
+        """
+        return sum(1 for pk_id in pk_ids if pk_id is not None and self.add(pk_id))
+
+    def __len__(self):
+        return self.count
+
+    def mark_seeded(self):
+        with self.lock:
+            self.seeded = True
+            self._write_header()
+            self.mm.flush()
+
+    def flush(self):
+        with self.lock:
+            self.mm.flush()
+
+    def close(self):
+        with self.lock:
+            self.mm.flush()
+            self.mm.close()
+            self.file.close()
+
+def open_seen_store(name, fetch_existing=None, field='Pk Id'):
+    """
+    Function to open a seen store, seeding it from Airtable the first time
+    fetch_existing is a function returning the table's records, only called if the store has never been seeded
+    """
+    store = SeenStore(name)
+    if not store.seeded and fetch_existing is not None:
+        print(f"Seeding seen store {name} from Airtable (only needed once)")
+        records = fetch_existing()
+        added = store.add_many(record.get('fields', {}).get(field) for record in records)
+        store.mark_seeded()
+        print(f"Seeded {name} with {added} pk ids")
+    return store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or reset the local pk id dedup stores")
+    parser.add_argument('action', choices=['stats', 'reset'])
+    parser.add_argument('name', help="store name, e.g. location_posts or business_network")
+    args = parser.parse_args()
+
+    if args.action == 'reset':
+        path = os.path.join(SEEN_STORE_DIR, f'{args.name}.idx')
+        if os.path.exists(path):
+            os.remove(path)
+        print(f"Removed {path}, it will be re-seeded from Airtable on the next run")
+    else:
+        store = SeenStore(args.name)
+        size_mb = os.path.getsize(store.path) / (1024 * 1024)
+        print(f"{args.name}: {len(store)} pk ids, {store.capacity} slots ({size_mb:.1f}MB), seeded={store.seeded}")
@@ -0,0 +1,341 @@
+import argparse
+import gzip
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import requests
+from dotenv import load_dotenv
+import http_client
+from airtable import table_shards
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+# Bulk export of the lead tables to gzipped JSONL (one {"id", "createdTime", "fields"} record per line) and
+# import of an export into another base, e.g. for backups, analytics or cloning a base
+# Each snapshot is a directory under SNAPSHOT_DIR with a manifest.json; an incremental snapshot only holds
+# the records modified since each table's parent (the latest snapshot holding that table), and importing it
+# replays the table's whole chain (newest version wins)
+# Deletions are not tracked: a record deleted after the full snapshot at the bottom of a chain is still
+# imported, take a full snapshot after deleting records
+AIRTABLE_API_KEY = os.getenv('AIRTABLE_API_KEY')
+AIRTABLE_BASE_ID = os.getenv('AIRTABLE_BASE_ID')
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR') or os.path.join(os.path.dirname(__file__), "..", "data", "snapshots")
+IMPORT_WORKERS = int(os.getenv('SNAPSHOT_IMPORT_WORKERS', 4))
+
+# Snapshot name -> Airtable table, tables whose env var isn't set are skipped
+SNAPSHOT_TABLES = {
+    'locations': os.getenv('AIRTABLE_LOCATIONS_TABLE'),
+    'location_posts': os.getenv('AIRTABLE_LOCATION_POSTS_TABLE'),
+    'business_targets': os.getenv('AIRTABLE_BUSINESS_TARGETS_TABLE'),
+    'business_network': os.getenv('AIRTABLE_BUSINESS_NETWORK_TABLE'),
+    'targets': os.getenv('AIRTABLE_TARGETS_TABLE'),
+    'network': os.getenv('AIRTABLE_NETWORK_TABLE')
+}
+
+# Field types Airtable computes itself, they can't be written when importing
+COMPUTED_FIELD_TYPES = {
+    'formula', 'rollup', 'count', 'multipleLookupValues', 'autoNumber', 'createdTime',
+    'lastModifiedTime', 'createdBy', 'lastModifiedBy', 'button', 'externalSyncSource'
+}
+# Links hold record ids of the source base, which don't exist in the target base
+LINK_FIELD_TYPES = {'multipleRecordLinks'}
+# Modified records are fetched from a little before the parent snapshot started, in case of clock skew
+INCREMENTAL_OVERLAP_SECONDS = 60
+
+def _headers():
+    return {
+        'Authorization': f'Bearer {AIRTABLE_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+
+def iter_table_records(table, modified_since=None):
+    """
+    Function to page through every record of a table (every shard of it, see airtable.py), one record at a time
+    modified_since (a datetime) limits it to records created or changed after that time
+    """
+    for base_id, shard_table in table_shards(table):
+        url = f'https://api.airtable.com/v0/{base_id}/{shard_table}'
+        query_params = {'pageSize': 100}
+        if modified_since:
+            query_params['filterByFormula'] = f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{modified_since.isoformat()}'))"
+
+        while True:
+            response = http_client.get(url, headers=_headers(), params=query_params)
+            response.raise_for_status()
+            data = response.json()
+            yield from data.get('records', [])
+            if 'offset' not in data:
+                break
+            query_params['offset'] = data['offset']
+
+def list_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    """
+    Function to list the snapshot directories with a manifest, oldest first
+    """
+    if not os.path.isdir(snapshot_dir):
+        return []
+    return sorted(name for name in os.listdir(snapshot_dir)
+                  if os.path.exists(os.path.join(snapshot_dir, name, 'manifest.json')))
+
+def load_manifest(name, snapshot_dir=SNAPSHOT_DIR):
+    with open(os.path.join(snapshot_dir, name, 'manifest.json'), 'r') as f:
+        return json.load(f)
+
+def export_snapshot(tables=None, incremental=False, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Function to write a snapshot of the given snapshot tables (default all configured ones)
+    Records are streamed straight to the gzip files, so memory stays flat however large the tables are
+    incremental=True only exports the records of each table modified since the latest snapshot holding that table,
+    which becomes the table's parent; tables no snapshot holds yet are exported in full
+    Returns the new snapshot's name
+    """
+    started = datetime.now(timezone.utc)
+    name = started.strftime('%Y%m%dT%H%M%SZ')
+    tables = tables or [t for t, table in SNAPSHOT_TABLES.items() if table]
+    existing = [(n, load_manifest(n, snapshot_dir)) for n in list_snapshots(snapshot_dir)] if incremental else []
+
+    path = os.path.join(snapshot_dir, name)
+    os.makedirs(path, exist_ok=True)
+    manifest = {
+        'started_at': started.isoformat(),
+        'base_id': AIRTABLE_BASE_ID,
+        'tables': {}
+    }
+
+    for snapshot_table in tables:
+        table = SNAPSHOT_TABLES.get(snapshot_table)
+        if not table:
+            print(f"Skipping {snapshot_table}, its table isn't configured")
+            continue
+        parent, parent_manifest = next(((n, m) for n, m in reversed(existing) if snapshot_table in m['tables']), (None, None))
+        modified_since = None
+        if parent:
+            parent_started = datetime.fromisoformat(parent_manifest['started_at'])
+            modified_since = parent_started - timedelta(seconds=INCREMENTAL_OVERLAP_SECONDS)
+        elif incremental:
+            print(f"No previous snapshot of {snapshot_table}, taking a full one")
+        filename = f'{snapshot_table}.jsonl.gz'
+        count = 0
+        with gzip.open(os.path.join(path, filename), 'wt', encoding='utf-8') as f:
+            for record in iter_table_records(table, modified_since=modified_since):
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+                if count % 5000 == 0:
+                    print(f"  {snapshot_table}: {count} records")
+        manifest['tables'][snapshot_table] = {
+            'table': table,
+            'file': filename,
+            'records': count,
+            'parent': parent,
+            'modified_since': modified_since.isoformat() if modified_since else None
+        }
+        print(f"Exported {count} {snapshot_table} records" + (f" (changes since {parent})" if parent else ""))
+
+    # Written last, a snapshot without a manifest is incomplete and ignored
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Snapshot {name} written to {path}")
+    return name
+
+def _iter_file(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+def _table_parent(manifest, snapshot_table):
+    # Snapshots taken before tables had their own parent kept one for the whole snapshot
+    info = manifest['tables'][snapshot_table]
+    return info['parent'] if 'parent' in info else manifest.get('parent')
+
+def snapshot_chain(name, snapshot_table, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Function to get the snapshots a table's records are rebuilt from, newest first, ending with a full export
+    Raises ValueError if a parent doesn't hold the table (its changes can't be turned back into the whole table)
+    """
+    chain = []
+    while name:
+        manifest = load_manifest(name, snapshot_dir)
+        if snapshot_table not in manifest['tables']:
+            raise ValueError(f"Snapshot {name} has no {snapshot_table}, so {chain[-1][0]} only holds changes "
+                             f"to a table that was never fully exported")
+        chain.append((name, manifest))
+        name = _table_parent(manifest, snapshot_table)
+    return chain
+
+def iter_snapshot_records(name, snapshot_table, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Function to get the latest version of every record in a snapshot table, following incremental parents
+    Only the incremental layers are held in memory, the full snapshot at the bottom of the chain is streamed
+    """
+    if snapshot_table not in load_manifest(name, snapshot_dir)['tables']:
+        return
+    chain = snapshot_chain(name, snapshot_table, snapshot_dir)
+    newest = {}
+    for layer_name, manifest in reversed(chain[:-1]):
+        for record in _iter_file(os.path.join(snapshot_dir, layer_name, manifest['tables'][snapshot_table]['file'])):
+            newest[record['id']] = record
+
+    base_name, base_manifest = chain[-1]
+    for record in _iter_file(os.path.join(snapshot_dir, base_name, base_manifest['tables'][snapshot_table]['file'])):
+        if record['id'] not in newest:
+            yield record
+    yield from newest.values()
+
+def writable_fields(base_id, table):
+    """
+    Function to get the names of the fields a table accepts on create, from the base schema
+    Returns None if the schema can't be read (the token needs schema.bases:read), then every field is sent
+    """
+    url = f'https://api.airtable.com/v0/meta/bases/{base_id}/tables'
+    try:
+        response = http_client.get(url, headers=_headers())
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Couldn't read the schema of base {base_id} ({e}), importing every field")
+        return None
+    for schema in response.json().get('tables', []):
+        if table in (schema.get('name'), schema.get('id')):
+            return {field['name'] for field in schema.get('fields', [])
+                    if field.get('type') not in COMPUTED_FIELD_TYPES | LINK_FIELD_TYPES}
+    return None
+
+def _import_fields(fields, allowed):
+    result = {}
+    for field, value in fields.items():
+        if allowed is not None and field not in allowed:
+            continue
+        # Attachments are re-uploaded by Airtable from their url
+        if isinstance(value, list) and value and isinstance(value[0], dict) and 'url' in value[0]:
+            value = [{'url': a['url'], 'filename': a.get('filename')} for a in value]
+        result[field] = value
+    return result
+
+def _imported_path(name, base_id, snapshot_table, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Function to get the resume file of an import, one line per source record id created in the target base
+    """
+    return os.path.join(snapshot_dir, name, f'imported-{base_id}-{snapshot_table}.txt')
+
+def _load_imported(path):
+    try:
+        with open(path, 'r') as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+def import_snapshot(name, base_id, tables=None, workers=IMPORT_WORKERS, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Function to create every record of a snapshot in another base, with the same table names
+    Batches of 10 are created by a pool of workers, the shared Airtable rate limit in http_client paces them
+    The source ids of created records are appended to a resume file next to the snapshot, the import stops
+    at the first failed batch and running it again skips the records already created
+    Returns {snapshot table: records created}
+    """
+    if base_id == load_manifest(name, snapshot_dir).get('base_id'):
+        raise ValueError("Refusing to import a snapshot into the base it was taken from")
+
+    latest_manifest = load_manifest(name, snapshot_dir)
+    tables = tables or list(latest_manifest['tables'])
+    counts = {}
+
+    for snapshot_table in tables:
+        table = latest_manifest['tables'].get(snapshot_table, {}).get('table')
+        if not table:
+            print(f"Skipping {snapshot_table}, it isn't in snapshot {name}")
+            continue
+        chain = snapshot_chain(name, snapshot_table, snapshot_dir)
+        if len(chain) > 1:
+            print(f"Rebuilding {snapshot_table} from {len(chain)} snapshots, records deleted since {chain[-1][0]} are imported too")
+        allowed = writable_fields(base_id, table)
+        url = f'https://api.airtable.com/v0/{base_id}/{table}'
+        imported_path = _imported_path(name, base_id, snapshot_table, snapshot_dir)
+        imported = _load_imported(imported_path)
+        if imported:
+            print(f"Resuming {snapshot_table}, {len(imported)} records were already imported")
+        lock = threading.Lock()
+        created = [0]
+        failed = threading.Event()
+        # Bounds the batches waiting for a worker, so the snapshot is streamed rather than read into memory
+        slots = threading.BoundedSemaphore(workers * 4)
+
+        def create_batch(batch, imported_file):
+            try:
+                if failed.is_set():
+                    return
+                response = http_client.post(url, headers=_headers(),
+                                            json={"records": [{"fields": fields} for _, fields in batch], "typecast": True})
+                response.raise_for_status()
+                with lock:
+                    imported_file.write(''.join(f"{source_id}\n" for source_id, _ in batch))
+                    imported_file.flush()
+                    created[0] += len(batch)
+                    if created[0] % 1000 < len(batch):
+                        print(f"  {snapshot_table}: {created[0]} records created")
+            except requests.exceptions.RequestException as e:
+                print(f"Error creating {snapshot_table} batch: {e}")
+                if hasattr(e.response, 'text'):
+                    print(f"Response text: {e.response.text}")
+                failed.set()
+            finally:
+                slots.release()
+
+        with open(imported_path, 'a') as imported_file, ThreadPoolExecutor(max_workers=workers) as executor:
+            batch = []
+            for record in iter_snapshot_records(name, snapshot_table, snapshot_dir):
+                if failed.is_set():
+                    break
+                if record['id'] in imported:
+                    continue
+                fields = _import_fields(record.get('fields', {}), allowed)
+                if not fields:
+                    continue
+                batch.append((record['id'], fields))
+                if len(batch) == 10:
+                    slots.acquire()
+                    executor.submit(create_batch, batch, imported_file)
+                    batch = []
+            if batch and not failed.is_set():
+                slots.acquire()
+                executor.submit(create_batch, batch, imported_file)
+
+        counts[snapshot_table] = created[0]
+        print(f"Imported {created[0]} {snapshot_table} records into {base_id}/{table}")
+        if failed.is_set():
+            # Stop the whole import, later tables would only pile up more to redo
+            print(f"Stopped after a failed batch, run the import again to resume (created records are listed in {imported_path})")
+            break
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the lead tables to a local snapshot, or import a snapshot into another base")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    export_parser = subparsers.add_parser('export', help="snapshot the tables of AIRTABLE_BASE_ID")
+    export_parser.add_argument('--incremental', action='store_true', help="only records modified since the latest snapshot")
+    export_parser.add_argument('--tables', nargs='+', choices=list(SNAPSHOT_TABLES), help="default: every configured table")
+    import_parser = subparsers.add_parser('import', help="create a snapshot's records in another base")
+    import_parser.add_argument('base_id', help="base to import into, with the same table names")
+    import_parser.add_argument('--snapshot', help="snapshot name (default: the latest)")
+    import_parser.add_argument('--tables', nargs='+', choices=list(SNAPSHOT_TABLES), help="default: every table in the snapshot")
+    import_parser.add_argument('--workers', type=int, default=IMPORT_WORKERS, help="concurrent batch creates")
+    subparsers.add_parser('list', help="list local snapshots")
+    args = parser.parse_args()
+
+    if args.action == 'export':
+        export_snapshot(args.tables, args.incremental)
+    elif args.action == 'import':
+        snapshots = list_snapshots()
+        snapshot = args.snapshot or (snapshots[-1] if snapshots else None)
+        if not snapshot:
+            print(f"No snapshots in {SNAPSHOT_DIR}")
+        else:
+            import_snapshot(snapshot, args.base_id, args.tables, args.workers)
+    else:
+        for name in list_snapshots():
+            manifest = load_manifest(name)
+            tables = []
+            for t, info in manifest['tables'].items():
+                parent = _table_parent(manifest, t)
+                tables.append(f"{t} {info['records']}" + (f" (changes since {parent})" if parent else ""))
+            print(f"{name}: {', '.join(tables)}")
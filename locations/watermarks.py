@@ -0,0 +1,41 @@
+import json
+import os
+import tempfile
+import threading
+
+# High-water marks per scraped source, e.g. the newest post taken_at seen for each location
+# Kept in data/watermarks.json so the next run can fetch only newer items
+WATERMARKS_FILE = os.getenv('WATERMARKS_FILE') or os.path.join(os.path.dirname(__file__), "..", "data", "watermarks.json")
+
+_lock = threading.Lock()
+
+def _load():
+    try:
+        with open(WATERMARKS_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def get_watermark(namespace, key):
+    """
+    Function to get the saved high-water mark for a key, None if there isn't one yet
+    """
+    return _load().get(namespace, {}).get(str(key))
+
+def update_watermark(namespace, key, value):
+    """
+    Function to raise the saved high-water mark for a key to value (it never moves backwards)
+    """
+    if value is None:
+        return
+    with _lock:
+        watermarks = _load()
+        entries = watermarks.setdefault(namespace, {})
+        if entries.get(str(key)) is not None and entries[str(key)] >= value:
+            return
+        entries[str(key)] = value
+        os.makedirs(os.path.dirname(WATERMARKS_FILE), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(WATERMARKS_FILE), prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(watermarks, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, WATERMARKS_FILE)
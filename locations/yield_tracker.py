@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+# Yield = new unique accounts per API call, tracked per location / business target
+# Cumulative stats are kept in data/yield_stats.json so later runs (and the budget allocator) can use them
+YIELD_STATS_FILE = os.getenv('YIELD_STATS_FILE') or os.path.join(os.path.dirname(__file__), "..", "data", "yield_stats.json")
+DEFAULT_MIN_YIELD = float(os.getenv('EARLY_STOP_MIN_YIELD', 0.1))
+DEFAULT_LOW_YIELD_PAGES = int(os.getenv('EARLY_STOP_LOW_YIELD_PAGES', 3))
+
+_lock = threading.Lock()
+
+def load_yield_stats():
+    """
+    Function to load the cumulative yield stats, {namespace: {record_id: stats}}
+    """
+    try:
+        with open(YIELD_STATS_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _save_yield_stats(stats):
+    os.makedirs(os.path.dirname(YIELD_STATS_FILE), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(YIELD_STATS_FILE), prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, YIELD_STATS_FILE)
+
+def add_early_stop_arguments(parser):
+    """
+    Function to add the shared early-stop options to an entry point's argument parser
+    """
+    parser.add_argument('--min-yield', type=float, default=DEFAULT_MIN_YIELD,
+                        help="a page counts as low yield when less than this fraction of its accounts are new")
+    parser.add_argument('--low-yield-pages', type=int, default=DEFAULT_LOW_YIELD_PAGES,
+                        help="stop paging after this many low yield pages in a row (0 disables early stopping)")
+
+class YieldTracker:
+    """
+    Tracks new unique accounts per call for one location or target and decides when to stop paging
+    Paging stops after low_yield_pages consecutive pages where under min_yield of the accounts were new
+    """
+
+    def __init__(self, namespace, record_id, label=None, min_yield=DEFAULT_MIN_YIELD, low_yield_pages=DEFAULT_LOW_YIELD_PAGES):
+        self.namespace = namespace
+        self.record_id = record_id
+        self.label = label or record_id
+        self.min_yield = min_yield
+        self.low_yield_pages = low_yield_pages
+        self.calls = 0
+        self.items = 0
+        self.new = 0
+        self.consecutive_low = 0
+        self.stopped_early = False
+
+    def record_page(self, items, new):
+        """
+        Function to record one API call that returned items accounts of which new were new
+        """
+        self.calls += 1
+        self.items += items
+        self.new += new
+        if items == 0 or new / items < self.min_yield:
+            self.consecutive_low += 1
+        else:
+            self.consecutive_low = 0
+
+    def should_stop(self):
+        if self.low_yield_pages and self.consecutive_low >= self.low_yield_pages:
+            if not self.stopped_early:
+                print(f"Stopping {self.label} early: {self.consecutive_low} pages in a row under {self.min_yield:.0%} new accounts")
+            self.stopped_early = True
+        return self.stopped_early
+
+    @property
+    def yield_per_call(self):
+        return self.new / self.calls if self.calls else 0.0
+
+    def save(self):
+        """
+        Function to add this run's numbers to the cumulative stats for the record
+        """
+        if not self.calls:
+            return
+        with _lock:
+            stats = load_yield_stats()
+            entry = stats.setdefault(self.namespace, {}).setdefault(str(self.record_id), {'calls': 0, 'items': 0, 'new': 0})
+            entry['label'] = self.label
+            entry['calls'] += self.calls
+            entry['items'] += self.items
+            entry['new'] += self.new
+            entry['last_run_yield'] = round(self.yield_per_call, 3)
+            entry['stopped_early'] = self.stopped_early
+            entry['updated_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+            _save_yield_stats(stats)
+        print(f"Yield for {self.label}: {self.new} new accounts from {self.calls} calls ({self.yield_per_call:.1f} per call)")
@@ -1,8 +1,20 @@
+import argparse
 import requests
-import time
 import os
+import sys
 from dotenv import load_dotenv
 
+# Shared service modules (HTTP client, RapidAPI key pool etc.) live in the locations folder
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "locations"))
+from rapidapi_keys import rapidapi_get
+import http_client
+from planner import Plan, add_plan_arguments, airtable_read_calls, airtable_write_calls
+from account_registry import get_registry
+from airtable import update_records
+from enrichment import enrich_records, default_workers
+from profiling import add_profile_argument, mark_stage, profile_run
+from lead_scoring import rank_by_lead_score
+
 # Load environment variables
 load_dotenv()
 
@@ -18,32 +30,41 @@ AIRTABLE_HEADERS = {
     "Content-Type": "application/json"
 }
 
-def get_account_details(username_or_id):
+def account_details_from_info(account_data):
+    return {
+        'follower_count': account_data.get('follower_count'),
+        'following_count': account_data.get('following_count'),
+        'media_count': account_data.get('media_count'),
+        'bio': account_data.get('biography'),
+        'bio_link': account_data.get('external_url'),
+        'email': account_data.get('public_email'),
+        'phone_number': account_data.get('contact_phone_number')
+    }
+
+def get_account_details(username_or_id, pk_id=None, username=None):
+    """
+    Function to get account details, from the account registry if they were fetched recently
+    Fresh lookups are saved to the registry so no pipeline fetches the same account twice
+    """
+    registry = get_registry()
+    cached = registry.get_profile(pk_id, username)
+    if cached:
+        print(f"Using details for {username_or_id} from the account registry")
+        return account_details_from_info(cached)
+
     url = "https://instagram-scraper-api2.p.rapidapi.com/v1/info"
     
     querystring = {"username_or_id_or_url": username_or_id}
     
-    headers = {
-        "x-rapidapi-key": os.getenv('RAPIDAPI_KEY'),
-        "x-rapidapi-host": os.getenv('RAPIDAPI_HOST')
-    }
-    
     try:
-        response = requests.get(url, headers=headers, params=querystring)
+        response = rapidapi_get(url, params=querystring)
         response.raise_for_status()
         
         data = response.json()
         if 'data' in data:
             account_data = data['data']
-            return {
-                'follower_count': account_data.get('follower_count'),
-                'following_count': account_data.get('following_count'),
-                'media_count': account_data.get('media_count'),
-                'bio': account_data.get('biography'),
-                'bio_link': account_data.get('external_url'),
-                'email': account_data.get('public_email'),
-                'phone_number': account_data.get('contact_phone_number')
-            }
+            registry.record_profile(account_data)
+            return account_details_from_info(account_data)
         return None
         
     except requests.exceptions.RequestException as e:
@@ -57,12 +78,14 @@ def fetch_unprocessed_network_accounts(offset=None, all_records=None):
         
     url = f"{AIRTABLE_API_URL}/{NETWORK_TABLE}"
     
-    params = {}
+    params = {
+        'filterByFormula': 'NOT({details_fetched})'
+    }
     if offset:
         params['offset'] = offset
 
     try:
-        response = requests.get(url, headers=AIRTABLE_HEADERS, params=params)
+        response = http_client.get(url, headers=AIRTABLE_HEADERS, params=params)
         response.raise_for_status()
         data = response.json()
         
@@ -76,51 +99,85 @@ def fetch_unprocessed_network_accounts(offset=None, all_records=None):
         print(f"Error fetching network accounts: {e}")
         return all_records
 
-def update_account_details(record_id, details):
-    """Update network record with account details"""
-    url = f"{AIRTABLE_API_URL}/{NETWORK_TABLE}/{record_id}"
-    
-    payload = {
-        "fields": {
-            "follower_count": details.get('follower_count'),
-            "following_count": details.get('following_count'),
-            "media_count": details.get('media_count'),
-            "bio": details.get('biography'),
-            "bio_link": details.get('external_url'),
-            "email": details.get('public_email'),
-            'phone_number': details.get('contact_phone_number'),
-            "details_fetched": True
-        }
+def account_detail_fields(record, details):
+    """Network record fields for a set of account details"""
+    return {
+        "follower_count": details.get('follower_count'),
+        "following_count": details.get('following_count'),
+        "media_count": details.get('media_count'),
+        "bio": details.get('bio'),
+        "bio_link": details.get('bio_link'),
+        "email": details.get('email'),
+        'phone_number': details.get('phone_number'),
+        "details_fetched": True
     }
-    
-    try:
-        response = requests.patch(url, headers=AIRTABLE_HEADERS, json=payload)
-        response.raise_for_status()
-        return True
-    except requests.exceptions.RequestException as e:
-        print(f"Error updating account details: {e}")
-        return False
 
-def process_network_accounts():
-    unprocessed_records = fetch_unprocessed_network_accounts()
-    
+def update_network_records(records):
+    """Update several network records, 10 per request"""
+    return update_records(NETWORK_TABLE, records, 'network accounts')
+
+def lookup_account_details(record):
+    fields = record.get('fields', {})
+    username = fields.get('username')
+    pk_id = fields.get('pk_id')
+    return get_account_details(username or pk_id, pk_id, username)
+
+def plan_network_accounts(unprocessed_records, workers=1):
+    """
+    Function to estimate the calls needed to fetch details for every network account
+    """
+    plan = Plan('process_network_accounts', concurrency=workers)
+    plan.add_fixed({'airtable': airtable_read_calls(len(unprocessed_records)) + airtable_write_calls(len(unprocessed_records))})
+
     for record in unprocessed_records:
-        username = record.get('fields', {}).get('username')
-        pk_id = record.get('fields', {}).get('pk_id')
-        record_id = record.get('id')
-        
-        if username or pk_id:
-            print(f"\nProcessing account: {username or pk_id}")
-            details = get_account_details(username or pk_id)
-            
-            if details:
-                if update_account_details(record_id, details):
-                    print(f"Updated details for: {username or pk_id}")
-                
-                # Add delay to avoid rate limits
-                time.sleep(1)
-            
-            print(f"Completed processing {username or pk_id}")
+        fields = record.get('fields', {})
+        plan.add_item(fields.get('username') or fields.get('pk_id'), record, {'info': 1})
+
+    return plan
+
+def process_network_accounts(plan_only=False, budget=None, workers=None):
+    """
+    Function to fetch details for every network account without details_fetched
+    Lookups run concurrently (paced by the RapidAPI key pool) and are written back 10 records per request
+    """
+    workers = workers or default_workers('info')
+    mark_stage('fetch accounts')
+    unprocessed_records = [
+        record for record in fetch_unprocessed_network_accounts()
+        if record.get('fields', {}).get('username') or record.get('fields', {}).get('pk_id')
+    ]
+    if not unprocessed_records:
+        print("No network accounts found needing details")
+        return
+
+    print(f"Found {len(unprocessed_records)} network accounts needing details")
+    # Best leads first, so a budget-limited or interrupted run fetches those
+    unprocessed_records = rank_by_lead_score(unprocessed_records, 'pk_id')
+
+    if plan_only or budget is not None:
+        plan = plan_network_accounts(unprocessed_records, workers)
+        if plan_only:
+            plan.print_summary(budget)
+            return
+        unprocessed_records = plan.fit_to_budget(budget)
+
+    mark_stage('enrich')
+    enrich_records(
+        unprocessed_records,
+        lookup_account_details,
+        account_detail_fields,
+        update_network_records,
+        workers,
+        label='network accounts',
+        pk_id_field='pk_id',
+        pipeline='network_accounts'
+    )
 
 if __name__ == "__main__":
-    process_network_accounts()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fetch Instagram account details for Network table rows")
+    add_plan_arguments(parser)
+    add_profile_argument(parser)
+    parser.add_argument('--workers', type=int, help="concurrent lookups (default: enough to keep the RapidAPI rate limit busy)")
+    args = parser.parse_args()
+    with profile_run('process_network_accounts', args.profile):
+        process_network_accounts(plan_only=args.plan, budget=args.budget, workers=args.workers)
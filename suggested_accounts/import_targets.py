@@ -0,0 +1,164 @@
+import argparse
+import csv
+import os
+import re
+import sys
+import requests
+from dotenv import load_dotenv
+
+# Shared service modules (HTTP client, batch writer etc.) live in the locations folder
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "locations"))
+import http_client
+from batch_writer import BatchWriter
+
+# Load environment variables
+load_dotenv()
+
+# Airtable configuration
+AIRTABLE_API_KEY = os.getenv('AIRTABLE_API_KEY')
+BASE_ID = os.getenv('AIRTABLE_BASE_ID')
+NETWORK_TABLE = os.getenv('AIRTABLE_NETWORK_TABLE')
+TARGETS_TABLE = os.getenv('AIRTABLE_TARGETS_TABLE')
+
+AIRTABLE_API_URL = f"https://api.airtable.com/v0/{BASE_ID}"
+
+AIRTABLE_HEADERS = {
+    "Authorization": f"Bearer {AIRTABLE_API_KEY}",
+    "Content-Type": "application/json"
+}
+
+# Instagram usernames: up to 30 letters, digits, periods and underscores
+USERNAME_PATTERN = re.compile(r'^[a-z0-9._]{1,30}$')
+# Lines of the similar_to_*.txt dumps written from get_similar_accounts output
+DUMP_USERNAME_LINE = re.compile(r'^\s*Username:\s*@?(\S+)', re.IGNORECASE)
+PROFILE_URL = re.compile(r'instagram\.com/([A-Za-z0-9._]{1,30})')
+DUMP_OTHER_LINE = re.compile(r'^\s*(Full Name|Profile URL|Similar accounts to|Found \d+|-{3,})', re.IGNORECASE)
+CSV_USERNAME_COLUMNS = ('username', 'user', 'handle', 'account', 'instagram')
+
+def normalize_username(value):
+    """
+    Function to clean a username from a list (handle, @handle or profile url), None if it isn't a valid username
+    """
+    value = (value or '').strip()
+    url_match = PROFILE_URL.search(value)
+    if url_match:
+        value = url_match.group(1)
+    username = value.lstrip('@').strip().lower()
+    return username if USERNAME_PATTERN.match(username) else None
+
+def iter_csv_usernames(f):
+    """
+    Function to read usernames from a CSV, from a username-like column if there is a header, else the first column
+    """
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [column.strip().lower() for column in header]
+    index = next((columns.index(name) for name in CSV_USERNAME_COLUMNS if name in columns), None)
+    if index is None:
+        # No header row, the first line is data
+        index = 0
+        yield header[0] if header else ''
+    for row in reader:
+        if len(row) > index:
+            yield row[index]
+
+def iter_text_usernames(f):
+    """
+    Function to read usernames from a text list: similar-accounts dumps, one handle per line or profile urls
+    """
+    for line in f:
+        dump_match = DUMP_USERNAME_LINE.match(line)
+        if dump_match:
+            yield dump_match.group(1)
+        elif DUMP_OTHER_LINE.match(line) or not line.strip():
+            continue
+        else:
+            # Plain lists may still separate handles with commas or spaces
+            yield from re.split(r'[\s,;]+', line.strip())
+
+def iter_usernames(path):
+    """
+    Function to stream the valid, normalized usernames of a list file, one at a time
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        values = iter_csv_usernames(f) if path.lower().endswith('.csv') else iter_text_usernames(f)
+        for value in values:
+            username = normalize_username(value)
+            if username:
+                yield username
+
+def fetch_usernames(table):
+    """
+    Function to get the set of lowercase usernames already in a table, fetching only the username field
+    """
+    url = f"{AIRTABLE_API_URL}/{table}"
+    params = {'fields[]': 'username', 'pageSize': 100}
+    usernames = set()
+    while True:
+        response = http_client.get(url, headers=AIRTABLE_HEADERS, params=params)
+        response.raise_for_status()
+        data = response.json()
+        for record in data.get('records', []):
+            username = record.get('fields', {}).get('username')
+            if username:
+                usernames.add(username.strip().lstrip('@').lower())
+        if 'offset' not in data:
+            return usernames
+        params['offset'] = data['offset']
+
+def create_target_batch(records):
+    """
+    Function to create up to 10 target records, returning True on success
+    """
+    url = f"{AIRTABLE_API_URL}/{TARGETS_TABLE}"
+    try:
+        response = http_client.post(url, headers=AIRTABLE_HEADERS, json={"records": records})
+        response.raise_for_status()
+        return True
+    except requests.exceptions.RequestException as e:
+        print(f"Error creating target records batch: {e}")
+        if hasattr(e.response, 'text'):
+            print(f"Response text: {e.response.text}")
+        return False
+
+def import_targets(paths, source=None, dry_run=False):
+    """
+    Function to add every new username from the list files to the Targets table
+    Usernames already in Targets or Network (or earlier in the lists) are skipped
+    Returns a dict of read / duplicate / created counts
+    """
+    print("Loading existing Targets and Network usernames")
+    known = fetch_usernames(TARGETS_TABLE) | fetch_usernames(NETWORK_TABLE)
+    print(f"{len(known)} usernames already known")
+
+    counts = {'read': 0, 'duplicate': 0, 'created': 0}
+    writer = None if dry_run else BatchWriter(create_target_batch, label='target records')
+    usernames = ((username, source or f"Import: {os.path.basename(path)}") for path in paths for username in iter_usernames(path))
+    for username, record_source in usernames:
+        counts['read'] += 1
+        if username in known:
+            counts['duplicate'] += 1
+            continue
+        known.add(username)
+        if not writer:
+            counts['created'] += 1
+        elif not writer.submit([{"fields": {"username": username, "Processed": False, "Source": record_source}}]):
+            break
+
+    if writer:
+        if not writer.close():
+            print("Stopped after a failed write, re-run the import to add the rest (created targets are skipped)")
+        counts['created'] = writer.written
+    action = "Would create" if dry_run else "Created"
+    print(f"Read {counts['read']} usernames, {counts['duplicate']} already known. {action} {counts['created']} targets")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add usernames from similar-accounts dumps, username lists or CSVs to the Targets table")
+    parser.add_argument('files', nargs='+', help="text dumps (e.g. similar_to_*.txt), one username per line, or .csv files")
+    parser.add_argument('--source', help="Source field for the new targets (default: Import: <file name>)")
+    parser.add_argument('--dry-run', action='store_true', help="count the new usernames without creating anything")
+    args = parser.parse_args()
+    import_targets(args.files, source=args.source, dry_run=args.dry_run)
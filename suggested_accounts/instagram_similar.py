@@ -1,9 +1,20 @@
+import argparse
 import requests
 import time
 import json
 import os
+import sys
 from dotenv import load_dotenv
 
+# Shared service modules (HTTP client, RapidAPI key pool etc.) live in the locations folder
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "locations"))
+from rapidapi_keys import rapidapi_get
+import http_client
+from planner import Plan, add_plan_arguments, airtable_read_calls
+from endpoint_stats import get_stat
+from account_registry import get_registry, NETWORK
+from profiling import add_profile_argument, mark_stage, profile_run
+
 # Load environment variables
 load_dotenv()
 
@@ -29,13 +40,8 @@ def get_similar_accounts(username):
     
     querystring = {"username_or_id_or_url": username}
     
-    headers = {
-        "x-rapidapi-key": os.getenv('RAPIDAPI_KEY'),
-        "x-rapidapi-host": os.getenv('RAPIDAPI_HOST')
-    }
-    
     try:
-        response = requests.get(url, headers=headers, params=querystring)
+        response = rapidapi_get(url, params=querystring, hedge=True)
         
         if response.status_code == 404:
             print(f"\nNo similar accounts found for @{username}")
@@ -77,7 +83,7 @@ def get_similar_accounts(username):
     
     except requests.exceptions.RequestException as e:
         print(f"Error fetching data: {e}")
-        if hasattr(e, 'response'):
+        if getattr(e, 'response', None) is not None:
             print(f"Response Status Code: {e.response.status_code}")
             print(f"Response Headers: {e.response.headers}")
             print(f"Response Body: {e.response.text}")
@@ -101,7 +107,7 @@ def fetch_unprocessed_targets(offset=None, all_records=None):
     if offset:
         query_params['offset'] = offset
 
-    response = requests.get(url, headers=headers, params=query_params)
+    response = http_client.get(url, headers=headers, params=query_params)
     response.raise_for_status()  # Raises a HTTPError if the status is 4XX, 5XX
     data = response.json()
     
@@ -130,7 +136,7 @@ def fetch_existing_network(username, offset=None, all_records=None):
     if offset:
         query_params['offset'] = offset
 
-    response = requests.get(url, headers=headers, params=query_params)
+    response = http_client.get(url, headers=headers, params=query_params)
     response.raise_for_status()
     data = response.json()
     
@@ -162,7 +168,7 @@ def create_result_record(account_data, source_username, record_id):
     }
     
     try:
-        response = requests.post(url, headers=AIRTABLE_HEADERS, json=payload)
+        response = http_client.post(url, headers=AIRTABLE_HEADERS, json=payload)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
@@ -180,16 +186,46 @@ def mark_as_processed(record_id):
     }
     
     try:
-        response = requests.patch(url, headers=AIRTABLE_HEADERS, json=payload)
+        response = http_client.patch(url, idempotent=True, headers=AIRTABLE_HEADERS, json=payload)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
         print(f"Error marking record as processed: {e}")
         return False
 
-def process_airtable_accounts():
+def plan_airtable_accounts(unprocessed_records):
+    """
+    Function to estimate the calls needed to fetch similar accounts for every target
+    """
+    plan = Plan('process_airtable_accounts')
+    plan.add_fixed({'airtable': airtable_read_calls(len(unprocessed_records))})
+
+    similar_per_target = round(get_stat('similar_accounts', 'page_size'))
+    for record in unprocessed_records:
+        username = record.get('fields', {}).get('username')
+        if not username:
+            continue
+        plan.add_item(username, record, {
+            'similar_accounts': 1,
+            # a network lookup and a create per similar account, then marking the target as processed
+            'airtable': similar_per_target * 2 + 1
+        })
+
+    plan.add_note("each network lookup is counted as one page, it reads the whole Network table per similar account")
+    return plan
+
+def process_airtable_accounts(plan_only=False, budget=None):
+    mark_stage('fetch targets')
     unprocessed_records = fetch_unprocessed_targets()
+
+    if plan_only or budget is not None:
+        plan = plan_airtable_accounts(unprocessed_records)
+        if plan_only:
+            plan.print_summary(budget)
+            return
+        unprocessed_records = plan.fit_to_budget(budget)
     
+    mark_stage('similar accounts')
     for record in unprocessed_records:
         username = record.get('fields', {}).get('username')
         record_id = record.get('id')
@@ -199,9 +235,21 @@ def process_airtable_accounts():
             similar_accounts = get_similar_accounts(username)
             
             if similar_accounts:
+                registry = get_registry()
                 for account in similar_accounts:
+                    # The registry knows the accounts we've already added, which saves a full Network table scan
+                    if registry.is_referenced(NETWORK, account['pk_id']):
+                        continue
                     if not fetch_existing_network(account['username']):
                         if create_result_record(account, username, record_id):
+                            registry.record_accounts([{
+                                'pk_id': account['pk_id'],
+                                'username': account['username'],
+                                'full_name': account['full_name'],
+                                'pfp_url': account['pfp_url'],
+                                'is_private': account['private'],
+                                'is_verified': account['verified']
+                            }], NETWORK, source=record_id)
                             print(f"Added similar account: {account['username']}")
                 
                 # Mark source record as processed
@@ -214,4 +262,9 @@ def process_airtable_accounts():
             print(f"Completed processing {username}")
 
 if __name__ == "__main__":
-    process_airtable_accounts()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fetch similar accounts for each target into the Network table")
+    add_plan_arguments(parser)
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    with profile_run('process_airtable_accounts', args.profile):
+        process_airtable_accounts(plan_only=args.plan, budget=args.budget)
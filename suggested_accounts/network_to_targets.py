@@ -1,7 +1,17 @@
+import argparse
 import requests
 import os
+import sys
 from dotenv import load_dotenv
 
+# Shared service modules (HTTP client, planner etc.) live in the locations folder
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "locations"))
+import http_client
+from planner import Plan, add_plan_arguments, airtable_read_calls
+from profiling import add_profile_argument, mark_stage, profile_run
+from account_registry import NETWORK
+from lead_scoring import score_accounts, sync_lead_scores
+
 # Load environment variables
 load_dotenv()
 
@@ -18,34 +28,31 @@ AIRTABLE_HEADERS = {
     "Content-Type": "application/json"
 }
 
+# lead_qualified and lead_score are written by `python lead_scoring.py --write` (the fields must exist in the Network table)
+QUALIFIED_FORMULA = os.getenv('NETWORK_QUALIFIED_FORMULA', "AND({lead_qualified}, NOT({converted_to_target}))")
+
 def fetch_qualified_network_accounts(offset=None, all_records=None):
     """
     Fetch network accounts that meet certain criteria:
-    - Has follower count
-    - Matches your target demographic
+    - Qualified by lead scoring (follower range, demographic, score threshold - see lead_scoring.py)
     - Hasn't been converted to target yet
+    Best leads come first, so a budget-limited run converts those
     """
     if all_records is None:
         all_records = []
         
     url = f"{AIRTABLE_API_URL}/{NETWORK_TABLE}"
     
-    # # Customize this formula based on your criteria
-    # formula = "AND(" + \
-    #          "{follower_count} > 1000," + \
-    #          "{follower_count} < 100000," + \
-    #          "{converted_to_target} != 1," + \ 
-    #          "{is_business} = 1" + \
-    #          ")"
-
-    ### add filtered view from airtable instead of formula in the code - decide on filter options ###
-    
-    params = {}
+    params = {
+        'filterByFormula': QUALIFIED_FORMULA,
+        'sort[0][field]': 'lead_score',
+        'sort[0][direction]': 'desc'
+    }
     if offset:
         params['offset'] = offset
 
     try:
-        response = requests.get(url, headers=AIRTABLE_HEADERS, params=params)
+        response = http_client.get(url, headers=AIRTABLE_HEADERS, params=params)
         response.raise_for_status()
         data = response.json()
         
@@ -74,7 +81,7 @@ def create_target_record(account_data):
     }
     
     try:
-        response = requests.post(url, headers=AIRTABLE_HEADERS, json=payload)
+        response = http_client.post(url, headers=AIRTABLE_HEADERS, json=payload)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
@@ -92,16 +99,47 @@ def mark_as_converted(record_id):
     }
     
     try:
-        response = requests.patch(url, headers=AIRTABLE_HEADERS, json=payload)
+        response = http_client.patch(url, idempotent=True, headers=AIRTABLE_HEADERS, json=payload)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
         print(f"Error marking as converted: {e}")
         return False
 
-def convert_network_to_targets():
+def plan_network_to_targets(qualified_accounts):
+    """
+    Function to estimate the calls needed to convert every qualified account
+    """
+    plan = Plan('convert_network_to_targets', budget_service='airtable')
+    plan.add_fixed({'airtable': airtable_read_calls(len(qualified_accounts))})
+
+    for account in qualified_accounts:
+        username = account.get('fields', {}).get('username')
+        if not username:
+            continue
+        # a target create and a converted mark per account
+        plan.add_item(username, account, {'airtable': 2})
+
+    return plan
+
+def convert_network_to_targets(plan_only=False, budget=None, rescore=False):
+    if rescore:
+        # Refresh the Network table's lead scores from the registry so newly fetched details count
+        mark_stage('score leads')
+        score_accounts(NETWORK)
+        sync_lead_scores(NETWORK)
+
+    mark_stage('fetch accounts')
     qualified_accounts = fetch_qualified_network_accounts()
+
+    if plan_only or budget is not None:
+        plan = plan_network_to_targets(qualified_accounts)
+        if plan_only:
+            plan.print_summary(budget)
+            return
+        qualified_accounts = plan.fit_to_budget(budget)
     
+    mark_stage('convert')
     for account in qualified_accounts:
         username = account.get('fields', {}).get('username')
         record_id = account.get('id')
@@ -118,4 +156,10 @@ def convert_network_to_targets():
             print(f"Completed processing {username}")
 
 if __name__ == "__main__":
-    convert_network_to_targets()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Turn qualified Network accounts into new targets")
+    add_plan_arguments(parser, budget_unit='Airtable')
+    add_profile_argument(parser)
+    parser.add_argument('--score', action='store_true', help="re-score the Network accounts and write the scores before converting")
+    args = parser.parse_args()
+    with profile_run('convert_network_to_targets', args.profile):
+        convert_network_to_targets(plan_only=args.plan, budget=args.budget, rescore=args.score)